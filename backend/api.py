@@ -12,7 +12,7 @@ from typing import Literal, Optional
 
 from fastapi import Depends, FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 
@@ -25,6 +25,7 @@ from bot.goal_manager import (
 )
 from bot.memory.database import (
     add_webapp_event,
+    close_db,
     create_daily_message,
     create_user,
     delete_user_completely,
@@ -32,12 +33,25 @@ from bot.memory.database import (
     get_db,
     get_goal_steps,
     get_patterns,
+    get_pool_stats,
     get_user,
     init_db,
 )
 from bot.memory.profile_manager import get_profile
+from bot.update_processor import get_update_stats
 from bot.prompts.memory_prompts import AFFIRMATION_BANK, AFFIRMATION_PROMPT
-from shared.llm_client import LLMError, call_gpt
+from shared.llm_client import (
+    LLMError,
+    call_gpt,
+    get_breaker_stats,
+    get_cache_stats,
+    get_hedge_stats,
+    get_scheduler_stats,
+)
+from shared import metrics
+from shared.degradation import get_degradation_stats
+from shared.llm_transport import get_transport_stats
+from shared.tracing import get_step_percentiles, get_trace_stats, recent_traces
 
 logger = logging.getLogger(__name__)
 
@@ -84,6 +98,8 @@ async def lifespan(app: FastAPI):
     await init_db()
     logger.info("Backend API: БД инициализирована")
     yield
+    await close_db()
+    logger.info("Backend API: пул БД закрыт")
 
 
 app = FastAPI(title="AI Наставник API", lifespan=lifespan)
@@ -205,7 +221,31 @@ async def health():
 
     uptime_s = round(time.monotonic() - _START_TIME, 1)
     status = "ok" if db_ok else "degraded"
-    return {"status": status, "db": db_ok, "uptime_s": uptime_s}
+    return {
+        "status": status,
+        "db": db_ok,
+        "uptime_s": uptime_s,
+        "db_pool": get_pool_stats(),
+        "updates": get_update_stats(),
+        "llm_hedge": get_hedge_stats(),
+        "llm_scheduler": get_scheduler_stats(),
+        "llm_breakers": get_breaker_stats(),
+        "llm_cache": get_cache_stats(),
+        "llm_transport": get_transport_stats(),
+        "traces": get_trace_stats(),
+        "degradation": get_degradation_stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics(key: str = ""):
+    """Метрики в формате Prometheus. Защита по ADMIN_KEY (params: key в scrape_config)."""
+    from shared.config import ADMIN_KEY
+    if not ADMIN_KEY or key != ADMIN_KEY:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
 
 
 @app.get("/api/user", response_model=UserResponse)
@@ -491,6 +531,24 @@ async def download_db(key: str = ""):
     )
 
 
+@app.get("/api/admin/traces")
+async def admin_traces(key: str = "", limit: int = 50, persisted: bool = False):
+    """Последние трассы ходов и перцентили по шагам. Защита по ADMIN_KEY.
+
+    persisted=true — трассы из message_traces (TRACE_PERSIST=1) вместо буфера.
+    """
+    from shared.config import ADMIN_KEY
+    if not ADMIN_KEY or key != ADMIN_KEY:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    limit = max(1, min(limit, 500))
+    if persisted:
+        from bot.memory.database import get_message_traces
+        traces = await get_message_traces(limit)
+    else:
+        traces = recent_traces(limit)
+    return {"steps": get_step_percentiles(), "traces": traces}
+
+
 # ---------------------------------------------------------------------------
 # Статика Mini App (SPA fallback) — ДОЛЖЕН БЫТЬ ПОСЛЕДНИМ
 # ---------------------------------------------------------------------------
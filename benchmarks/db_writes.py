@@ -0,0 +1,90 @@
+"""Бенчмарк hot-path записей: messages/sec до и после group commit.
+
+N симулированных пользователей параллельно делают ходы диалога
+(add_message user -> mark_message_processed -> add_message assistant ->
+update_user -> add_emotion) во временной SQLite.
+
+Режим "before": DB_GROUP_COMMIT_MS=0 (COMMIT на каждую запись).
+Режим "after": group commit с окном DB_GROUP_COMMIT_MS (по умолчанию 2 мс).
+
+Запуск:
+    python -m benchmarks.db_writes --users 200 --turns 5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bot.memory import database  # noqa: E402
+
+
+async def _user_turns(telegram_id: int, turns: int, base_msg_id: int) -> None:
+    for i in range(turns):
+        await database.add_message(telegram_id, "user", f"Сообщение {i}")
+        await database.mark_message_processed(base_msg_id + i, telegram_id)
+        await database.add_message(
+            telegram_id, "assistant", "Ответ Евы", response_latency_ms=100,
+        )
+        await database.update_user(telegram_id, messages_total=i + 1)
+        await database.add_emotion(telegram_id, "радость")
+
+
+async def _run(mode: str, users: int, turns: int, window_ms: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        database.DB_GROUP_COMMIT_MS = 0 if mode == "before" else window_ms
+        await database.init_db()
+        for u in range(users):
+            await database.create_user(1_000_000 + u, name=f"u{u}")
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            _user_turns(1_000_000 + u, turns, (u + 1) * 10_000)
+            for u in range(users)
+        ))
+        elapsed = time.perf_counter() - t0
+        stats = database.get_pool_stats()
+        await database.close_db()
+
+    messages = users * turns * 2
+    return {
+        "mode": mode,
+        "users": users,
+        "turns": turns,
+        "writes": users * turns * 5,
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(messages / elapsed, 1),
+        "turns_per_s": round(users * turns / elapsed, 1),
+        "batches": stats.get("batches", 0),
+        "writes_per_batch": stats.get("writes_per_batch", 0.0),
+        "pool_wait_avg_ms": stats.get("wait_avg_ms", 0.0),
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--window-ms", type=float, default=database.DB_GROUP_COMMIT_MS or 2)
+    args = parser.parse_args()
+
+    report = [
+        await _run(mode, args.users, args.turns, args.window_ms)
+        for mode in ("before", "after")
+    ]
+    before, after = report
+    print(json.dumps({
+        "runs": report,
+        "speedup": round(after["messages_per_s"] / before["messages_per_s"], 2),
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
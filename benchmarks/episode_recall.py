@@ -0,0 +1,139 @@
+"""Бенчмарк поиска эпизодов: recall BM25 относительно LLM-выбора.
+
+Берёт записанные разговоры из БД Евы (сообщения пользователя, к моменту
+которых у неё уже были эпизоды) и для каждого сообщения сравнивает:
+    reference — текущий LLM-выбор (GPT по заголовкам, EPISODE_SELECTION_PROMPT);
+    bm25      — локальный episode_index, top-k.
+
+recall@k = |bm25 ∩ reference| / |reference| (по сообщениям с непустым reference).
+Плюс латентность обоих вариантов (p50/p95, мс).
+
+Reference-выборы можно сохранить (--save-cases) и переиспользовать без
+API-ключа (--cases).
+
+Запуск:
+    python -m benchmarks.episode_recall --db nastavnik.db --max-messages 300
+    python -m benchmarks.episode_recall --db nastavnik.db --cases cases.jsonl
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bot.memory import database, episode_index  # noqa: E402
+from bot.memory.episode_manager import _llm_select  # noqa: E402
+
+
+def _load_recorded(db_path: str, max_messages: int) -> list[dict]:
+    """Сообщения пользователей + заголовки эпизодов, существовавших на тот момент."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    episodes: dict[int, list[dict]] = {}
+    for r in conn.execute(
+        "SELECT id, telegram_id, title, created_at FROM episodes ORDER BY created_at DESC"
+    ):
+        episodes.setdefault(r["telegram_id"], []).append(dict(r))
+
+    cases = []
+    for r in conn.execute(
+        """SELECT telegram_id, content, created_at FROM messages
+           WHERE role = 'user' ORDER BY created_at DESC"""
+    ):
+        headers = [
+            {"id": e["id"], "title": e["title"], "created_at": e["created_at"]}
+            for e in episodes.get(r["telegram_id"], [])
+            if e["created_at"] < r["created_at"]
+        ]
+        if not headers:
+            continue
+        cases.append({
+            "telegram_id": r["telegram_id"],
+            "message": r["content"],
+            "headers": headers,
+        })
+        if len(cases) >= max_messages:
+            break
+    conn.close()
+    return cases
+
+
+def _pct(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+
+
+async def _run(cases: list[dict], k: int, need_reference: bool) -> dict:
+    llm_ms: list[float] = []
+    bm25_ms: list[float] = []
+    recalls: list[float] = []
+    both_empty = 0
+
+    for case in cases:
+        tid, msg, headers = case["telegram_id"], case["message"], case["headers"]
+        if need_reference:
+            t0 = time.perf_counter()
+            case["reference"] = await _llm_select(tid, msg, headers, k)
+            llm_ms.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        hits = await episode_index.search(tid, msg, headers)
+        bm25_ms.append((time.perf_counter() - t0) * 1000)
+        got = {ep_id for ep_id, _ in hits[:k]}
+
+        ref = set(case["reference"])
+        if ref:
+            recalls.append(len(got & ref) / len(ref))
+        elif not got:
+            both_empty += 1
+
+    return {
+        "messages": len(cases),
+        "k": k,
+        "with_reference": len(recalls),
+        "recall_at_k": round(sum(recalls) / len(recalls), 3) if recalls else None,
+        "both_empty": both_empty,
+        "bm25_ms": {"p50": _pct(bm25_ms, 0.5), "p95": _pct(bm25_ms, 0.95)},
+        "llm_ms": {"p50": _pct(llm_ms, 0.5), "p95": _pct(llm_ms, 0.95)} if llm_ms else None,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--db", default=database.DB_PATH)
+    parser.add_argument("--max-messages", type=int, default=300)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--cases", help="jsonl с сохранёнными reference-выборами")
+    parser.add_argument("--save-cases", help="куда сохранить reference-выборы (jsonl)")
+    args = parser.parse_args()
+
+    # episode_index догружает тексты эпизодов из этой БД
+    database.DB_PATH = args.db
+
+    if args.cases:
+        with open(args.cases, encoding="utf-8") as f:
+            cases = [json.loads(line) for line in f if line.strip()]
+    else:
+        cases = _load_recorded(args.db, args.max_messages)
+
+    report = await _run(cases, args.k, need_reference=not args.cases)
+    await database.close_db()
+
+    if args.save_cases:
+        with open(args.save_cases, "w", encoding="utf-8") as f:
+            for case in cases:
+                f.write(json.dumps(case, ensure_ascii=False) + "\n")
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,395 @@
+"""Нагрузочный стенд: сколько одновременных пользователей держит один инстанс.
+
+N синтетических пользователей во временной SQLite ведут многодневные
+сценарные разговоры через bot.session_manager.process_message. LLM —
+synthetic-транспорт (shared.llm_transport) с заданной латентностью,
+поэтому работают настоящие планировщик, breaker'ы и кэш. Параллельно
+трафику крутятся задачи планировщика: run_full_memory_update,
+send_daily_messages, check_pending_feedback.
+
+После каждого «дня» все временные метки в БД сдвигаются на сутки назад
+и задачи планировщика проходят ещё раз («ночь») — так они видят паузу
+пользователей, а следующий день начинается с возврата после перерыва.
+
+Лимиты провайдеров (CLAUDE_RPM, OPENAI_TPM, ...) берутся из env, как в проде:
+ожидание в их очередях видно в llm_scheduler и в шаге llm_dialog.
+
+Отчёт (JSON, ключи отсортированы — удобно diff'ать прогоны):
+    throughput      — ходов/сек, сообщений/сек;
+    steps           — p50/p95/p99/max по шагам конвейера и задачам (мс);
+    db_pool         — ожидание соединений пула (lock waits);
+    event_loop_lag  — задержка event loop (мс);
+    max_users_within_slo — наибольшее N, где p95 ответа <= --slo-p95-ms.
+
+Запуск:
+    python -m benchmarks.load --users 20,50,100 --days 2 --turns 6
+    python -m benchmarks.load --users 50 --llm-latency-ms 2500 --out run.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.setdefault("LLM_TRANSPORT", "synthetic")
+
+from bot import daily_messenger, session_manager  # noqa: E402
+from bot.analytics import feedback_collector  # noqa: E402
+from bot.memory import database, full_memory_update  # noqa: E402
+from shared import llm_client, llm_transport  # noqa: E402
+
+# Сценарий: сообщения пользователя по дням (у каждого — свой сдвиг по кругу)
+_SCRIPT = [
+    [
+        "Привет, меня зовут Аня, мне 29",
+        "Сегодня опять поругалась с мамой из-за работы",
+        "Она считает, что я должна остаться в банке",
+        "А я хочу уйти в дизайн, но страшно",
+        "Наверное, я просто боюсь её разочаровать",
+        "Спасибо, стало чуть легче",
+        "Ладно, пойду спать",
+    ],
+    [
+        "Привет, это снова я",
+        "Вчера думала над нашим разговором",
+        "Решила записаться на курс по дизайну",
+        "Но муж говорит, что это несерьёзно",
+        "Я устала от всего этого, честно",
+        "Как мне с ним поговорить спокойно?",
+        "Попробую завтра вечером",
+    ],
+    [
+        "Поговорила с мужем!",
+        "Он неожиданно поддержал",
+        "Теперь хочу поставить цель — закончить курс за 3 месяца",
+        "С чего начать?",
+        "Мне нравится идея маленьких шагов",
+        "Спасибо тебе",
+    ],
+]
+
+# (модуль, функция, шаг отчёта) — обёртки с замером времени
+_STEPS = [
+    (session_manager, "is_message_processed", "idempotency"),
+    (session_manager, "detect_crisis", "crisis"),
+    (session_manager, "_save_batch", "save_batch"),
+    (session_manager, "build_context", "context"),
+    (session_manager, "get_recent_messages", "history"),
+    (session_manager, "_call_dialog", "llm_dialog"),
+    (session_manager, "_run_turn", "turn"),
+    (session_manager, "_mini_memory_update", "mini_update"),
+    (session_manager, "_check_phase_transition", "phase_check"),
+    (session_manager, "update_single_user", "full_update_user"),
+    (full_memory_update, "update_single_user", "full_update_user"),
+]
+
+_BASE_TID = 5_000_000
+
+
+def _pct(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+
+
+def _summary(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50": _pct(values, 0.50),
+        "p95": _pct(values, 0.95),
+        "p99": _pct(values, 0.99),
+        "max": round(max(values), 2) if values else 0.0,
+    }
+
+
+class _Recorder:
+    """Замеры по шагам: подменяет функции модулей на обёртки с таймером."""
+
+    def __init__(self) -> None:
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self._patched: list[tuple[object, str, object]] = []
+
+    def add(self, step: str, ms: float) -> None:
+        self.samples[step].append(ms)
+
+    def wrap(self, module, name: str, step: str) -> None:
+        orig = getattr(module, name)
+
+        @functools.wraps(orig)
+        async def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await orig(*args, **kwargs)
+            finally:
+                self.add(step, (time.perf_counter() - t0) * 1000)
+
+        setattr(module, name, timed)
+        self._patched.append((module, name, orig))
+
+    def restore(self) -> None:
+        for module, name, orig in reversed(self._patched):
+            setattr(module, name, orig)
+        self._patched.clear()
+
+
+class _FakeBot:
+    """Telegram-бот для задач планировщика: только send_message."""
+
+    def __init__(self, latency_ms: float) -> None:
+        self.latency_ms = latency_ms
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency_ms / 1000)
+        self.sent += 1
+        return SimpleNamespace(message_id=self.sent, chat_id=chat_id, text=text)
+
+
+async def _loop_lag(samples: list[float], interval: float = 0.05) -> None:
+    """Задержка event loop: насколько позже обещанного просыпается sleep."""
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, (loop.time() - t0 - interval) * 1000))
+
+
+# ---------------------------------------------------------------------------
+# Сдвиг времени между днями
+# ---------------------------------------------------------------------------
+
+_TIME_COLUMNS = {
+    "users": ("created_at", "last_message_at", "last_full_update_at", "last_automated_msg_at"),
+    "messages": ("created_at",),
+    "episodes": ("created_at", "session_start", "session_end"),
+    "daily_messages": ("created_at", "sent_at"),
+    "session_feedback": ("created_at", "session_end"),
+    "pending_facts": ("created_at",),
+}
+
+
+def _shift(value: str | None, delta: timedelta) -> str | None:
+    """Сдвиг метки с сохранением её формата (ISO с 'T' или SQLite-формат)."""
+    if not value:
+        return value
+    dt = datetime.fromisoformat(value) - delta
+    return dt.isoformat() if "T" in value else dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def _advance_day() -> None:
+    """«Прошли сутки»: все метки в БД на день назад."""
+    delta = timedelta(days=1)
+    async with database.get_db() as db:
+        for table, columns in _TIME_COLUMNS.items():
+            cols = ", ".join(columns)
+            async with db.execute(f"SELECT rowid, {cols} FROM {table}") as cur:
+                rows = await cur.fetchall()
+            sets = ", ".join(f"{c} = ?" for c in columns)
+            await db.executemany(
+                f"UPDATE {table} SET {sets} WHERE rowid = ?",
+                [(*(_shift(v, delta) for v in row[1:]), row[0]) for row in rows],
+            )
+        await db.commit()
+
+
+# ---------------------------------------------------------------------------
+# Прогон одного уровня нагрузки
+# ---------------------------------------------------------------------------
+
+
+def _reset_state() -> None:
+    """Модульное состояние между прогонами (как clear_module_state в e2e)."""
+    for registry in (
+        session_manager._user_locks,
+        session_manager._rate_counters,
+        session_manager._consecutive_errors,
+        session_manager._inboxes,
+        session_manager._inflight,
+        full_memory_update._error_counts,
+        full_memory_update._update_locks,
+        llm_client._breakers,
+        llm_client._schedulers,
+    ):
+        registry.clear()
+    llm_client._response_cache.clear()
+
+
+async def _user(tid: int, day: int, turns: int, think_s: float,
+                rec: _Recorder, counters: dict) -> None:
+    script = _SCRIPT[(day + tid) % len(_SCRIPT)]
+    for i in range(turns):
+        await asyncio.sleep(random.expovariate(1 / think_s) if think_s > 0 else 0)
+        text = script[i % len(script)]
+        message_id = (tid - _BASE_TID) * 100_000 + day * 1000 + i
+        t0 = time.perf_counter()
+        reply = await session_manager.process_message(tid, message_id, text, f"u{tid}")
+        rec.add("reply", (time.perf_counter() - t0) * 1000)
+        counters["messages"] += 1
+        if reply is None:
+            counters["dropped"] += 1
+
+
+async def _jobs_once(bot: _FakeBot, rec: _Recorder) -> None:
+    """Один проход задач планировщика (одновременно, как в APScheduler)."""
+    context = SimpleNamespace(bot=bot)
+    jobs = {
+        "job.full_memory_update": full_memory_update.run_full_memory_update,
+        "job.daily_messages": lambda: daily_messenger.send_daily_messages(context),
+        "job.pending_feedback": lambda: feedback_collector.check_pending_feedback(context),
+    }
+
+    async def timed(step, job):
+        t0 = time.perf_counter()
+        try:
+            await job()
+        finally:
+            rec.add(step, (time.perf_counter() - t0) * 1000)
+
+    await asyncio.gather(*(timed(step, job) for step, job in jobs.items()))
+
+
+async def _jobs(bot: _FakeBot, interval_s: float, rec: _Recorder, stop: asyncio.Event) -> None:
+    """Задачи планировщика параллельно трафику, как APScheduler в run.py."""
+    while not stop.is_set():
+        await _jobs_once(bot, rec)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval_s)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _drain(keep: set, timeout: float) -> None:
+    """Дождаться фоновых задач ходов (мини-обновления, фазы, память)."""
+    deadline = time.monotonic() + timeout
+    while (left := deadline - time.monotonic()) > 0:
+        pool = database._pool
+        writer = pool._writer_task if pool is not None else None
+        background = asyncio.all_tasks() - keep - {asyncio.current_task(), writer}
+        if not background:
+            return
+        await asyncio.wait(background, timeout=left)
+
+
+async def _run(users: int, args: argparse.Namespace) -> dict:
+    _reset_state()
+    rec = _Recorder()
+    for module, name, step in _STEPS:
+        rec.wrap(module, name, step)
+    counters = {"messages": 0, "dropped": 0}
+    lag: list[float] = []
+    bot = _FakeBot(args.telegram_latency_ms)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "load.db")
+        await database.init_db()
+        for u in range(users):
+            await database.create_user(_BASE_TID + u, name=f"u{u}")
+
+        # Задачи пула БД и прочее долгоживущее — не фон ходов
+        preexisting = asyncio.all_tasks()
+        lag_task = asyncio.create_task(_loop_lag(lag))
+        stop = asyncio.Event()
+        jobs_task = asyncio.create_task(_jobs(bot, args.jobs_interval_s, rec, stop))
+        t0 = time.perf_counter()
+        try:
+            for day in range(args.days):
+                await asyncio.gather(*(
+                    _user(_BASE_TID + u, day, args.turns, args.think_s, rec, counters)
+                    for u in range(users)
+                ))
+                # Ночь: сутки прошли, задачи видят паузу пользователей
+                await _advance_day()
+                await _jobs_once(bot, rec)
+            elapsed = time.perf_counter() - t0
+            await _drain(preexisting | {lag_task, jobs_task}, args.drain_s)
+        finally:
+            stop.set()
+            await jobs_task
+            lag_task.cancel()
+            rec.restore()
+            pool = database.get_pool_stats()
+            await database.close_db()
+
+    reply = rec.samples.get("reply", [])
+    return {
+        "users": users,
+        "elapsed_s": round(elapsed, 3),
+        "throughput": {
+            "messages": counters["messages"],
+            "dropped": counters["dropped"],
+            "messages_per_s": round(counters["messages"] / elapsed, 2) if elapsed else 0.0,
+            "turns_per_s": round(len(rec.samples.get("turn", [])) / elapsed, 2) if elapsed else 0.0,
+            "telegram_sends": bot.sent,
+        },
+        "within_slo": _pct(reply, 0.95) <= args.slo_p95_ms,
+        "steps": {step: _summary(values) for step, values in sorted(rec.samples.items())},
+        "db_pool": {
+            k: pool.get(k, 0)
+            for k in ("acquisitions", "wait_avg_ms", "wait_max_ms", "batches", "writes_per_batch")
+        },
+        "event_loop_lag": _summary(lag),
+        "llm_scheduler": llm_client.get_scheduler_stats()["classes"],
+        "llm_cache": {
+            site: st["hit_rate"] for site, st in llm_client.get_cache_stats()["sites"].items()
+        },
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", default="20,50", help="уровни нагрузки через запятую")
+    parser.add_argument("--days", type=int, default=2)
+    parser.add_argument("--turns", type=int, default=6, help="сообщений на пользователя в день")
+    parser.add_argument("--think-s", type=float, default=3.0, help="средняя пауза между сообщениями")
+    parser.add_argument("--llm-latency-ms", type=float, default=llm_transport.LLM_SYNTHETIC_LATENCY_MS)
+    parser.add_argument("--llm-jitter", type=float, default=llm_transport.LLM_SYNTHETIC_JITTER)
+    parser.add_argument("--telegram-latency-ms", type=float, default=50)
+    parser.add_argument("--jobs-interval-s", type=float, default=5.0)
+    parser.add_argument("--drain-s", type=float, default=30.0)
+    parser.add_argument("--slo-p95-ms", type=float, default=8000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="куда записать отчёт (по умолчанию stdout)")
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+
+    if llm_client.LLM_TRANSPORT == "live":
+        parser.error("LLM_TRANSPORT=live: стенд не ходит в настоящие API")
+    random.seed(args.seed)
+    llm_transport.LLM_SYNTHETIC_LATENCY_MS = args.llm_latency_ms
+    llm_transport.LLM_SYNTHETIC_JITTER = args.llm_jitter
+    # Тихие часы зависят от времени запуска — для стенда выключены
+    feedback_collector._is_quiet_hours = lambda: False
+
+    runs = [await _run(int(n), args) for n in args.users.split(",")]
+    within = [r["users"] for r in runs if r["within_slo"]]
+    report = {
+        "config": {
+            k: v for k, v in vars(args).items() if k not in ("out", "log_level")
+        } | {"transport": llm_client.LLM_TRANSPORT},
+        "runs": runs,
+        "max_users_within_slo": max(within) if within else 0,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,12 +1,14 @@
 """Мониторинг аномалий с дедупликацией алертов."""
 from __future__ import annotations
 
+import asyncio
 import logging
 import time
 from datetime import datetime, timedelta, timezone
 from typing import Any
 
 from shared.config import ALERT_THRESHOLDS, OWNER_TELEGRAM_ID
+from shared.llm_client import CIRCUIT_CLOSED, CIRCUIT_OPEN, add_breaker_listener
 
 logger = logging.getLogger(__name__)
 MOSCOW_TZ = timezone(timedelta(hours=3))
@@ -17,6 +19,7 @@ _DEDUP_WINDOWS: dict[str, int] = {
     "latency_critical_ms": 1800,   # 30 мин
     "consecutive_empty_context": 900,  # 15 мин
     "consecutive_errors": 900,     # 15 мин
+    # circuit_<state>:<provider>:<model> — по умолчанию 300
 }
 
 
@@ -29,6 +32,19 @@ class Alerter:
     def init(self, bot) -> None:
         """Инициализация Telegram-ботом. Вызвать из post_init в main.py."""
         self._bot = bot
+        add_breaker_listener(self.on_circuit_change)
+
+    def on_circuit_change(self, name: str, state: str, info: dict) -> None:
+        """Колбэк breaker'а LLM: алерт на открытие и на восстановление."""
+        if state != CIRCUIT_OPEN and not (
+            state == CIRCUIT_CLOSED and info.get("from") != CIRCUIT_CLOSED
+        ):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.create_task(self._maybe_send(0, f"circuit_{state}:{name}", info))
 
     async def check(self, telegram_id: int, event: str, value: Any = None) -> None:
         """Проверяет порог и отправляет алерт если превышен."""
@@ -97,6 +97,7 @@ async def generate_steps(goal_id: int, context: str) -> list[GoalStep]:
             messages=[{"role": "user", "content": prompt}],
             max_tokens=500,
             response_format={"type": "json_object"},
+            cache="goal_steps",
         )
         data = json.loads(response)
         steps_raw = data["steps"][:7]
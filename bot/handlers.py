@@ -1,6 +1,9 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import re
+import time
 
 from telegram import (
     Update,
@@ -10,6 +13,7 @@ from telegram import (
 )
 from telegram.ext import ContextTypes
 from telegram.constants import ChatAction
+from telegram.error import BadRequest, RetryAfter, TelegramError
 
 from bot.memory import database
 from bot.memory.database import (
@@ -26,7 +30,7 @@ from bot.memory.database import (
 )
 from bot.session_manager import process_message
 from bot.transcriber import transcribe_voice
-from shared.config import OWNER_TELEGRAM_ID
+from shared.config import OWNER_TELEGRAM_ID, STREAM_EDIT_INTERVAL_S, STREAM_REPLIES
 
 logger = logging.getLogger(__name__)
 
@@ -226,6 +230,109 @@ async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# ---------------------------------------------------------------------------
+# Стриминг ответа: первое предложение сразу, дальше редкие правки
+# ---------------------------------------------------------------------------
+
+# Конец предложения: .!?… (+ закрывающие скобки/кавычки) и пробел
+_SENTENCE_END = re.compile(r"[.!?…][)»\"']*\s")
+# Лимит Telegram 4096; финальный ответ уже обрезан _truncate_response до 4000
+_STREAM_MAX_LEN = 4000
+
+
+def _retry_after_s(exc: RetryAfter) -> float:
+    ra = exc.retry_after
+    return ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+
+
+class _StreamingReply:
+    """Доставка ответа по мере генерации.
+
+    Первое законченное предложение — reply_text, дальше edit_text не чаще
+    STREAM_EDIT_INTERVAL_S (по границе слова). finish() ставит финальный текст.
+    Ошибки Telegram не прерывают генерацию — в худшем случае ответ придёт целиком.
+    """
+
+    def __init__(self, message):
+        self._message = message
+        self._sent = None
+        self._shown = ""
+        self._next_edit_at = 0.0
+        self._broken = False
+
+    async def on_delta(self, text: str) -> None:
+        if self._broken:
+            return
+        if self._sent is None:
+            match = _SENTENCE_END.search(text)
+            if match:
+                await self._send(text[:match.end()].rstrip())
+            return
+        if time.monotonic() < self._next_edit_at:
+            return
+        cut = max(text.rfind(" "), text.rfind("\n"))
+        visible = text[:cut].rstrip() if cut > 0 else ""
+        if len(visible) <= len(self._shown) or len(visible) > _STREAM_MAX_LEN:
+            return
+        await self._edit(visible)
+
+    async def finish(self, final: str) -> None:
+        if self._sent is None:
+            await self._message.reply_text(final)
+            return
+        if final == self._shown:
+            return
+        for _ in range(2):
+            try:
+                await self._sent.edit_text(final)
+                return
+            except RetryAfter as exc:
+                await asyncio.sleep(_retry_after_s(exc))
+            except BadRequest as exc:
+                if "not modified" in str(exc).lower():
+                    return
+                break
+            except TelegramError:
+                break
+        # Правка не прошла — отправляем ответ целиком, чтобы он точно дошёл
+        logger.warning("stream finish: edit failed, sending full reply")
+        await self._message.reply_text(final)
+
+    async def _send(self, text: str) -> None:
+        try:
+            self._sent = await self._message.reply_text(text)
+            self._shown = text
+            self._next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL_S
+        except TelegramError as exc:
+            logger.warning("stream: first chunk send failed: %s", exc)
+            self._broken = True
+
+    async def _edit(self, text: str) -> None:
+        try:
+            await self._sent.edit_text(text)
+            self._shown = text
+            self._next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL_S
+        except RetryAfter as exc:
+            self._next_edit_at = time.monotonic() + _retry_after_s(exc)
+        except TelegramError as exc:
+            logger.warning("stream: edit failed: %s", exc)
+            self._next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL_S
+
+
+async def _process_and_reply(update: Update, **kwargs) -> None:
+    """process_message + доставка ответа (стримингом, если STREAM_REPLIES)."""
+    reply = _StreamingReply(update.message) if STREAM_REPLIES else None
+    response = await process_message(
+        **kwargs, on_delta=reply.on_delta if reply else None,
+    )
+    if response is None:
+        return
+    if reply is not None:
+        await reply.finish(response)
+    else:
+        await update.message.reply_text(response)
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений."""
     if not await _check_access(update, context):
@@ -240,16 +347,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await context.bot.send_chat_action(chat_id=telegram_id, action=ChatAction.TYPING)
 
-    response = await process_message(
+    await _process_and_reply(
+        update,
         telegram_id=telegram_id,
         message_id=message_id,
         text=user_text,
         user_name=user_name,
     )
 
-    if response is not None:
-        await update.message.reply_text(response)
-
 
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик голосовых сообщений."""
@@ -278,7 +383,8 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Прости, не расслышала. Напиши текстом? 🙏")
         return
 
-    response = await process_message(
+    await _process_and_reply(
+        update,
         telegram_id=telegram_id,
         message_id=message_id,
         text=user_text,
@@ -286,9 +392,6 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         is_voice=True,
     )
 
-    if response is not None:
-        await update.message.reply_text(response)
-
 
 async def handle_other_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик фото, стикеров, документов и прочего."""
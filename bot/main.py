@@ -7,7 +7,8 @@ from bot.handlers import (
     callback_handler, app_command, forget_command, delete_account_command,
 )
 from bot.scheduler import setup_scheduler
-from bot.memory.database import init_db
+from bot.memory.database import close_db, init_db
+from bot.update_processor import create_update_processor
 from shared.config import TELEGRAM_BOT_TOKEN, WEBAPP_URL
 
 logging.basicConfig(
@@ -38,6 +39,11 @@ async def post_init(app: Application):
     alerter.init(app.bot)
 
 
+async def post_shutdown(app: Application):
+    await close_db()
+    logger.info("Пул соединений БД закрыт")
+
+
 async def error_handler(update, context):
     logger.error(f"Exception: {context.error}", exc_info=context.error)
 
@@ -49,7 +55,9 @@ def main():
     app = (
         Application.builder()
         .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(create_update_processor())
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
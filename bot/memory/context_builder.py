@@ -5,12 +5,11 @@
     Вход: telegram_id (int), current_message (str)
     Выход: (system_prompt: str, token_count: int, meta: ContextMeta)
     Ошибки: ValueError если пользователь не найден,
-            DB-ошибки в get_user пробрасываются наверх.
+            DB-ошибки в load_context_snapshot пробрасываются наверх.
             Ошибки зависимостей — _safe_call ловит, секция пропускается.
 """
 from __future__ import annotations
 
-import asyncio
 import logging
 from datetime import datetime, timezone
 
@@ -20,17 +19,33 @@ from bot.memory.episode_manager import (
     find_episodes_by_date,
     find_relevant_episodes,
 )
-from bot.memory.procedural_memory import get_procedural_as_text
-from bot.memory.profile_manager import get_profile_as_text
+from bot.memory.procedural_memory import format_procedural_json
+from bot.memory.profile_manager import format_profile_json
 from bot.prompts.system_prompt import build_system_prompt
 from shared.config import TOKEN_BUDGET_SOFT
 from shared.models import ContextMeta, Episode
+from shared.tracing import span
 
 logger = logging.getLogger(__name__)
 
 _FALLBACK_PROFILE = "=== ПРОФИЛЬ ===\nНовый пользователь. Информации пока нет. Наблюдай."
 _FALLBACK_PROCEDURAL = "=== КАК С НЕЙ РАБОТАТЬ ===\nСтиль не определён. Наблюдай и подстраивайся."
 
+# Блоки system prompt от самого стабильного к самому изменчивому.
+# Каждый блок — отдельный cache breakpoint у Claude: смена времени или
+# свежего факта не сбрасывает кэш персоны и памяти.
+_SYSTEM_BLOCKS = (
+    # статичный: персона + фаза + режим
+    ("base_prompt",),
+    # память юзера: меняется на полном обновлении / при работе с целью
+    (
+        "memory_header", "profile", "procedural", "running_summary",
+        "patterns", "commitments",
+    ),
+    # волатильный: время, факты этого разговора, эпизоды под текущее сообщение
+    ("current_time", "pending_facts", "episodes", "pause_context"),
+)
+
 
 # ---------------------------------------------------------------------------
 # Внутренние хелперы
@@ -46,6 +61,15 @@ async def _safe_call(fn, *args, **kwargs):
         return None
 
 
+def _safe_format(fn, *args):
+    """Синхронный аналог _safe_call для форматтеров секций."""
+    try:
+        return fn(*args)
+    except Exception as exc:
+        logger.warning("build_context: %s failed: %s", getattr(fn, "__name__", str(fn)), exc)
+        return None
+
+
 def _estimate_tokens(text: str) -> int:
     """Грубая оценка токенов: ~3.3 на слово."""
     if not text:
@@ -214,42 +238,40 @@ async def build_context(
 
     Возвращает (system_prompt, token_count, ContextMeta).
     """
-    # Шаг 1: пользователь (DB-ошибки пробрасываются)
-    user = await database.get_user(telegram_id)
-    if not user:
+    # Шаг 1: снимок памяти — одна read-транзакция (DB-ошибки пробрасываются)
+    with span("build_context.snapshot"):
+        snapshot = await database.load_context_snapshot(telegram_id)
+    if snapshot is None:
         raise ValueError(f"User {telegram_id} not found")
 
+    user = snapshot.user
     current_phase = user.get("current_phase", "ЗНАКОМСТВО")
     pause_minutes = _calc_pause(user.get("last_message_at"))
 
-    # Шаг 2: параллельный сбор данных (без эпизодов — они зависят от temporal detection)
-    profile_text, procedural_text, patterns, goal, running_summary, pending_facts = (
-        await asyncio.gather(
-            _safe_call(get_profile_as_text, telegram_id),
-            _safe_call(get_procedural_as_text, telegram_id),
-            _safe_call(database.get_patterns, telegram_id),
-            _safe_call(database.get_active_goal, telegram_id),
-            _safe_call(database.get_running_summary, telegram_id),
-            _safe_call(database.get_pending_facts, telegram_id),
-        )
+    # Шаг 2: секции из снимка (без запросов к БД)
+    profile_text = _safe_format(format_profile_json, telegram_id, snapshot.profile_json)
+    procedural_text = _safe_format(
+        format_procedural_json, telegram_id, snapshot.procedural_json,
     )
+    patterns = snapshot.patterns
+    goal = snapshot.active_goal
+    steps: list[dict] | None = snapshot.goal_steps or None
+    running_summary = snapshot.running_summary
+    pending_facts = snapshot.pending_facts
 
     # Шаг 2b: эпизоды — temporal search (по дате) или semantic search
     temporal = detect_temporal_query(current_message)
-    if temporal:
-        date_episodes = await _safe_call(
-            find_episodes_by_date, telegram_id, temporal[0], temporal[1], limit=10,
-        )
-        episodes = date_episodes or []
-    else:
-        episodes = await _safe_call(
-            find_relevant_episodes, telegram_id, current_message, limit=3,
-        )
-
-    # Шаги цели (если есть)
-    steps: list[dict] | None = None
-    if goal and goal.get("id"):
-        steps = await _safe_call(database.get_goal_steps, goal["id"])
+    with span("build_context.episodes"):
+        if temporal:
+            date_episodes = await _safe_call(
+                find_episodes_by_date, telegram_id, temporal[0], temporal[1], limit=10,
+            )
+            episodes = date_episodes or []
+        else:
+            episodes = await _safe_call(
+                find_relevant_episodes, telegram_id, current_message, limit=3,
+                headers=snapshot.episode_headers,
+            )
 
     # Шаг 3: base prompt (SYNC вызов)
     conversation_mode = user.get("conversation_mode")
@@ -294,9 +316,10 @@ async def build_context(
         sections["pause_context"] = ""
 
     # Шаг 5: обрезка если > TOKEN_BUDGET_SOFT
-    truncated_vars = _truncate_context(
-        sections, episodes, patterns, goal, steps,
-    )
+    with span("build_context.truncate"):
+        truncated_vars = _truncate_context(
+            sections, episodes, patterns, goal, steps,
+        )
 
     # Шаг 6: проверка — если после всей обрезки всё ещё > 3800
     total = sum(_estimate_tokens(v) for v in sections.values() if v)
@@ -314,17 +337,18 @@ async def build_context(
                 tokens_per_var={"base_prompt": _estimate_tokens(base_prompt)},
                 was_truncated=True,
                 truncated_vars=list(sections.keys()),
+                system_blocks=[base_prompt],
             ),
         )
 
-    # Шаг 7: сборка (base_prompt ПЕРВЫМ для prompt caching)
-    order = [
-        "base_prompt", "current_time", "memory_header", "profile",
-        "pending_facts", "procedural", "running_summary", "episodes",
-        "patterns", "commitments", "pause_context",
+    # Шаг 7: сборка блоками (стабильный префикс первым — для prompt caching)
+    order = [k for block in _SYSTEM_BLOCKS for k in block]
+    blocks = [
+        "\n\n".join(sections[k] for k in block if sections.get(k))
+        for block in _SYSTEM_BLOCKS
     ]
-    parts = [sections[k] for k in order if sections.get(k)]
-    final_prompt = "\n\n".join(parts)
+    blocks = [b for b in blocks if b]
+    final_prompt = "\n\n".join(blocks)
     token_count = _estimate_tokens(final_prompt)
 
     meta = ContextMeta(
@@ -332,6 +356,7 @@ async def build_context(
         tokens_per_var={k: _estimate_tokens(sections[k]) for k in order if sections.get(k)},
         was_truncated=bool(truncated_vars),
         truncated_vars=truncated_vars,
+        system_blocks=blocks,
     )
 
     return final_prompt, token_count, meta
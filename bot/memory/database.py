@@ -2,17 +2,27 @@
 Модуль базы данных Евы.
 17 таблиц, init_db(), CRUD для каждой таблицы.
 SQLite + aiosqlite + WAL mode.
+Соединения — из долгоживущего пула DBPool (readers + один writer).
 """
 
+import asyncio
+import functools
+import inspect
 import json
 import logging
+import sqlite3
+import time
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from datetime import datetime, timezone
 from typing import Optional
 
 import aiosqlite
 
-from shared.config import DB_PATH
+from shared.config import DB_GROUP_COMMIT_MS, DB_PATH, DB_POOL_READERS
+from shared import metrics
+from shared.models import ContextSnapshot
+from shared.tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -47,18 +57,489 @@ def _now() -> str:
 # ---------------------------------------------------------------------------
 
 
-@asynccontextmanager
-async def get_db():
-    """Открывает соединение с WAL + FK, возвращает через yield, закрывает в finally."""
-    db = await aiosqlite.connect(DB_PATH)
+def _is_broken(exc: Exception) -> bool:
+    """Ошибка означает мёртвое соединение (а не ошибку в SQL)."""
+    if isinstance(exc, (sqlite3.ProgrammingError, ValueError)):
+        return "closed" in str(exc).lower()
+    return False
+
+
+async def _apply_ops(db: aiosqlite.Connection, ops: list, atomic: bool) -> tuple:
+    """Выполняет намерения внутри открытой транзакции батча.
+
+    Одиночная запись: упавший statement SQLite откатывает сам.
+    Атомарная группа: SAVEPOINT, при ошибке — откат только этой группы.
+    Возвращает (lastrowid | [lastrowid, ...], exc | None).
+    """
+    if not atomic:
+        sql, params = ops[0]
+        try:
+            cur = await db.execute(sql, params)
+            return cur.lastrowid, None
+        except Exception as exc:
+            return None, exc
+    await db.execute("SAVEPOINT uow")
     try:
+        rowids = []
+        for sql, params in ops:
+            cur = await db.execute(sql, params)
+            rowids.append(cur.lastrowid)
+    except Exception as exc:
+        await db.execute("ROLLBACK TO uow")
+        await db.execute("RELEASE uow")
+        return None, exc
+    await db.execute("RELEASE uow")
+    return rowids, None
+
+
+class DBPool:
+    """Долгоживущий пул соединений: N читателей + один писатель.
+
+    PRAGMA выставляются один раз при открытии соединения.
+    Писатель эксклюзивен (asyncio.Lock) — SQLite всё равно допускает
+    одну пишущую транзакцию. Читатели в WAL не блокируют писателя.
+    Вложенный get_db()/get_read_db() в той же задаче переиспользует
+    уже взятое соединение (без дедлока).
+    """
+
+    def __init__(self, path: str, readers: int = DB_POOL_READERS) -> None:
+        self.path = path
+        # :memory: — у каждого соединения своя БД, читаем через писателя
+        self.readers_count = 0 if path == ":memory:" else max(0, readers)
+        self.loop = asyncio.get_running_loop()
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._readers: asyncio.Queue = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+        self._open_lock = asyncio.Lock()
+        self._opened = False
+        self._closed = False
+        # Group commit: очередь намерений записи + фоновый writer-таск
+        self._write_queue: asyncio.Queue = asyncio.Queue()
+        self._writer_task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.batched_writes = 0
+        # Метрики
+        self.checked_out = 0
+        self.acquisitions = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.reconnects = 0
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = aiosqlite.connect(self.path)
+        # Поток соединения не должен держать процесс при выходе
+        conn.daemon = True
+        db = await conn
         # WAL — вне транзакции (PRAGMA не требует транзакции)
         await db.execute("PRAGMA journal_mode=WAL")
         await db.execute("PRAGMA foreign_keys=ON")
         db.row_factory = aiosqlite.Row
+        return db
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if self._opened:
+                return
+            self._writer = await self._connect()
+            for _ in range(self.readers_count):
+                conn = await self._connect()
+                self._all_readers.append(conn)
+                self._readers.put_nowait(conn)
+            self._opened = True
+            logger.info(
+                "DBPool: открыт (%s), readers=%d", self.path, self.readers_count,
+            )
+
+    def _record_wait(self, t0: float) -> None:
+        waited = (time.monotonic() - t0) * 1000
+        self.acquisitions += 1
+        self.wait_total_ms += waited
+        if waited > self.wait_max_ms:
+            self.wait_max_ms = waited
+
+    async def _replace(self, conn: aiosqlite.Connection) -> aiosqlite.Connection:
+        """Закрывает сломанное соединение и открывает новое."""
+        try:
+            await conn.close()
+        except Exception:
+            pass
+        self.reconnects += 1
+        logger.warning("DBPool: соединение пересоздано (%s)", self.path)
+        return await self._connect()
+
+    @asynccontextmanager
+    async def writer(self):
+        held = _held_writer.get()
+        if held is not None:
+            yield held
+            return
+        if not self._opened:
+            await self.open()
+        t0 = time.monotonic()
+        async with self._writer_lock:
+            self._record_wait(t0)
+            db = self._writer
+            token = _held_writer.set(db)
+            self.checked_out += 1
+            try:
+                yield db
+            except Exception as exc:
+                if _is_broken(exc):
+                    self._writer = await self._replace(db)
+                raise
+            finally:
+                self.checked_out -= 1
+                _held_writer.reset(token)
+                if db is self._writer and db.in_transaction:
+                    # Незакоммиченное (ошибка посреди записи) — откатываем
+                    try:
+                        await db.rollback()
+                    except Exception:
+                        self._writer = await self._replace(db)
+
+    @asynccontextmanager
+    async def reader(self):
+        if self.readers_count == 0:
+            async with self.writer() as db:
+                yield db
+            return
+        held = _held_reader.get() or _held_writer.get()
+        if held is not None:
+            yield held
+            return
+        if not self._opened:
+            await self.open()
+        t0 = time.monotonic()
+        db = await self._readers.get()
+        self._record_wait(t0)
+        token = _held_reader.set(db)
+        self.checked_out += 1
+        try:
+            yield db
+        except Exception as exc:
+            if _is_broken(exc):
+                idx = self._all_readers.index(db)
+                db = self._all_readers[idx] = await self._replace(db)
+            raise
+        finally:
+            self.checked_out -= 1
+            _held_reader.reset(token)
+            if db.in_transaction:
+                try:
+                    await db.rollback()
+                except Exception:
+                    idx = self._all_readers.index(db)
+                    db = self._all_readers[idx] = await self._replace(db)
+            self._readers.put_nowait(db)
+
+    # --- Group commit --------------------------------------------------------
+
+    def submit_write(self, sql: str, params) -> asyncio.Future:
+        """Ставит запись в очередь writer-таска. Future -> lastrowid после COMMIT."""
+        return self._submit([(sql, params)], atomic=False)
+
+    def submit_unit(self, ops: list) -> asyncio.Future:
+        """Атомарная группа записей (unit of work). Future -> список lastrowid."""
+        return self._submit(ops, atomic=True)
+
+    def _submit(self, ops: list, atomic: bool) -> asyncio.Future:
+        fut = self.loop.create_future()
+        self._write_queue.put_nowait((ops, atomic, fut))
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = self.loop.create_task(self._write_loop())
+        return fut
+
+    async def _write_loop(self) -> None:
+        """Берёт намерения из очереди, всё пришедшее за окно — одной транзакцией.
+
+        None в очереди — сигнал остановки: дописываем собранное и выходим.
+        """
+        window = DB_GROUP_COMMIT_MS / 1000
+        stop = False
+        while not stop:
+            item = await self._write_queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + window
+            while len(batch) < _GROUP_COMMIT_MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if self._write_queue.empty() and remaining <= 0:
+                    break
+                try:
+                    item = (
+                        self._write_queue.get_nowait()
+                        if not self._write_queue.empty()
+                        else await asyncio.wait_for(self._write_queue.get(), remaining)
+                    )
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._commit_batch(batch)
+
+    async def _commit_batch(self, batch: list) -> None:
+        results: list = []
+        t0 = time.monotonic()
+        try:
+            async with self.writer() as db:
+                if not db.in_transaction:
+                    await db.execute("BEGIN")
+                for ops, atomic, fut in batch:
+                    results.append((fut, *await _apply_ops(db, ops, atomic)))
+                await db.commit()
+        except Exception as exc:
+            logger.error("group commit failed (%d writes): %s", len(batch), exc)
+            for _ops, _atomic, fut in batch:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        self.batches += 1
+        self.batched_writes += len(batch)
+        _COMMIT_SECONDS.observe(time.monotonic() - t0)
+        for fut, result, exc in results:
+            if fut.done():
+                continue
+            if exc is not None:
+                fut.set_exception(exc)
+            else:
+                fut.set_result(result)
+
+    async def _stop_writer(self) -> None:
+        """Дописывает очередь и останавливает writer-таск."""
+        if self._writer_task is None or self._writer_task.done():
+            return
+        self._write_queue.put_nowait(None)
+        await self._writer_task
+        self._writer_task = None
+
+    async def health_check(self) -> bool:
+        """SELECT 1 на писателе и свободных читателях, сломанные пересоздаёт."""
+        ok = True
+        async with self.writer() as db:
+            try:
+                async with db.execute("SELECT 1") as cur:
+                    await cur.fetchone()
+            except Exception:
+                ok = False
+                self._writer = await self._replace(db)
+        idle: list[aiosqlite.Connection] = []
+        while not self._readers.empty():
+            idle.append(self._readers.get_nowait())
+        for db in idle:
+            try:
+                async with db.execute("SELECT 1") as cur:
+                    await cur.fetchone()
+            except Exception:
+                ok = False
+                idx = self._all_readers.index(db)
+                db = self._all_readers[idx] = await self._replace(db)
+            self._readers.put_nowait(db)
+        return ok
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self.loop is asyncio.get_running_loop():
+            await self._stop_writer()
+        conns = list(self._all_readers)
+        if self._writer is not None:
+            conns.append(self._writer)
+        for conn in conns:
+            try:
+                await conn.close()
+            except Exception:
+                logger.warning("DBPool: ошибка при закрытии соединения", exc_info=True)
+        self._all_readers.clear()
+        self._writer = None
+        self._opened = False
+        logger.info("DBPool: закрыт (%s)", self.path)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "readers": self.readers_count,
+            "readers_idle": self._readers.qsize(),
+            "checked_out": self.checked_out,
+            "acquisitions": self.acquisitions,
+            "wait_avg_ms": round(self.wait_total_ms / self.acquisitions, 3)
+            if self.acquisitions else 0.0,
+            "wait_max_ms": round(self.wait_max_ms, 3),
+            "reconnects": self.reconnects,
+            "write_queue": self._write_queue.qsize(),
+            "batches": self.batches,
+            "writes_per_batch": round(self.batched_writes / self.batches, 2)
+            if self.batches else 0.0,
+        }
+
+
+_GROUP_COMMIT_MAX_BATCH = 256
+
+_pool: Optional[DBPool] = None
+_held_writer: ContextVar[Optional[aiosqlite.Connection]] = ContextVar(
+    "_held_writer", default=None,
+)
+_held_reader: ContextVar[Optional[aiosqlite.Connection]] = ContextVar(
+    "_held_reader", default=None,
+)
+
+
+async def _get_pool() -> DBPool:
+    """Ленивый пул. Пересоздаётся при смене DB_PATH (тесты) или event loop."""
+    global _pool
+    loop = asyncio.get_running_loop()
+    if _pool is not None and (_pool.path != DB_PATH or _pool.loop is not loop):
+        old, _pool = _pool, None
+        await old.close()
+    if _pool is None:
+        _pool = DBPool(DB_PATH)
+    return _pool
+
+
+@asynccontextmanager
+async def get_db():
+    """Пишущее соединение из пула (эксклюзивно). Можно и читать."""
+    pool = await _get_pool()
+    async with pool.writer() as db:
         yield db
-    finally:
-        await db.close()
+
+
+@asynccontextmanager
+async def get_read_db():
+    """Читающее соединение из пула. Не коммитить через него."""
+    pool = await _get_pool()
+    async with pool.reader() as db:
+        yield db
+
+
+async def _write(sql: str, params) -> Optional[int]:
+    """Одна запись с COMMIT через group commit. Возвращает lastrowid.
+
+    await дожидается COMMIT батча (durable). Внутри transaction() запись
+    откладывается до коммита unit of work (возвращает None). Внутри уже
+    взятого get_db() пишет прямо в удерживаемое соединение — коммитит
+    владелец. При DB_GROUP_COMMIT_MS=0 — отдельный COMMIT на запись.
+    """
+    uow = _current_uow.get()
+    if uow is not None and not uow.closed:
+        uow.add(sql, params)
+        return None
+    held = _held_writer.get()
+    if held is not None:
+        cur = await held.execute(sql, params)
+        return cur.lastrowid
+    pool = await _get_pool()
+    if DB_GROUP_COMMIT_MS <= 0:
+        async with pool.writer() as db:
+            cur = await db.execute(sql, params)
+            await db.commit()
+            return cur.lastrowid
+    return await pool.submit_write(sql, params)
+
+
+# ---------------------------------------------------------------------------
+# Unit of work
+# ---------------------------------------------------------------------------
+
+
+class UnitOfWork:
+    """Отложенные записи одного хода: коммитятся вместе или не коммитятся вовсе.
+
+    Записи через _write() (add_message, mark_message_processed, update_user,
+    mark_daily_responded, ...) внутри transaction() не идут в БД сразу,
+    а копятся здесь. Соединение на время хода НЕ удерживается (между
+    записями может быть LLM-вызов на 10+ секунд).
+    """
+
+    def __init__(self) -> None:
+        self.ops: list[tuple[str, tuple | list]] = []
+        self.rowids: list[int] = []
+        self.closed = False
+        self._after_commit: list = []
+
+    def add(self, sql: str, params) -> None:
+        self.ops.append((sql, params))
+
+    def after_commit(self, fn) -> None:
+        """Колбэк после успешного COMMIT (например, fire-and-forget задачи)."""
+        self._after_commit.append(fn)
+
+    async def commit(self) -> None:
+        self.closed = True
+        if self.ops:
+            pool = await _get_pool()
+            if DB_GROUP_COMMIT_MS <= 0:
+                async with pool.writer() as db:
+                    if not db.in_transaction:
+                        await db.execute("BEGIN")
+                    rowids, exc = await _apply_ops(db, self.ops, atomic=True)
+                    if exc is not None:
+                        raise exc
+                    await db.commit()
+            else:
+                rowids = await pool.submit_unit(self.ops)
+            self.rowids = rowids
+        for fn in self._after_commit:
+            fn()
+
+
+_current_uow: ContextVar[Optional[UnitOfWork]] = ContextVar("_current_uow", default=None)
+
+
+@asynccontextmanager
+async def transaction():
+    """Unit of work: все записи внутри блока — одна атомарная транзакция.
+
+    Коммит при нормальном выходе (в т.ч. через return), при исключении
+    записи отбрасываются. Вложенный transaction() присоединяется к внешнему.
+    """
+    outer = _current_uow.get()
+    if outer is not None and not outer.closed:
+        yield outer
+        return
+    uow = UnitOfWork()
+    token = _current_uow.set(uow)
+    try:
+        yield uow
+    except BaseException:
+        uow.closed = True
+        _current_uow.reset(token)
+        raise
+    _current_uow.reset(token)
+    with span("db_commit"):
+        await uow.commit()
+
+
+async def close_db() -> None:
+    """Закрывает пул (graceful shutdown)."""
+    global _pool
+    if _pool is not None:
+        old, _pool = _pool, None
+        await old.close()
+
+
+def get_pool_stats() -> dict:
+    """Метрики пула: ожидание, выданные соединения, переподключения."""
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+
+_COMMIT_SECONDS = metrics.histogram(
+    "db_group_commit_seconds", "Одна транзакция group commit (пачка записей)",
+)
+metrics.gauge(
+    "db_write_queue_depth", "Записи в очереди writer-таска",
+    fn=lambda: _pool._write_queue.qsize() if _pool is not None else 0,
+)
+metrics.gauge(
+    "db_connections_checked_out", "Выданные соединения пула",
+    fn=lambda: _pool.checked_out if _pool is not None else 0,
+)
 
 
 # ---------------------------------------------------------------------------
@@ -283,11 +764,32 @@ CREATE TABLE IF NOT EXISTS allowed_users (
     added_by INTEGER,
     created_at TEXT NOT NULL DEFAULT (datetime('now'))
 );
+
+-- 19. llm_cache (ответы детерминированных фоновых промптов)
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    site TEXT NOT NULL,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (datetime('now'))
+);
+CREATE INDEX IF NOT EXISTS idx_lc_expires ON llm_cache(expires_at);
+
+-- 20. message_traces (спаны шагов хода, TRACE_PERSIST=1)
+CREATE TABLE IF NOT EXISTS message_traces (
+    message_id INTEGER PRIMARY KEY,
+    telegram_id INTEGER NOT NULL,
+    total_ms REAL NOT NULL,
+    spans TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (datetime('now'))
+);
+CREATE INDEX IF NOT EXISTS idx_mt_created ON message_traces(created_at);
 """
 
 
 async def init_db():
-    """Создаёт все 18 таблиц + миграции. Безопасен для повторного вызова."""
+    """Создаёт все 20 таблиц + миграции. Безопасен для повторного вызова."""
     async with get_db() as db:
         await db.executescript(_CREATE_TABLES)
         await db.commit()
@@ -351,7 +853,7 @@ _USER_UPDATABLE_FIELDS = frozenset({
 
 
 async def get_user(telegram_id: int) -> Optional[dict]:
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             "SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)
         ) as cur:
@@ -381,16 +883,14 @@ async def update_user(telegram_id: int, **fields):
     fields.setdefault("updated_at", _now())
     cols = ", ".join(f"{k} = ?" for k in fields)
     vals = list(fields.values()) + [telegram_id]
-    async with get_db() as db:
-        await db.execute(
-            f"UPDATE users SET {cols} WHERE telegram_id = ?", vals  # noqa: S608
-        )
-        await db.commit()
+    await _write(
+        f"UPDATE users SET {cols} WHERE telegram_id = ?", vals  # noqa: S608
+    )
 
 
 async def get_users_needing_update() -> list[int]:
     """WHERE needs_full_update=1 AND last_message_at < now()-30min."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT telegram_id FROM users
                WHERE needs_full_update = 1
@@ -401,7 +901,7 @@ async def get_users_needing_update() -> list[int]:
 
 async def get_silent_users(hours: int = 72) -> list[dict]:
     """Пользователи без сообщений >= hours часов (для silence_reminder)."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT * FROM users
                WHERE last_message_at < datetime('now', ? || ' hours')
@@ -412,14 +912,14 @@ async def get_silent_users(hours: int = 72) -> list[dict]:
 
 
 async def get_all_users() -> list[dict]:
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute("SELECT * FROM users") as cur:
             return [dict(r) for r in await cur.fetchall()]
 
 
 async def get_running_summary(telegram_id: int) -> str:
     """Возвращает running_summary пользователя (пустая строка если нет)."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             "SELECT running_summary FROM users WHERE telegram_id = ?",
             (telegram_id,),
@@ -454,21 +954,18 @@ async def add_message(
     """Добавляет сообщение, возвращает id."""
     now = _now()
     char_length = len(content) if content else 0
-    async with get_db() as db:
-        cur = await db.execute(
-            """INSERT INTO messages
-               (telegram_id, role, content, char_length, source, is_voice,
-                response_latency_ms, created_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-            (telegram_id, role, content, char_length, source, is_voice,
-             response_latency_ms, now),
-        )
-        await db.commit()
-        return cur.lastrowid
+    return await _write(
+        """INSERT INTO messages
+           (telegram_id, role, content, char_length, source, is_voice,
+            response_latency_ms, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (telegram_id, role, content, char_length, source, is_voice,
+         response_latency_ms, now),
+    )
 
 
 async def get_recent_messages(telegram_id: int, limit: int = 20) -> list[dict]:
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT * FROM messages
                WHERE telegram_id = ?
@@ -481,7 +978,7 @@ async def get_recent_messages(telegram_id: int, limit: int = 20) -> list[dict]:
 
 async def get_messages_since(telegram_id: int, since_dt: str) -> list[dict]:
     """Сообщения с момента since_dt (для full_memory_update)."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT * FROM messages
                WHERE telegram_id = ? AND created_at >= ?
@@ -508,7 +1005,7 @@ async def delete_old_messages(days: int = 90):
 
 
 async def is_message_processed(message_id: int) -> bool:
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             "SELECT 1 FROM processed_messages WHERE message_id = ?",
             (message_id,),
@@ -517,14 +1014,12 @@ async def is_message_processed(message_id: int) -> bool:
 
 
 async def mark_message_processed(message_id: int, telegram_id: int):
-    async with get_db() as db:
-        await db.execute(
-            """INSERT OR IGNORE INTO processed_messages
-               (message_id, telegram_id, received_at)
-               VALUES (?, ?, ?)""",
-            (message_id, telegram_id, _now()),
-        )
-        await db.commit()
+    await _write(
+        """INSERT OR IGNORE INTO processed_messages
+           (message_id, telegram_id, received_at)
+           VALUES (?, ?, ?)""",
+        (message_id, telegram_id, _now()),
+    )
 
 
 # ---------------------------------------------------------------------------
@@ -533,7 +1028,7 @@ async def mark_message_processed(message_id: int, telegram_id: int):
 
 
 async def get_profile(telegram_id: int) -> Optional[dict]:
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             "SELECT * FROM semantic_profiles WHERE telegram_id = ?",
             (telegram_id,),
@@ -583,7 +1078,7 @@ async def upsert_profile(telegram_id: int, profile_json: dict, tokens_count: int
 
 async def get_profile_version(telegram_id: int, version: int) -> Optional[dict]:
     """Получить конкретную версию профиля из profile_versions."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             "SELECT profile_json FROM profile_versions WHERE telegram_id = ? AND version = ?",
             (telegram_id, version),
@@ -638,7 +1133,7 @@ async def create_episode(
 
 async def get_episode_headers(telegram_id: int) -> list[dict]:
     """Только id, title, created_at — для выбора конспектов."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT id, title, created_at FROM episodes
                WHERE telegram_id = ?
@@ -652,7 +1147,7 @@ async def get_episodes_by_date_range(
     telegram_id: int, date_from: str, date_to: str, limit: int = 4,
 ) -> list[dict]:
     """Эпизоды за период (date_from, date_to — SQL date expressions)."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             f"""SELECT * FROM episodes
             WHERE telegram_id = ?
@@ -681,7 +1176,7 @@ async def get_episodes_by_ids(ids: list[int]) -> list[dict]:
     if not ids:
         return []
     placeholders = ", ".join("?" for _ in ids)
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             f"SELECT * FROM episodes WHERE id IN ({placeholders})",  # noqa: S608
             ids,
@@ -703,7 +1198,7 @@ async def get_episodes_by_ids(ids: list[int]) -> list[dict]:
 
 
 async def get_procedural(telegram_id: int) -> Optional[dict]:
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             "SELECT * FROM procedural_memory WHERE telegram_id = ?",
             (telegram_id,),
@@ -744,18 +1239,16 @@ async def add_pending_fact(
     content: str,
     confidence: str = "medium",
 ):
-    async with get_db() as db:
-        await db.execute(
-            """INSERT INTO pending_facts
-               (telegram_id, fact_type, content, confidence, created_at)
-               VALUES (?, ?, ?, ?, ?)""",
-            (telegram_id, fact_type, content, confidence, _now()),
-        )
-        await db.commit()
+    await _write(
+        """INSERT INTO pending_facts
+           (telegram_id, fact_type, content, confidence, created_at)
+           VALUES (?, ?, ?, ?, ?)""",
+        (telegram_id, fact_type, content, confidence, _now()),
+    )
 
 
 async def get_pending_facts(telegram_id: int) -> list[dict]:
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT * FROM pending_facts
                WHERE telegram_id = ?
@@ -780,17 +1273,15 @@ async def clear_pending_facts(telegram_id: int):
 
 
 async def add_emotion(telegram_id: int, emotion: str):
-    async with get_db() as db:
-        await db.execute(
-            """INSERT INTO emotion_log (telegram_id, emotion, created_at)
-               VALUES (?, ?, ?)""",
-            (telegram_id, emotion, _now()),
-        )
-        await db.commit()
+    await _write(
+        """INSERT INTO emotion_log (telegram_id, emotion, created_at)
+           VALUES (?, ?, ?)""",
+        (telegram_id, emotion, _now()),
+    )
 
 
 async def get_recent_emotions(telegram_id: int, limit: int = 10) -> list[dict]:
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT * FROM emotion_log
                WHERE telegram_id = ?
@@ -836,7 +1327,7 @@ async def add_or_increment_pattern(
 
 
 async def get_patterns(telegram_id: int) -> list[dict]:
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT * FROM patterns
                WHERE telegram_id = ?
@@ -885,7 +1376,7 @@ async def create_goal(telegram_id: int, title: str) -> int:
 
 
 async def get_active_goal(telegram_id: int) -> Optional[dict]:
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT * FROM goals
                WHERE telegram_id = ? AND status = 'active'
@@ -951,7 +1442,7 @@ async def update_step_status(
 
 
 async def get_goal_steps(goal_id: int) -> list[dict]:
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT * FROM goal_steps
                WHERE goal_id = ?
@@ -963,7 +1454,7 @@ async def get_goal_steps(goal_id: int) -> list[dict]:
 
 async def get_steps_by_deadline(telegram_id: int, date_str: str) -> list[dict]:
     """Шаги с deadline_at на указанную дату. date_str формат: 'YYYY-MM-DD'."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT * FROM goal_steps
                WHERE telegram_id = ? AND date(deadline_at) = ? AND status = 'pending'
@@ -975,7 +1466,7 @@ async def get_steps_by_deadline(telegram_id: int, date_str: str) -> list[dict]:
 
 async def get_overdue_steps(telegram_id: int) -> list[dict]:
     """Просроченные шаги: pending AND deadline < now - 1 hour."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT * FROM goal_steps
                WHERE telegram_id = ? AND status = 'pending'
@@ -986,6 +1477,101 @@ async def get_overdue_steps(telegram_id: int) -> list[dict]:
             return [dict(r) for r in await cur.fetchall()]
 
 
+# ---------------------------------------------------------------------------
+# Снимок контекста (для build_context)
+# ---------------------------------------------------------------------------
+
+
+async def _fetch_dicts(db: aiosqlite.Connection, sql: str, params) -> list[dict]:
+    return [dict(r) for r in await db.execute_fetchall(sql, params)]
+
+
+async def load_context_snapshot(telegram_id: int) -> Optional[ContextSnapshot]:
+    """Всё для build_context — одной read-транзакцией на одном соединении.
+
+    В WAL читатель внутри BEGIN видит один снимок БД, поэтому профиль,
+    цель, шаги и факты согласованы между собой. None если юзера нет.
+    """
+    async with get_read_db() as db:
+        # Соединение могли выдать из уже открытой транзакции writer'а —
+        # тогда читаем внутри неё и не трогаем её границы.
+        own_tx = not db.in_transaction
+        if own_tx:
+            await db.execute("BEGIN")
+        try:
+            users = await _fetch_dicts(
+                db, "SELECT * FROM users WHERE telegram_id = ?", (telegram_id,),
+            )
+            if not users:
+                return None
+            user = users[0]
+
+            profile = await _fetch_dicts(
+                db,
+                "SELECT profile_json FROM semantic_profiles WHERE telegram_id = ?",
+                (telegram_id,),
+            )
+            procedural = await _fetch_dicts(
+                db,
+                "SELECT memory_json FROM procedural_memory WHERE telegram_id = ?",
+                (telegram_id,),
+            )
+            goals = await _fetch_dicts(
+                db,
+                """SELECT * FROM goals
+                   WHERE telegram_id = ? AND status = 'active'
+                   LIMIT 1""",
+                (telegram_id,),
+            )
+            goal = goals[0] if goals else None
+            steps = []
+            if goal:
+                steps = await _fetch_dicts(
+                    db,
+                    """SELECT * FROM goal_steps
+                       WHERE goal_id = ?
+                       ORDER BY sort_order ASC""",
+                    (goal["id"],),
+                )
+
+            return ContextSnapshot(
+                user=user,
+                profile_json=(
+                    _parse_json(profile[0]["profile_json"]) if profile else None
+                ),
+                procedural_json=(
+                    _parse_json(procedural[0]["memory_json"]) if procedural else None
+                ),
+                patterns=await _fetch_dicts(
+                    db,
+                    """SELECT * FROM patterns
+                       WHERE telegram_id = ?
+                       ORDER BY count DESC""",
+                    (telegram_id,),
+                ),
+                active_goal=goal,
+                goal_steps=steps,
+                running_summary=user.get("running_summary") or "",
+                pending_facts=await _fetch_dicts(
+                    db,
+                    """SELECT * FROM pending_facts
+                       WHERE telegram_id = ?
+                       ORDER BY created_at ASC""",
+                    (telegram_id,),
+                ),
+                episode_headers=await _fetch_dicts(
+                    db,
+                    """SELECT id, title, created_at FROM episodes
+                       WHERE telegram_id = ?
+                       ORDER BY created_at DESC""",
+                    (telegram_id,),
+                ),
+            )
+        finally:
+            if own_tx:
+                await db.rollback()
+
+
 # ---------------------------------------------------------------------------
 # CRUD — Daily messages
 # ---------------------------------------------------------------------------
@@ -1010,19 +1596,17 @@ async def create_daily_message(
 
 
 async def mark_daily_responded(daily_id: int, response_delay_minutes: int):
-    async with get_db() as db:
-        await db.execute(
-            """UPDATE daily_messages
-               SET responded = 1, response_delay_minutes = ?
-               WHERE id = ?""",
-            (response_delay_minutes, daily_id),
-        )
-        await db.commit()
+    await _write(
+        """UPDATE daily_messages
+           SET responded = 1, response_delay_minutes = ?
+           WHERE id = ?""",
+        (response_delay_minutes, daily_id),
+    )
 
 
 async def has_daily_today(telegram_id: int) -> bool:
     """Проверяет, было ли уже отправлено daily-сообщение сегодня (idempotency)."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT 1 FROM daily_messages
                WHERE telegram_id = ? AND DATE(sent_at) = DATE('now')
@@ -1034,7 +1618,7 @@ async def has_daily_today(telegram_id: int) -> bool:
 
 async def get_unresponded_daily(telegram_id: int) -> Optional[dict]:
     """Находит последнее неотвеченное daily_message за сегодня."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             """SELECT id, sent_at FROM daily_messages
                WHERE telegram_id = ? AND responded = 0 AND DATE(created_at) = DATE('now')
@@ -1097,7 +1681,7 @@ async def mark_feedback_sent(feedback_id: int) -> None:
 
 async def get_unsent_feedback(telegram_id: int) -> list[dict]:
     """Возвращает все неотправленные feedback-записи пользователя."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             "SELECT id, episode_id, session_end, messages_in_session "
             "FROM session_feedback WHERE telegram_id = ? AND sent = 0",
@@ -1133,20 +1717,18 @@ async def add_webapp_event(
     page: str = None,
     metadata: dict = None,
 ):
-    async with get_db() as db:
-        await db.execute(
-            """INSERT INTO webapp_events
-               (telegram_id, event_type, page, metadata_json, created_at)
-               VALUES (?, ?, ?, ?, ?)""",
-            (
-                telegram_id,
-                event_type,
-                page,
-                _to_json(metadata) if metadata else None,
-                _now(),
-            ),
-        )
-        await db.commit()
+    await _write(
+        """INSERT INTO webapp_events
+           (telegram_id, event_type, page, metadata_json, created_at)
+           VALUES (?, ?, ?, ?, ?)""",
+        (
+            telegram_id,
+            event_type,
+            page,
+            _to_json(metadata) if metadata else None,
+            _now(),
+        ),
+    )
 
 
 async def delete_old_webapp_events(days: int = 90):
@@ -1272,7 +1854,7 @@ async def delete_user_completely(telegram_id: int):
 
 async def is_user_allowed(telegram_id: int) -> bool:
     """Проверяет, есть ли юзер в whitelist."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute(
             "SELECT 1 FROM allowed_users WHERE telegram_id = ?",
             (telegram_id,),
@@ -1302,7 +1884,7 @@ async def remove_allowed_user(telegram_id: int) -> None:
 
 async def get_allowed_users() -> list[int]:
     """Список всех допущенных юзеров."""
-    async with get_db() as db:
+    async with get_read_db() as db:
         async with db.execute("SELECT telegram_id FROM allowed_users") as cur:
             return [row[0] for row in await cur.fetchall()]
 
@@ -1311,3 +1893,112 @@ async def retention_cleanup(msg_days: int = 90, events_days: int = 90):
     """Вызывает delete_old_messages + delete_old_webapp_events."""
     await delete_old_messages(days=msg_days)
     await delete_old_webapp_events(days=events_days)
+
+
+# ---------------------------------------------------------------------------
+# LLM cache
+# ---------------------------------------------------------------------------
+
+
+async def get_llm_cache(key: str, now: float) -> Optional[tuple[str, float]]:
+    """(response, expires_at) непросроченной записи или None."""
+    async with get_read_db() as db:
+        async with db.execute(
+            "SELECT response, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+            (key, now),
+        ) as cur:
+            row = await cur.fetchone()
+            return (row[0], row[1]) if row else None
+
+
+async def put_llm_cache(
+    key: str, site: str, model: str, response: str, expires_at: float
+) -> None:
+    await _write(
+        """INSERT OR REPLACE INTO llm_cache
+           (key, site, model, response, expires_at, created_at)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (key, site, model, response, expires_at, _now()),
+    )
+
+
+async def prune_llm_cache(now: float, max_rows: int) -> None:
+    """Удаляет просроченные записи и самые ранние по сроку сверх max_rows."""
+    await _write("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+    await _write(
+        """DELETE FROM llm_cache WHERE key IN (
+               SELECT key FROM llm_cache
+               ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+           )""",
+        (max_rows,),
+    )
+
+
+# ---------------------------------------------------------------------------
+# Message traces
+# ---------------------------------------------------------------------------
+
+
+async def save_message_trace(
+    message_id: int, telegram_id: int, total_ms: float, spans: list[dict]
+) -> None:
+    await _write(
+        """INSERT OR REPLACE INTO message_traces
+           (message_id, telegram_id, total_ms, spans, created_at)
+           VALUES (?, ?, ?, ?, ?)""",
+        (message_id, telegram_id, total_ms,
+         json.dumps(spans, ensure_ascii=False), _now()),
+    )
+
+
+async def get_message_traces(limit: int = 50) -> list[dict]:
+    """Последние сохранённые трассы (spans распарсены), новые первыми."""
+    async with get_read_db() as db:
+        async with db.execute(
+            """SELECT message_id, telegram_id, total_ms, spans, created_at
+               FROM message_traces ORDER BY created_at DESC, rowid DESC LIMIT ?""",
+            (limit,),
+        ) as cur:
+            rows = await cur.fetchall()
+    result = []
+    for row in rows:
+        d = dict(row)
+        d["spans"] = json.loads(d["spans"])
+        result.append(d)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Метрики: время каждой публичной функции БД (db_query_seconds{function})
+# ---------------------------------------------------------------------------
+
+_QUERY_SECONDS = metrics.histogram(
+    "db_query_seconds",
+    "Время функции БД (запись внутри transaction() — только постановка в UoW)",
+    ("function",),
+)
+
+
+def _timed(fn):
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        t0 = time.monotonic()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            _QUERY_SECONDS.observe(time.monotonic() - t0, name)
+
+    return wrapper
+
+
+# Оборачиваем при импорте: новая функция модуля попадает в метрики сама
+for _name, _fn in list(globals().items()):
+    if (
+        not _name.startswith("_")
+        and inspect.iscoroutinefunction(_fn)
+        and _fn.__module__ == __name__
+    ):
+        globals()[_name] = _timed(_fn)
+del _name, _fn
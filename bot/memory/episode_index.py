@@ -0,0 +1,174 @@
+"""
+Локальный лексический поиск эпизодов: BM25 по title/summary/key_insight.
+
+Per-user инвертированный индекс в памяти процесса. Строится лениво
+из БД, дальше обновляется инкрементально (add_episode из create_episode)
+и сверяется со списком заголовков (sync) — удалённые эпизоды выпадают,
+созданные другим процессом догружаются.
+
+Токенизация: нижний регистр, ё -> е, стоп-слова, лёгкий стемминг
+(отрезание возвратной частицы и типичных русских окончаний).
+"""
+
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+
+from bot.memory import database
+
+# BM25
+_K1 = 1.5
+_B = 0.75
+# Заголовок — самое плотное поле, считаем его дважды
+_TITLE_WEIGHT = 2
+
+_TOKEN_RE = re.compile(r"[а-яa-z0-9]+")
+
+_STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы
+по только ее мне было вот от меня еще нет о из ему теперь когда даже ну вдруг
+ли если уже или ни быть был него до вас нибудь опять уж вам ведь там потом
+себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам
+чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому
+этого какой совсем ним здесь этом один почти мой тем чтобы нее сейчас были
+куда зачем всех никогда можно при наконец два об другой хоть после над больше
+тот через эти нас про всего них какая много разве три эту моя впрочем хорошо
+свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно
+всю между это просто очень
+""".split())
+
+# Окончания от длинных к коротким: отрезаем первое подошедшее,
+# если от слова остаётся >= _MIN_STEM букв.
+_SUFFIXES = tuple(sorted(set("""
+ость ости остью остей иями ями ами ях ах ией ием ем ом ой ей ий ый ое
+ая яя ую юю ого его ому ему ыми ими ых их ешь ет ют ут ем ете ишь ит ят им ите
+ала ило али ыла ыли ила или ать ять ить еть уть ться тся ла ли ло ия ие ье ья
+ию ью а я о е и ы у ю ь й
+""".split()), key=len, reverse=True))
+_MIN_STEM = 3
+_VOWELS = frozenset("аеиоуыэюя")
+
+
+def _stem(word: str) -> str:
+    """Лёгкий стемминг: отрезает одно окончание, основа >= 3 букв и с гласной."""
+    # Возвратные глаголы: поссорилась -> поссорила -> поссорил
+    if word.endswith(("ся", "сь")) and len(word) - 2 >= _MIN_STEM + 1:
+        word = word[:-2]
+    for suf in _SUFFIXES:
+        if word.endswith(suf) and len(word) - len(suf) >= _MIN_STEM:
+            stem = word[: -len(suf)]
+            if _VOWELS.intersection(stem):
+                return stem
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    """Текст -> список основ (без стоп-слов и однобуквенных)."""
+    if not text:
+        return []
+    text = text.lower().replace("ё", "е")
+    return [
+        _stem(w) for w in _TOKEN_RE.findall(text)
+        if len(w) > 1 and w not in _STOPWORDS
+    ]
+
+
+@dataclass
+class _UserIndex:
+    """Инвертированный индекс эпизодов одного пользователя."""
+
+    postings: dict[str, dict[int, int]] = field(default_factory=dict)
+    doc_len: dict[int, int] = field(default_factory=dict)
+    total_len: int = 0
+
+    def add(self, episode_id: int, text_fields: tuple[str, str, str]) -> None:
+        if episode_id in self.doc_len:
+            self.remove(episode_id)
+        title, summary, insight = text_fields
+        tokens = tokenize(title) * _TITLE_WEIGHT + tokenize(summary) + tokenize(insight)
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, {})[episode_id] = tf
+        self.doc_len[episode_id] = len(tokens)
+        self.total_len += len(tokens)
+
+    def remove(self, episode_id: int) -> None:
+        length = self.doc_len.pop(episode_id, None)
+        if length is None:
+            return
+        self.total_len -= length
+        for term in [t for t, docs in self.postings.items() if episode_id in docs]:
+            del self.postings[term][episode_id]
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def search(self, query: str) -> list[tuple[int, float]]:
+        """[(episode_id, score)] по убыванию score, только score > 0."""
+        n = len(self.doc_len)
+        if not n:
+            return []
+        avg_len = self.total_len / n or 1.0
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = 1 - _B + _B * self.doc_len[doc_id] / avg_len
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (_K1 + 1) / (
+                    tf + _K1 * norm
+                )
+        return sorted(scores.items(), key=lambda x: (-x[1], -x[0]))
+
+
+_indexes: dict[int, _UserIndex] = {}
+
+
+def _fields(row: dict) -> tuple[str, str, str]:
+    return row.get("title") or "", row.get("summary") or "", row.get("key_insight") or ""
+
+
+def add_episode(
+    telegram_id: int,
+    episode_id: int,
+    title: str,
+    summary: str = "",
+    key_insight: Optional[str] = None,
+) -> None:
+    """Инкрементальное добавление (вызывается после записи эпизода в БД).
+
+    Если индекс юзера ещё не построен — ничего не делаем, sync построит его целиком.
+    """
+    index = _indexes.get(telegram_id)
+    if index is not None:
+        index.add(episode_id, (title or "", summary or "", key_insight or ""))
+
+
+async def sync(telegram_id: int, headers: list[dict]) -> _UserIndex:
+    """Сверяет индекс с заголовками из БД: догружает новые, убирает удалённые."""
+    index = _indexes.setdefault(telegram_id, _UserIndex())
+    wanted = {h["id"] for h in headers}
+    for stale in set(index.doc_len) - wanted:
+        index.remove(stale)
+    missing = sorted(wanted - set(index.doc_len))
+    if missing:
+        for row in await database.get_episodes_by_ids(missing):
+            index.add(row["id"], _fields(row))
+    return index
+
+
+async def search(
+    telegram_id: int,
+    query: str,
+    headers: list[dict],
+) -> list[tuple[int, float]]:
+    """BM25-поиск по эпизодам пользователя. headers — актуальный список из БД."""
+    index = await sync(telegram_id, headers)
+    return index.search(query)
+
+
+def drop(telegram_id: int) -> None:
+    """Забыть индекс пользователя."""
+    _indexes.pop(telegram_id, None)
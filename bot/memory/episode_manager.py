@@ -6,13 +6,20 @@ import re
 from datetime import datetime, timezone
 from typing import Optional
 
+from shared import degradation
+from shared.config import EPISODE_LLM_RERANK, EPISODE_RETRIEVER
 from shared.llm_client import LLMError, call_gpt
 from shared.models import Episode
-from bot.memory import database
+from bot.memory import database, episode_index
 from bot.prompts.memory_prompts import EPISODE_SELECTION_PROMPT, EPISODE_SUMMARY_PROMPT
 
 logger = logging.getLogger(__name__)
 
+# Re-rank: сколько лучших BM25-кандидатов показать GPT
+_RERANK_POOL = 8
+# Неоднозначно, если кандидат за границей limit почти не уступает последнему вошедшему
+_RERANK_MARGIN = 0.85
+
 
 def _now() -> str:
     """UTC datetime строкой."""
@@ -212,6 +219,9 @@ async def create_episode(telegram_id: int, messages: list[dict]) -> Episode:
     )
 
     episode.id = episode_id
+    episode_index.add_episode(
+        telegram_id, episode_id, episode.title, episode.summary, episode.key_insight,
+    )
     logger.info(
         "create_episode: user=%s episode_id=%d title=%r",
         telegram_id, episode_id, episode.title,
@@ -223,16 +233,61 @@ async def find_relevant_episodes(
     telegram_id: int,
     current_message: str,
     limit: int = 3,
+    headers: Optional[list[dict]] = None,
 ) -> list[Episode]:
     """Находит релевантные эпизоды для текущего сообщения.
 
-    Использует LLM для семантического подбора.
-    При LLMError или невалидном JSON — keyword fallback.
+    По умолчанию — локальный BM25 (episode_index), без LLM.
+    EPISODE_LLM_RERANK: неоднозначный топ BM25 уточняет GPT.
+    EPISODE_RETRIEVER='llm': GPT выбирает по всем заголовкам (старый режим).
+    headers — уже загруженные заголовки (из снимка контекста), иначе из БД.
+    Под перегрузкой (degradation) GPT не зовётся: ключевые слова / BM25.
     """
-    headers = await database.get_episode_headers(telegram_id)
+    if headers is None:
+        headers = await database.get_episode_headers(telegram_id)
     if not headers:
         return []
 
+    use_llm = degradation.policy().llm_episode_selection
+    if EPISODE_RETRIEVER == "llm":
+        if use_llm:
+            selected_ids = await _llm_select(telegram_id, current_message, headers, limit)
+        else:
+            selected_ids = _keyword_fallback(current_message, headers, limit)
+    else:
+        hits = await episode_index.search(telegram_id, current_message, headers)
+        selected_ids = [ep_id for ep_id, _ in hits[:limit]]
+        if use_llm and EPISODE_LLM_RERANK and _is_ambiguous(hits, limit):
+            by_id = {h["id"]: h for h in headers}
+            pool = [by_id[ep_id] for ep_id, _ in hits[:_RERANK_POOL] if ep_id in by_id]
+            selected_ids = await _llm_select(
+                telegram_id, current_message, pool, limit,
+            ) or selected_ids
+
+    if not selected_ids:
+        return []
+
+    rows = await database.get_episodes_by_ids(selected_ids)
+    # IN (...) не сохраняет порядок — возвращаем в порядке релевантности
+    rank = {ep_id: i for i, ep_id in enumerate(selected_ids)}
+    rows.sort(key=lambda r: rank.get(r["id"], len(rank)))
+    return [_map_dict_to_episode(row) for row in rows]
+
+
+def _is_ambiguous(hits: list[tuple[int, float]], limit: int) -> bool:
+    """Граница топа размыта: кандидат №limit+1 почти равен №limit."""
+    if len(hits) <= limit or limit <= 0:
+        return False
+    return hits[limit][1] >= hits[limit - 1][1] * _RERANK_MARGIN
+
+
+async def _llm_select(
+    telegram_id: int,
+    current_message: str,
+    headers: list[dict],
+    limit: int,
+) -> list[int]:
+    """GPT выбирает эпизоды по заголовкам. При LLMError / невалидном JSON — keyword fallback."""
     # Нумерованный список заголовков
     episode_list = "\n".join(
         f"{i + 1} \u2014 {h['title']}" for i, h in enumerate(headers)
@@ -249,6 +304,7 @@ async def find_relevant_episodes(
             messages=[{"role": "user", "content": prompt}],
             max_tokens=100,
             response_format={"type": "json_object"},
+            cache="episode_selection",
         )
         data = json.loads(response)
         selected_numbers = data.get("selected", [])
@@ -272,11 +328,7 @@ async def find_relevant_episodes(
         )
         selected_ids = _keyword_fallback(current_message, headers, limit)
 
-    if not selected_ids:
-        return []
-
-    rows = await database.get_episodes_by_ids(selected_ids)
-    return [_map_dict_to_episode(row) for row in rows]
+    return selected_ids
 
 
 async def get_episode_titles(telegram_id: int) -> list[str]:
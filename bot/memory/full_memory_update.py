@@ -20,7 +20,8 @@ import json
 import logging
 from datetime import datetime, timezone
 
-from shared.llm_client import LLMError, call_gpt
+from shared.config import GPT_MODEL
+from shared.llm_client import LLMError, call_gpt, llm_available
 from shared.models import FullUpdateResult, ProfileDiff
 from bot.memory import database
 from bot.memory import profile_manager
@@ -132,6 +133,14 @@ async def run_full_memory_update() -> list[FullUpdateResult]:
     results: list[FullUpdateResult] = []
 
     for tid in user_ids:
+        if not llm_available("openai", GPT_MODEL):
+            # Провайдер отключён breaker'ом — остальные остаются с
+            # needs_full_update=1 до следующего запуска
+            logger.warning(
+                "Full update paused: LLM circuit open, %d users deferred",
+                len(user_ids) - len(results),
+            )
+            break
         try:
             result = await update_single_user(tid)
             if result.error:
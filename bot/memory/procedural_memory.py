@@ -52,8 +52,11 @@ async def get_procedural(telegram_id: int) -> Optional[ProceduralMemory]:
     row = await database.get_procedural(telegram_id)
     if row is None:
         return None
+    return _parse_procedural(telegram_id, row.get("memory_json"))
 
-    memory_json = row.get("memory_json")
+
+def _parse_procedural(telegram_id: int, memory_json) -> Optional[ProceduralMemory]:
+    """memory_json -> ProceduralMemory. None если пусто или невалидно."""
     if memory_json is None:
         return None
 
@@ -140,7 +143,19 @@ async def get_procedural_as_text(
     memory = _memory if _memory is not None else await get_procedural(telegram_id)
     if memory is None:
         return ""
+    return _procedural_to_text(memory)
+
+
+def format_procedural_json(telegram_id: int, memory_json: Optional[dict]) -> str:
+    """Как get_procedural_as_text, но из уже загруженного memory_json (без БД)."""
+    memory = _parse_procedural(telegram_id, memory_json)
+    if memory is None:
+        return ""
+    return _procedural_to_text(memory)
+
 
+def _procedural_to_text(memory: ProceduralMemory) -> str:
+    """Текст процедурной памяти в бюджете _MAX_TOKENS ('' если данных нет)."""
     lines: list[str] = []
     lines.append("=== КАК С НЕЙ РАБОТАТЬ ===")
 
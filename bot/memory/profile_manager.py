@@ -6,8 +6,8 @@
     Выход: SemanticProfile | None | str
     Ошибки: ValueError (профиль/версия не найдены), aiosqlite.Error (пробрасываем)
 
-5 функций: create_empty_profile, get_profile, update_profile,
-           rollback_profile, get_profile_as_text.
+6 функций: create_empty_profile, get_profile, update_profile,
+           rollback_profile, get_profile_as_text, format_profile_json.
 """
 
 import logging
@@ -111,8 +111,15 @@ async def get_profile(telegram_id: int) -> Optional[SemanticProfile]:
     row = await database.get_profile(telegram_id)
     if row is None:
         return None
+    return _parse_profile(telegram_id, row["profile_json"])
+
+
+def _parse_profile(telegram_id: int, profile_json) -> Optional[SemanticProfile]:
+    """profile_json -> SemanticProfile. None если пусто или ошибка парсинга."""
+    if profile_json is None:
+        return None
     try:
-        return SemanticProfile(**row["profile_json"])
+        return SemanticProfile(**profile_json)
     except (TypeError, ValidationError):
         logger.error(
             "get_profile: ошибка парсинга profile_json для user=%s",
@@ -235,7 +242,24 @@ async def get_profile_as_text(telegram_id: int) -> str:
     profile = await get_profile(telegram_id)
     if profile is None:
         return ""
+    return _profile_prompt_text(telegram_id, profile)
+
+
+# -------------------------------------------------------------------------
+# 6. format_profile_json
+# -------------------------------------------------------------------------
+
+
+def format_profile_json(telegram_id: int, profile_json: Optional[dict]) -> str:
+    """Как get_profile_as_text, но из уже загруженного profile_json (без БД)."""
+    profile = _parse_profile(telegram_id, profile_json)
+    if profile is None:
+        return ""
+    return _profile_prompt_text(telegram_id, profile)
+
 
+def _profile_prompt_text(telegram_id: int, profile: SemanticProfile) -> str:
+    """Текст профиля в бюджете _MAX_PROFILE_TOKENS."""
     text = _profile_to_text(profile)
     tokens = _estimate_tokens(text)
 
@@ -106,6 +106,7 @@ async def evaluate_phase(
             messages=[{"role": "user", "content": prompt}],
             max_tokens=300,
             response_format={"type": "json_object"},
+            cache="evaluate_phase",
         )
         data = json.loads(response)
         result = PhaseEvaluation(**data)
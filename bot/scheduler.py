@@ -10,15 +10,38 @@ from __future__ import annotations
 
 import logging
 from datetime import time, timedelta, timezone
+from time import monotonic
 
 from bot.analytics.feedback_collector import check_pending_feedback
 from bot.daily_messenger import send_daily_messages, check_silence
 from bot.memory.full_memory_update import run_full_memory_update
+from shared import metrics
 
 logger = logging.getLogger(__name__)
 
 MOSCOW_TZ = timezone(timedelta(hours=3))
 
+_JOB_SECONDS = metrics.histogram(
+    "scheduler_job_seconds", "Длительность фоновой задачи",
+    ("job", "outcome"), buckets=metrics.JOB_BUCKETS,
+)
+
+
+def _timed(name: str, job):
+    """Обёртка задачи job_queue: длительность и исход в scheduler_job_seconds."""
+
+    async def run(context) -> None:
+        t0 = monotonic()
+        outcome = "error"
+        try:
+            await job(context)
+            outcome = "ok"
+        finally:
+            _JOB_SECONDS.observe(monotonic() - t0, name, outcome)
+
+    run.__name__ = name
+    return run
+
 
 async def _full_memory_update_job(context) -> None:
     """Обёртка для run_full_memory_update (не принимает context)."""
@@ -31,14 +54,14 @@ def setup_scheduler(app) -> None:
 
     # 1. Ежедневные сообщения — 19:00 MSK
     job_queue.run_daily(
-        send_daily_messages,
+        _timed("send_daily_messages", send_daily_messages),
         time=time(hour=19, minute=0, tzinfo=MOSCOW_TZ),
         name="send_daily_messages",
     )
 
     # 2. Проверка тишины — каждые 6 часов
     job_queue.run_repeating(
-        check_silence,
+        _timed("check_silence", check_silence),
         interval=timedelta(hours=6),
         first=timedelta(minutes=10),
         name="check_silence",
@@ -46,7 +69,7 @@ def setup_scheduler(app) -> None:
 
     # 3. Полное обновление памяти — каждые 5 минут
     job_queue.run_repeating(
-        _full_memory_update_job,
+        _timed("full_memory_update", _full_memory_update_job),
         interval=timedelta(minutes=5),
         first=timedelta(minutes=2),
         name="full_memory_update",
@@ -54,7 +77,7 @@ def setup_scheduler(app) -> None:
 
     # 4. Проверка pending feedback — каждые 30 минут
     job_queue.run_repeating(
-        check_pending_feedback,
+        _timed("check_pending_feedback", check_pending_feedback),
         interval=timedelta(minutes=30),
         first=timedelta(minutes=5),
         name="check_pending_feedback",
@@ -1,11 +1,18 @@
 """Конвейер обработки сообщений -- 14 шагов от получения до ответа Евы.
 
 Публичный API:
-    process_message(telegram_id, message_id, text, user_name, is_voice) -> str | None
+    process_message(telegram_id, message_id, text, user_name, is_voice, on_delta) -> str | None
 
 Гарантии:
 - Идемпотентность по message_id (None если уже обработано)
 - Мьютекс на пользователя (одновременно один запрос)
+- Склейка пачек: сообщения, пришедшие в пределах COALESCE_WINDOW_MS или пока
+  генерируется ответ, идут одним ходом (один build_context, один вызов LLM).
+  Каждое сообщение сохраняется и помечается processed отдельно; ответ
+  возвращает вызов последнего сообщения пачки, остальные получают None
+- Атомарность хода: все записи коммитятся одной транзакцией (database.transaction)
+- LLM-вызовы хода идут классом interactive планировщика (shared.llm_client),
+  фоновые задачи хода — background
 - НИКОГДА не бросает исключение вызывающему -- всегда FALLBACK или кризисный ответ
 """
 from __future__ import annotations
@@ -14,6 +21,8 @@ import asyncio
 import logging
 import re
 import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 
 from bot.analytics.alerter import alerter
@@ -30,22 +39,44 @@ from bot.memory.database import (
     is_message_processed,
     mark_message_processed,
     update_user,
+    _now as _db_now,
 )
 from bot.memory.full_memory_update import update_single_user
 from bot.prompts.phase_evaluator import evaluate_phase
+from bot.update_processor import release_turn
 from shared.config import (
     CLAUDE_TIMEOUT,
+    COALESCE_CANCEL_INFLIGHT,
+    COALESCE_WINDOW_MS,
+    DIALOG_BACKUP_PROVIDER,
     DIALOG_GPT_MODEL,
     DIALOG_PROVIDER,
     FALLBACK_RESPONSE,
     RATE_LIMIT_PER_MINUTE,
 )
-from shared.llm_client import LLMError, call_claude, call_gemini, call_gpt
+from shared.llm_client import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    Attempt,
+    LLMError,
+    StreamAttempt,
+    call_claude,
+    call_gemini,
+    call_gpt,
+    hedged_call,
+    hedged_stream,
+    llm_priority,
+    stream_claude,
+    stream_gemini,
+    stream_gpt,
+)
 from shared.safety import (
     CRISIS_INSTRUCTION_LEVEL2,
     CRISIS_RESPONSE_LEVEL3,
     detect_crisis,
 )
+from shared import degradation, metrics
+from shared.tracing import span, trace
 
 logger = logging.getLogger(__name__)
 
@@ -53,10 +84,48 @@ logger = logging.getLogger(__name__)
 # Модуль-уровневое состояние
 # ---------------------------------------------------------------------------
 
+# Колбэк стриминга: получает накопленный текст ответа по мере генерации
+OnDelta = Callable[[str], Awaitable[None]]
+
 _user_locks: dict[int, asyncio.Lock] = {}
 _rate_counters: dict[int, list[float]] = {}  # telegram_id -> [timestamps]
 _consecutive_errors: dict[int, int] = {}
 
+COALESCE_WINDOW_S = COALESCE_WINDOW_MS / 1000
+
+_FALLBACKS = metrics.counter(
+    "fallback_responses_total", "Ответы-заглушки вместо LLM", ("source",),
+)
+_CRISIS_LEVELS = metrics.counter(
+    "crisis_detected_total", "Уровень кризиса по ходам (0 — нет)", ("level",),
+)
+
+
+@dataclass
+class _Incoming:
+    """Сообщение, ждущее своего хода."""
+
+    message_id: int
+    text: str
+    is_voice: bool
+    # Исход для ожидающего: ответ хода / None (склеено) / _LEAD (стань ведущим)
+    future: asyncio.Future = field(repr=False)
+
+
+@dataclass
+class _Turn:
+    """Ход в работе: пачка сообщений + задача генерации."""
+
+    batch: list[_Incoming]
+    task: asyncio.Task | None = None
+    cancellable: bool = True  # False после первой дельты / готового ответа
+    obsolete: bool = False
+
+
+_LEAD = object()
+_inboxes: dict[int, list[_Incoming]] = {}  # telegram_id -> ждущие сообщения
+_inflight: dict[int, _Turn] = {}
+
 # ---------------------------------------------------------------------------
 # Фазовая система
 # ---------------------------------------------------------------------------
@@ -107,20 +176,156 @@ _FALLBACK_VARIANTS: list[str] = [
 _FALLBACK_PERSISTENT = "Кажется, у меня что-то сломалось. Попробуй чуть позже, ладно? 💛"
 
 
+# ===========================================================================
+# Вызов диалоговой модели
+# ===========================================================================
+
+
+_GEMINI_DIALOG_MODELS = {
+    "gemini-flash": "gemini-2.5-flash",
+    "gemini-pro": "gemini-2.5-pro",
+}
+
+
+def _dialog_attempt(
+    provider: str,
+    messages: list[dict],
+    system_blocks: list[str],
+    system_prompt: str,
+    fallback: bool,
+    max_tokens: int = 400,
+) -> Attempt:
+    """(provider, фабрика вызова) для hedged_call. Claude — блоками (кэш), прочие — строкой."""
+    if provider == "openai":
+        return provider, lambda: call_gpt(
+            messages=messages,
+            system=system_prompt,
+            max_tokens=max_tokens,
+            model_override=DIALOG_GPT_MODEL,
+        )
+    if provider in _GEMINI_DIALOG_MODELS:
+        return provider, lambda: call_gemini(
+            messages=messages,
+            system=system_prompt,
+            max_tokens=max_tokens,
+            model_override=_GEMINI_DIALOG_MODELS[provider],
+        )
+    return provider, lambda: call_claude(
+        messages=messages,
+        system=system_blocks,
+        max_tokens=max_tokens,
+        timeout=CLAUDE_TIMEOUT,
+        fallback=fallback,
+    )
+
+
+def _dialog_stream_attempt(
+    provider: str,
+    messages: list[dict],
+    system_blocks: list[str],
+    system_prompt: str,
+    max_tokens: int = 400,
+) -> StreamAttempt:
+    """(provider, фабрика стрима) для hedged_stream."""
+    if provider == "openai":
+        return provider, lambda: stream_gpt(
+            messages=messages,
+            system=system_prompt,
+            max_tokens=max_tokens,
+            model_override=DIALOG_GPT_MODEL,
+        )
+    if provider in _GEMINI_DIALOG_MODELS:
+        return provider, lambda: stream_gemini(
+            messages=messages,
+            system=system_prompt,
+            max_tokens=max_tokens,
+            model_override=_GEMINI_DIALOG_MODELS[provider],
+        )
+    return provider, lambda: stream_claude(
+        messages=messages,
+        system=system_blocks,
+        max_tokens=max_tokens,
+        timeout=CLAUDE_TIMEOUT,
+    )
+
+
+async def _call_dialog(
+    messages: list[dict],
+    system_blocks: list[str],
+    system_prompt: str,
+    max_tokens: int = 400,
+) -> str:
+    """Ответ DIALOG_PROVIDER целиком; с DIALOG_BACKUP_PROVIDER — через hedged_call."""
+    backup = None
+    if DIALOG_BACKUP_PROVIDER:
+        backup = _dialog_attempt(
+            DIALOG_BACKUP_PROVIDER, messages, system_blocks, system_prompt,
+            fallback=False, max_tokens=max_tokens,
+        )
+    primary = _dialog_attempt(
+        DIALOG_PROVIDER, messages, system_blocks, system_prompt,
+        fallback=backup is None, max_tokens=max_tokens,
+    )
+    return await hedged_call(primary, backup)
+
+
+async def _stream_dialog(
+    messages: list[dict],
+    system_blocks: list[str],
+    system_prompt: str,
+    on_delta: OnDelta,
+    max_tokens: int = 400,
+) -> str | None:
+    """Стрим ответа DIALOG_PROVIDER (с hedging по первому токену, если задан
+    DIALOG_BACKUP_PROVIDER); on_delta получает накопленный текст.
+
+    None — стрим упал или пуст до первой дельты (вызывающий идёт в _call_dialog
+    с его retry). Ошибка после первой дельты -> LLMError.
+    """
+    backup = None
+    if DIALOG_BACKUP_PROVIDER:
+        backup = _dialog_stream_attempt(
+            DIALOG_BACKUP_PROVIDER, messages, system_blocks, system_prompt, max_tokens,
+        )
+    stream = hedged_stream(
+        _dialog_stream_attempt(
+            DIALOG_PROVIDER, messages, system_blocks, system_prompt, max_tokens,
+        ),
+        backup,
+    )
+
+    text = ""
+    try:
+        async for delta in stream:
+            text += delta
+            await on_delta(text)
+    except LLMError as e:
+        if text:
+            raise
+        logger.warning("_stream_dialog: stream failed before first token: %s", e)
+        return None
+    return text or None
+
+
 # ===========================================================================
 # Публичный API
 # ===========================================================================
 
 
+@llm_priority(PRIORITY_INTERACTIVE)
 async def process_message(
     telegram_id: int,
     message_id: int,
     text: str,
     user_name: str | None,
     is_voice: bool = False,
+    on_delta: OnDelta | None = None,
 ) -> str | None:
     """Главный конвейер обработки сообщения.
 
+    on_delta: если задан — ответ LLM стримится, колбэк получает накопленный
+    текст. Возвращаемое значение — всё равно финальный (обрезанный) ответ.
+
     Returns:
         Строка с ответом Евы, или None если сообщение уже обработано (идемпотентность).
     """
@@ -132,54 +337,199 @@ async def process_message(
         if await is_message_processed(message_id):
             return None
 
+        inbox = _inboxes.setdefault(telegram_id, [])
+        if any(e.message_id == message_id for e in inbox):
+            return None  # повторная доставка того же апдейта
+        entry = _Incoming(
+            message_id, text, is_voice,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        inbox.append(entry)
+        # Порядок зафиксирован в inbox — следующий апдейт юзера может входить
+        release_turn()
+        _cancel_obsolete(telegram_id)
+
+        try:
+            return await _coalesce(telegram_id, entry, user_name, start_time, on_delta)
+        finally:
+            _discard(telegram_id, entry)
+    except Exception:
+        logger.exception("ALERT: unhandled_error user %s", telegram_id)
+        _FALLBACKS.inc("unhandled_error")
+        return _get_fallback_response(telegram_id)
+
+
+# ===========================================================================
+# Склейка пачек сообщений
+# ===========================================================================
+
+
+def _is_last(telegram_id: int, entry: _Incoming) -> bool:
+    inbox = _inboxes.get(telegram_id)
+    return bool(inbox) and inbox[-1] is entry
+
+
+def _cancel_obsolete(telegram_id: int) -> None:
+    """Новое сообщение делает генерацию в работе устаревшей — отменяем её.
+
+    Только пока ход ещё ничего не показал пользователю и не получил ответ:
+    записи хода откатятся, его сообщения вернутся в inbox и уйдут в новый ход.
+    """
+    turn = _inflight.get(telegram_id)
+    if (
+        COALESCE_CANCEL_INFLIGHT
+        and turn is not None
+        and turn.cancellable
+        and turn.task is not None
+        and not turn.task.done()
+    ):
+        logger.info(
+            "coalesce: cancel obsolete turn user %s (%d msgs)",
+            telegram_id, len(turn.batch),
+        )
+        turn.obsolete = True
+        turn.task.cancel()
+
+
+def _discard(telegram_id: int, entry: _Incoming) -> None:
+    """Выход вызова: убрать своё сообщение, если оно так и не ушло в ход.
+
+    Если это был последний в очереди — ведущим становится новый последний.
+    """
+    inbox = _inboxes.get(telegram_id)
+    if not inbox or entry not in inbox:
+        return
+    inbox.remove(entry)
+    if not inbox:
+        del _inboxes[telegram_id]
+    elif not inbox[-1].future.done():
+        inbox[-1].future.set_result(_LEAD)
+
+
+async def _coalesce(
+    telegram_id: int,
+    entry: _Incoming,
+    user_name: str | None,
+    start_time: float,
+    on_delta: OnDelta | None,
+) -> str | None:
+    """Debounce + выбор ведущего: ход делает вызов последнего сообщения пачки."""
+    if COALESCE_WINDOW_S > 0:
+        await asyncio.sleep(COALESCE_WINDOW_S)
+
+    while True:
+        if not entry.future.done() and not _is_last(telegram_id, entry):
+            # Пришло сообщение новее — его вызов ответит за всю пачку
+            await asyncio.shield(entry.future)
+        if entry.future.done():
+            outcome = entry.future.result()
+            if outcome is not _LEAD:
+                return outcome
+            entry.future = asyncio.get_running_loop().create_future()
+
         # --- Step 3: Mutex (per-user lock) ---
         async with _get_user_lock(telegram_id):
-            return await _process_under_lock(
+            if entry.future.done() or not _is_last(telegram_id, entry):
+                continue  # пока ждали мьютекс, пачка ушла или выросла
+            batch = _inboxes.pop(telegram_id)
+            turn = _Turn(batch=batch)
+            _inflight[telegram_id] = turn
+            turn.task = asyncio.get_running_loop().create_task(_run_turn(
+                turn, telegram_id, user_name, start_time, on_delta,
+            ))
+            try:
+                response = await turn.task
+            except asyncio.CancelledError:
+                current = asyncio.current_task()
+                if not turn.obsolete or (current is not None and current.cancelling()):
+                    raise
+                # Записи хода откатились — сообщения снова в очереди, перед новыми
+                _inboxes[telegram_id] = batch + _inboxes.get(telegram_id, [])
+                continue
+            finally:
+                if _inflight.get(telegram_id) is turn:
+                    del _inflight[telegram_id]
+                if not turn.obsolete:
+                    for e in batch:
+                        if e is not entry and not e.future.done():
+                            e.future.set_result(None)
+            return response
+
+
+async def _run_turn(
+    turn: _Turn,
+    telegram_id: int,
+    user_name: str | None,
+    start_time: float,
+    on_delta: OnDelta | None,
+) -> str | None:
+    """Один ход за пачку: транзакция + шаги 4-14."""
+    if on_delta is not None:
+        deliver = on_delta
+
+        async def on_delta(text: str) -> None:
+            turn.cancellable = False  # пользователь уже видит ответ
+            await deliver(text)
+
+    # Unit of work: сообщения, processed-маркеры, ответ, счётчики и
+    # daily-флаг коммитятся одной транзакцией при выходе из блока
+    # Трасса по последнему сообщению пачки (ход отвечает на него)
+    async with trace(turn.batch[-1].message_id, telegram_id):
+        async with database.transaction() as tx:
+            response = await _process_under_lock(
+                tx=tx,
+                turn=turn,
                 telegram_id=telegram_id,
-                message_id=message_id,
-                text=text,
                 user_name=user_name,
-                is_voice=is_voice,
                 start_time=start_time,
+                on_delta=on_delta,
             )
-    except Exception:
-        logger.exception("ALERT: unhandled_error user %s", telegram_id)
-        return _get_fallback_response(telegram_id)
+            turn.cancellable = False  # дальше только COMMIT
+    degradation.observe_turn(time.monotonic() - start_time)
+    return response
 
 
 async def _process_under_lock(
     *,
+    tx: database.UnitOfWork,
+    turn: _Turn,
     telegram_id: int,
-    message_id: int,
-    text: str,
     user_name: str | None,
-    is_voice: bool,
     start_time: float,
+    on_delta: OnDelta | None,
 ) -> str | None:
-    """Обработка внутри мьютекса -- шаги 4-14."""
+    """Обработка внутри мьютекса -- шаги 4-14, один ход на пачку turn.batch.
+
+    Записи шагов 6-14 копятся в tx и коммитятся вызывающим одной транзакцией;
+    фоновые задачи стартуют только после COMMIT (tx.after_commit).
+    """
+    batch = turn.batch
+    # Классификатор, контекст и память видят пачку как одну реплику
+    text = "\n".join(e.text for e in batch)
+    # Под перегрузкой часть работы хода отключена (кризис L3 не затрагивается)
+    policy = degradation.policy()
 
     # --- Step 4: Get/create user + calculate pause ---
-    user = await get_user(telegram_id)
-    if not user:
-        user = await create_user(telegram_id, name=user_name)
+    with span("get_user"):
+        user = await get_user(telegram_id)
+        if not user:
+            user = await create_user(telegram_id, name=user_name)
 
     # pause_minutes используется build_context (читает last_message_at из БД)
 
     # --- Step 5: Voice already transcribed in handlers -- skip ---
 
     # --- Step 6: Crisis detection ---
-    crisis = await detect_crisis(text)
+    with span("crisis"):
+        crisis = await detect_crisis(text)
+    _CRISIS_LEVELS.inc(str(crisis.level))
 
     if crisis.level == 3:
-        await add_message(
-            telegram_id, "user", text,
-            source="user", is_voice=int(is_voice),
-        )
+        await _save_batch(telegram_id, batch)
         await add_message(
             telegram_id, "assistant", CRISIS_RESPONSE_LEVEL3,
             source="crisis",
         )
-        await mark_message_processed(message_id, telegram_id)
         logger.error(
             "ALERT: crisis_level_3 user %s trigger=%s",
             telegram_id, crisis.trigger,
@@ -191,31 +541,40 @@ async def _process_under_lock(
     if not _check_rate_limit(telegram_id):
         return "Ой, ты так быстро пишешь! Дай мне секунду собраться с мыслями 😅"
 
-    # --- Step 8: Save message + mark processed ---
-    await add_message(
-        telegram_id, "user", text,
-        source="user", is_voice=int(is_voice),
-    )
-    await mark_message_processed(message_id, telegram_id)
+    # --- Step 8: Save messages + mark processed (в tx, коммит в конце хода) ---
+    user_msg_at = _db_now()
+    with span("save_batch"):
+        await _save_batch(telegram_id, batch)
 
     # --- Step 9: Build context ---
     try:
-        system_prompt, token_count, meta = await build_context(telegram_id, text)
+        with span("build_context"):
+            system_prompt, token_count, meta = await build_context(telegram_id, text)
     except Exception:
         logger.exception("build_context failed for %s", telegram_id)
         await alerter.check(telegram_id, "consecutive_empty_context")
+        _FALLBACKS.inc("build_context")
         return _get_fallback_response(telegram_id)
 
     # --- Step 10: Call Claude ---
 
+    # Блоки для prompt caching; ситуативные добавки — в последний (волатильный)
+    system_blocks = list(meta.system_blocks) or [system_prompt]
+
     # Если crisis level 2, добавляем инструкцию в системный промпт
     if crisis.level == 2:
-        system_prompt += f"\n\n{CRISIS_INSTRUCTION_LEVEL2}"
+        system_blocks[-1] += f"\n\n{CRISIS_INSTRUCTION_LEVEL2}"
 
     # UX #10: Post-crisis контекст
-    recent = await get_recent_messages(telegram_id, limit=12)
+    # Сообщения хода ещё не закоммичены — добавляем их в историю сами
+    with span("history"):
+        recent = await get_recent_messages(telegram_id, limit=policy.history_limit)
+    recent = [
+        *recent,
+        *({"role": "user", "content": e.text, "created_at": user_msg_at} for e in batch),
+    ]
     if _was_recent_crisis(recent):
-        system_prompt += (
+        system_blocks[-1] += (
             "\n\nПользовательница недавно была в кризисном состоянии. "
             "Мягко спроси как она сейчас, не давя."
         )
@@ -237,35 +596,22 @@ async def _process_under_lock(
         messages_for_claude.append({"role": m["role"], "content": content})
         prev_time = curr_time
 
+    system_prompt = "\n\n".join(system_blocks)
+
     try:
-        if DIALOG_PROVIDER == "openai":
-            response = await call_gpt(
-                messages=messages_for_claude,
-                system=system_prompt,
-                max_tokens=400,
-                model_override=DIALOG_GPT_MODEL,
-            )
-        elif DIALOG_PROVIDER == "gemini-flash":
-            response = await call_gemini(
-                messages=messages_for_claude,
-                system=system_prompt,
-                max_tokens=400,
-                model_override="gemini-2.5-flash",
-            )
-        elif DIALOG_PROVIDER == "gemini-pro":
-            response = await call_gemini(
-                messages=messages_for_claude,
-                system=system_prompt,
-                max_tokens=400,
-                model_override="gemini-2.5-pro",
-            )
-        else:
-            response = await call_claude(
-                messages=messages_for_claude,
-                system=system_prompt,
-                max_tokens=400,
-                timeout=CLAUDE_TIMEOUT,
-            )
+        with span("dialog"):
+            response = None
+            if on_delta is not None:
+                response = await _stream_dialog(
+                    messages_for_claude, system_blocks, system_prompt, on_delta,
+                    max_tokens=policy.dialog_max_tokens,
+                )
+            if response is None:
+                response = await _call_dialog(
+                    messages_for_claude, system_blocks, system_prompt,
+                    max_tokens=policy.dialog_max_tokens,
+                )
+        turn.cancellable = False  # ответ оплачен — не выбрасываем
         _consecutive_errors.pop(telegram_id, None)  # сброс при успехе
         alerter.reset(telegram_id, "consecutive_errors")
         alerter.reset(telegram_id, "consecutive_empty_context")
@@ -278,15 +624,17 @@ async def _process_under_lock(
                 "ALERT: consecutive_errors user %s count=%d",
                 telegram_id, _consecutive_errors[telegram_id],
             )
+        _FALLBACKS.inc("llm_error")
         return _get_fallback_response(telegram_id)
 
     # --- Step 11: Save response + truncate if needed ---
     response = _truncate_response(response, max_len=4000)
     latency_ms = int((time.monotonic() - start_time) * 1000)
-    await add_message(
-        telegram_id, "assistant", response,
-        source="user", response_latency_ms=latency_ms,
-    )
+    with span("save_response"):
+        await add_message(
+            telegram_id, "assistant", response,
+            source="user", response_latency_ms=latency_ms,
+        )
     if latency_ms > 25_000:
         logger.error(
             "ALERT: latency_critical_ms user %s latency=%d",
@@ -296,7 +644,8 @@ async def _process_under_lock(
 
     # --- Step 11b: mark_daily_responded если юзер ответил на daily message ---
     try:
-        daily = await database.get_unresponded_daily(telegram_id)
+        with span("daily_responded"):
+            daily = await database.get_unresponded_daily(telegram_id)
         if daily and daily.get("sent_at"):
             sent_dt = datetime.fromisoformat(daily["sent_at"])
             if sent_dt.tzinfo is None:
@@ -310,29 +659,41 @@ async def _process_under_lock(
             "mark_daily_responded failed for %s", telegram_id, exc_info=True,
         )
 
-    # --- Step 12: ASYNC mini memory update (fire-and-forget) ---
-    asyncio.create_task(_mini_memory_update(telegram_id, text, response))
+    # --- Step 12: ASYNC mini memory update (fire-and-forget, после COMMIT) ---
+    tx.after_commit(
+        lambda: asyncio.create_task(_mini_memory_update(telegram_id, text, response))
+    )
 
     # --- Step 13: ASYNC phase check + memory update (every 10 messages) ---
-    messages_total = user.get("messages_total", 0) + 1
-    if messages_total % 10 == 0:
-        asyncio.create_task(_check_phase_transition(telegram_id, messages_total))
-        asyncio.create_task(_trigger_memory_update(telegram_id))
+    prev_total = user.get("messages_total", 0)
+    messages_total = prev_total + len(batch)
+    # Пачка может перешагнуть кратное 10 — считаем по пересечению
+    every_10th = messages_total // 10 > prev_total // 10
+    # Под перегрузкой не запускаем: needs_full_update ниже догонит планировщик
+    if every_10th and policy.phase_check:
+        tx.after_commit(lambda: asyncio.create_task(
+            _check_phase_transition(telegram_id, messages_total),
+        ))
+    if every_10th and policy.memory_update_trigger:
+        tx.after_commit(
+            lambda: asyncio.create_task(_trigger_memory_update(telegram_id))
+        )
 
     # --- Step 14: Update counters ---
     pause_minutes = _calc_pause_minutes(user.get("last_message_at"))
     if pause_minutes and pause_minutes >= 30:
         needs_update = 1  # Пауза > 30 мин — триггерим обновление памяти
-    elif messages_total % 10 == 0:
+    elif every_10th:
         needs_update = 1
     else:
         needs_update = 0
-    await update_user(
-        telegram_id,
-        last_message_at=_now(),
-        messages_total=messages_total,
-        needs_full_update=needs_update,
-    )
+    with span("update_counters"):
+        await update_user(
+            telegram_id,
+            last_message_at=_now(),
+            messages_total=messages_total,
+            needs_full_update=needs_update,
+        )
 
     return response
 
@@ -342,8 +703,22 @@ async def _process_under_lock(
 # ===========================================================================
 
 
+async def _save_batch(telegram_id: int, batch: list[_Incoming]) -> None:
+    """Каждое сообщение пачки — отдельной записью и отдельным processed-маркером."""
+    for e in batch:
+        await add_message(
+            telegram_id, "user", e.text,
+            source="user", is_voice=int(e.is_voice),
+        )
+        await mark_message_processed(e.message_id, telegram_id)
+
+
 def _get_user_lock(telegram_id: int) -> asyncio.Lock:
-    """Ленивое создание per-user мьютекса (атомарно через setdefault)."""
+    """Ленивое создание per-user мьютекса (атомарно через setdefault).
+
+    Порядок апдейтов держит bot.update_processor; мьютекс — страховка
+    для вызовов мимо него (планировщик, тесты, webhook без процессора).
+    """
     return _user_locks.setdefault(telegram_id, asyncio.Lock())
 
 
@@ -449,6 +824,7 @@ def _get_next_phase(current: str) -> str | None:
 # ===========================================================================
 
 
+@llm_priority(PRIORITY_BACKGROUND)
 async def _mini_memory_update(
     telegram_id: int,
     user_text: str,
@@ -499,10 +875,14 @@ async def _mini_memory_update(
         )
 
 
+@llm_priority(PRIORITY_BACKGROUND)
 async def _trigger_memory_update(telegram_id: int) -> None:
-    """Запускает полное обновление памяти (fire-and-forget, каждые 10 msg)."""
+    """Запускает полное обновление памяти (fire-and-forget, каждые 10 msg).
+
+    needs_full_update сбрасывает финализация update_single_user — отдельная
+    запись здесь не нужна (и в group commit перетирала флаг текущего хода).
+    """
     try:
-        await update_user(telegram_id, needs_full_update=0)
         await update_single_user(telegram_id)
     except Exception:
         logger.warning(
@@ -511,6 +891,7 @@ async def _trigger_memory_update(telegram_id: int) -> None:
         )
 
 
+@llm_priority(PRIORITY_BACKGROUND)
 async def _check_phase_transition(telegram_id: int, messages_total: int) -> None:
     """Проверка фазового перехода через LLM. Запускается в фоне каждые 5 сообщений."""
     try:
@@ -0,0 +1,219 @@
+"""Параллельная обработка Telegram-апдейтов с порядком внутри пользователя.
+
+Апдейты разных пользователей обрабатываются одновременно, апдейты одного
+пользователя (шард = telegram_id) — строго по очереди прихода.
+
+Два ограничения:
+    max_pending     — сколько апдейтов принято в работу (ждут + выполняются);
+                      семафор BaseUpdateProcessor, дальше апдейты копятся
+                      в update_queue приложения;
+    max_concurrent  — сколько хэндлеров реально выполняется одновременно.
+                      Слот берётся только когда подошла очередь пользователя,
+                      поэтому ждущий своей очереди апдейт слот не занимает.
+
+Порядок держится на FIFO-очередях asyncio.Lock/Semaphore: задачи апдейтов
+создаются приложением в порядке прихода и встают в очередь до первого await.
+
+Хэндлер может отпустить очередь пользователя раньше конца (release_turn) —
+когда порядок уже зафиксирован у него самого (склейка пачек в session_manager).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from shared import metrics
+from shared.config import UPDATE_CONCURRENCY, UPDATE_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+_WAIT_SECONDS = metrics.histogram(
+    "update_wait_seconds", "Ожидание апдейта в очереди пользователя и слота",
+)
+
+
+class _Shard:
+    """Очередь одного пользователя: lock + число апдейтов в ней."""
+
+    __slots__ = ("lock", "depth")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class _UserTurn:
+    """Очередь пользователя, занятая текущим апдейтом; отпускается один раз."""
+
+    __slots__ = ("shard", "released")
+
+    def __init__(self, shard: _Shard) -> None:
+        self.shard = shard
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.shard.lock.release()
+
+
+_turn: ContextVar[Optional[_UserTurn]] = ContextVar("_turn", default=None)
+
+
+def release_turn() -> None:
+    """Пустить следующий апдейт этого пользователя, не дожидаясь конца текущего.
+
+    Вне процессора (тесты, планировщик) — no-op.
+    """
+    turn = _turn.get()
+    if turn is not None:
+        turn.release()
+
+
+def _shard_key(update: object) -> Optional[int]:
+    """telegram_id апдейта (в личке совпадает с chat_id). None — без порядка."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельно между пользователями, последовательно внутри пользователя."""
+
+    def __init__(self, max_concurrent: int, max_pending: int) -> None:
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be a positive integer")
+        super().__init__(max(max_pending, max_concurrent))
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._shards: dict[int, _Shard] = {}
+        self.pending = 0
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_pending_seen = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _shard_key(update)
+        shard = None
+        if key is not None:
+            shard = self._shards.get(key)
+            if shard is None:
+                shard = self._shards[key] = _Shard()
+            shard.depth += 1
+
+        self.pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        started = False
+        t0 = time.monotonic()
+        turn = None
+        try:
+            if shard is not None:
+                await shard.lock.acquire()
+                turn = _UserTurn(shard)
+            token = _turn.set(turn)
+            try:
+                async with self._slots:
+                    wait_ms = (time.monotonic() - t0) * 1000
+                    _WAIT_SECONDS.observe(wait_ms / 1000)
+                    self.wait_total_ms += wait_ms
+                    self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+                    self.pending -= 1
+                    self.running += 1
+                    started = True
+                    try:
+                        await coroutine
+                    except Exception:
+                        # Application.process_update сам ловит ошибки хэндлеров,
+                        # сюда долетает только то, что прошло мимо него
+                        self.failed += 1
+                        raise
+                    finally:
+                        self.running -= 1
+                        self.processed += 1
+            finally:
+                _turn.reset(token)
+                if turn is not None:
+                    turn.release()
+        finally:
+            if not started:
+                # Отменён в ожидании очереди/слота: хэндлер так и не запускался
+                self.pending -= 1
+                if asyncio.iscoroutine(coroutine):
+                    coroutine.close()
+            if shard is not None:
+                shard.depth -= 1
+                if shard.depth == 0:
+                    self._shards.pop(key, None)
+
+    async def initialize(self) -> None:
+        """Ресурсов нет — очереди создаются лениво."""
+
+    async def shutdown(self) -> None:
+        """Дожидаться нечего: Application.stop() уже дождался задач апдейтов."""
+        if self.pending or self.running:
+            logger.warning(
+                "update processor shutdown: pending=%d running=%d",
+                self.pending, self.running,
+            )
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_pending": self.max_concurrent_updates,
+            "running": self.running,
+            "pending": self.pending,
+            "active_users": len(self._shards),
+            "max_user_depth": max((s.depth for s in self._shards.values()), default=0),
+            "max_pending_seen": self.max_pending_seen,
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_avg_ms": round(self.wait_total_ms / self.processed, 3)
+            if self.processed else 0.0,
+            "wait_max_ms": round(self.wait_max_ms, 3),
+        }
+
+
+_processor: Optional[PerUserUpdateProcessor] = None
+
+
+def create_update_processor() -> PerUserUpdateProcessor:
+    """Процессор для Application.builder().concurrent_updates(...) из конфига."""
+    global _processor
+    _processor = PerUserUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING)
+    return _processor
+
+
+def get_update_stats() -> dict:
+    """Метрики очереди апдейтов ({} если бот в этом процессе не запущен)."""
+    if _processor is None:
+        return {}
+    return _processor.stats()
+
+
+def _queue_depth() -> dict:
+    if _processor is None:
+        return {}
+    return {
+        ("pending",): _processor.pending,
+        ("running",): _processor.running,
+        ("max_user_depth",): max((s.depth for s in _processor._shards.values()), default=0),
+    }
+
+
+metrics.gauge(
+    "update_queue_depth", "Очередь апдейтов: pending, running, max_user_depth",
+    ("state",), fn=_queue_depth,
+)
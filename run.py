@@ -20,7 +20,8 @@ from bot.handlers import (
     allow_command, deny_command, allowed_command,
 )
 from bot.scheduler import setup_scheduler
-from bot.memory.database import init_db
+from bot.memory.database import close_db, init_db
+from bot.update_processor import create_update_processor
 from shared.config import TELEGRAM_BOT_TOKEN
 
 logging.basicConfig(
@@ -32,7 +33,12 @@ logger = logging.getLogger(__name__)
 
 async def _setup_bot() -> Application:
     """Создаёт и настраивает Telegram Application."""
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(create_update_processor())
+        .build()
+    )
 
     # Инициализация БД
     await init_db()
@@ -131,6 +137,7 @@ async def main():
         await bot_app.updater.stop()
         await bot_app.stop()
         await bot_app.shutdown()
+        await close_db()
 
 
 if __name__ == "__main__":
@@ -20,13 +20,102 @@ GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
 GEMINI_TIMEOUT = 30
 
 DB_PATH = os.getenv('DB_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'nastavnik.db'))
+DB_POOL_READERS = int(os.getenv('DB_POOL_READERS', '4'))
+DB_GROUP_COMMIT_MS = float(os.getenv('DB_GROUP_COMMIT_MS', '2'))
 WEBAPP_URL = os.getenv('WEBAPP_URL', '')
+# Telegram-апдейты: одновременно выполняемых хэндлеров / принятых в работу
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '16'))
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', '256'))
+# Склейка пачек сообщений: окно debounce и отмена устаревшей генерации
+COALESCE_WINDOW_MS = int(os.getenv('COALESCE_WINDOW_MS', '600'))
+COALESCE_CANCEL_INFLIGHT = os.getenv('COALESCE_CANCEL_INFLIGHT', '1') == '1'
+# Поиск эпизодов для контекста: 'bm25' (локально) или 'llm' (GPT по заголовкам)
+EPISODE_RETRIEVER = os.getenv('EPISODE_RETRIEVER', 'bm25')
+# GPT как re-ranker для неоднозначных BM25-результатов
+EPISODE_LLM_RERANK = os.getenv('EPISODE_LLM_RERANK', '0') == '1'
 
 OWNER_TELEGRAM_ID = int(os.getenv('OWNER_TELEGRAM_ID', '0'))
 TOKEN_BUDGET_SOFT = 7000
 RATE_LIMIT_PER_MINUTE = 60
 CLAUDE_TIMEOUT = 30
 GPT_TIMEOUT = 15
+# Стриминг ответа в Telegram: первое предложение сразу, дальше правки сообщения
+STREAM_REPLIES = os.getenv('STREAM_REPLIES', '1') == '1'
+# Минимальный интервал между edit_message_text (лимит Telegram ~1 правка/сек на чат)
+STREAM_EDIT_INTERVAL_S = float(os.getenv('STREAM_EDIT_INTERVAL_S', '1.5'))
+# Hedging диалога: второй провайдер ('' — выключено; значения как у DIALOG_PROVIDER)
+DIALOG_BACKUP_PROVIDER = os.getenv('DIALOG_BACKUP_PROVIDER', '')
+# Порог дублирующего запроса — перцентиль латентности основного провайдера
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '0.95'))
+HEDGE_MIN_DELAY_S = float(os.getenv('HEDGE_MIN_DELAY_S', '2'))
+HEDGE_DEFAULT_DELAY_S = float(os.getenv('HEDGE_DEFAULT_DELAY_S', '8'))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+
+# Планировщик LLM: лимиты провайдеров в минуту (0 — без лимита)
+LLM_RPM = {
+    'claude': int(os.getenv('CLAUDE_RPM', '1000')),
+    'openai': int(os.getenv('OPENAI_RPM', '5000')),
+    'gemini': int(os.getenv('GEMINI_RPM', '1000')),
+}
+LLM_TPM = {
+    'claude': int(os.getenv('CLAUDE_TPM', '400000')),
+    'openai': int(os.getenv('OPENAI_TPM', '2000000')),
+    'gemini': int(os.getenv('GEMINI_TPM', '1000000')),
+}
+# Очереди классов приоритета: максимум ждущих и дедлайн ожидания (сек)
+LLM_QUEUE_LIMIT = {'interactive': 200, 'safety': 200, 'background': 1000}
+LLM_QUEUE_DEADLINE_S = {'interactive': 20.0, 'safety': 10.0, 'background': 600.0}
+
+# Circuit breaker на провайдера+модель: окно, пороги, пауза и пробы half-open
+BREAKER_WINDOW_S = 60
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '8'))
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_SLOW_CALL_S = float(os.getenv('BREAKER_SLOW_CALL_S', '20'))
+BREAKER_SLOW_RATE = float(os.getenv('BREAKER_SLOW_RATE', '0.8'))
+BREAKER_OPEN_S = float(os.getenv('BREAKER_OPEN_S', '30'))
+BREAKER_PROBES = 2
+
+# Кэш ответов LLM для детерминированных фоновых промптов (память + SQLite)
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', '1') == '1'
+LLM_CACHE_MEMORY_SIZE = int(os.getenv('LLM_CACHE_MEMORY_SIZE', '512'))
+LLM_CACHE_DB_ROWS = int(os.getenv('LLM_CACHE_DB_ROWS', '5000'))
+# TTL (сек) по месту вызова; место без записи здесь не кэшируется
+LLM_CACHE_TTL_S = {
+    'verify_crisis': 600,
+    'episode_selection': 3600,
+    'evaluate_phase': 1800,
+    'goal_steps': 86400,
+}
+
+# Транспорт LLM: live | record (пишет кассету) | replay (отдаёт из кассеты) |
+# synthetic (генерирует ответы) — для бенчмарков и нагрузки без сети
+LLM_TRANSPORT = os.getenv('LLM_TRANSPORT', 'live')
+LLM_CASSETTE = os.getenv('LLM_CASSETTE', 'llm_cassette.jsonl')
+# Латентность synthetic: медиана (мс) и разброс (sigma логнормального)
+LLM_SYNTHETIC_LATENCY_MS = float(os.getenv('LLM_SYNTHETIC_LATENCY_MS', '1200'))
+LLM_SYNTHETIC_JITTER = float(os.getenv('LLM_SYNTHETIC_JITTER', '0.5'))
+# Множитель задержек replay/synthetic (0 — мгновенно)
+LLM_LATENCY_SCALE = float(os.getenv('LLM_LATENCY_SCALE', '1'))
+# Трассировка шагов хода: кольцевой буфер трасс; 1 — ещё и в message_traces
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', '500'))
+TRACE_PERSIST = os.getenv('TRACE_PERSIST', '0') == '1'
+# Деградация под нагрузкой: пороги уровней 1..3 по p95 латентности хода (сек)
+# и по очереди (апдейты + ждущие LLM-вызовы); окно и пауза перед понижением
+DEGRADE_ENABLED = os.getenv('DEGRADE_ENABLED', '1') == '1'
+DEGRADE_LATENCY_S = (
+    float(os.getenv('DEGRADE_LATENCY1_S', '10')),
+    float(os.getenv('DEGRADE_LATENCY2_S', '16')),
+    float(os.getenv('DEGRADE_LATENCY3_S', '22')),
+)
+DEGRADE_BACKLOG = (
+    int(os.getenv('DEGRADE_BACKLOG1', '32')),
+    int(os.getenv('DEGRADE_BACKLOG2', '96')),
+    int(os.getenv('DEGRADE_BACKLOG3', '192')),
+)
+DEGRADE_WINDOW_S = 60
+DEGRADE_MIN_SAMPLES = 5
+DEGRADE_COOLDOWN_S = float(os.getenv('DEGRADE_COOLDOWN_S', '30'))
 FALLBACK_RESPONSE = 'Мм, мне нужно немного подумать. Напиши ещё раз через минутку?'
 FULL_UPDATE_PAUSE_MINUTES = 30
 
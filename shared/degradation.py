@@ -0,0 +1,168 @@
+"""
+Деградация под нагрузкой: уровень 0-3 по живой латентности ходов и очереди.
+
+Сигналы:
+    p95 латентности хода за DEGRADE_WINDOW_S (observe_turn из session_manager);
+    очередь — апдейты, ждущие хэндлера, + LLM-вызовы, ждущие планировщика.
+
+Уровень растёт сразу, снижается на одну ступень после DEGRADE_COOLDOWN_S
+ниже порога. Что отключается — policy() (накопительно по уровням):
+    1 — эпизоды без GPT (BM25 / _keyword_fallback), без проверки фазы;
+    2 — короче история и ответ, без внеочередного полного обновления памяти
+        (needs_full_update всё равно ставится — догонит планировщик);
+    3 — без GPT-верификации кризиса 1-2 уровня: считаем реальным, как при
+        ошибке верификации (консервативно).
+Кризис 3 уровня (шаблон без LLM) от уровня не зависит.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from shared import metrics
+from shared.config import (
+    DEGRADE_BACKLOG,
+    DEGRADE_COOLDOWN_S,
+    DEGRADE_ENABLED,
+    DEGRADE_LATENCY_S,
+    DEGRADE_MIN_SAMPLES,
+    DEGRADE_WINDOW_S,
+)
+
+logger = logging.getLogger(__name__)
+
+LEVEL_NORMAL = 0
+LEVEL_MAX = 3
+
+# Пересчёт уровня не чаще раза в секунду — policy() дёргается на каждом ходе
+_EVAL_INTERVAL_S = 1.0
+
+
+@dataclass(frozen=True)
+class Policy:
+    """Что разрешено на текущем уровне."""
+
+    llm_episode_selection: bool = True
+    phase_check: bool = True
+    memory_update_trigger: bool = True
+    verify_crisis: bool = True
+    history_limit: int = 11
+    dialog_max_tokens: int = 400
+
+
+_POLICIES: dict[int, Policy] = {
+    0: Policy(),
+    1: Policy(llm_episode_selection=False, phase_check=False),
+    2: Policy(
+        llm_episode_selection=False, phase_check=False, memory_update_trigger=False,
+        history_limit=7, dialog_max_tokens=300,
+    ),
+    3: Policy(
+        llm_episode_selection=False, phase_check=False, memory_update_trigger=False,
+        verify_crisis=False, history_limit=5, dialog_max_tokens=250,
+    ),
+}
+
+_LEVEL = metrics.gauge("degradation_level", "Текущий уровень деградации (0 — норма)")
+_TRANSITIONS = metrics.counter(
+    "degradation_transitions_total", "Смены уровня деградации", ("from_level", "to_level"),
+)
+
+
+class _Controller:
+    def __init__(self) -> None:
+        self.level = LEVEL_NORMAL
+        self._turns: deque[tuple[float, float]] = deque()  # (время, латентность)
+        self._evaluated_at = 0.0
+        self._below_since: float | None = None
+        self.transitions = 0
+        self.last_signals: dict = {}
+
+    def observe_turn(self, seconds: float) -> None:
+        now = time.monotonic()
+        self._turns.append((now, seconds))
+        self._trim(now)
+
+    def _trim(self, now: float) -> None:
+        while self._turns and now - self._turns[0][0] > DEGRADE_WINDOW_S:
+            self._turns.popleft()
+
+    def _latency_p95(self) -> float | None:
+        if len(self._turns) < DEGRADE_MIN_SAMPLES:
+            return None
+        ordered = sorted(lat for _, lat in self._turns)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def evaluate(self, backlog: int, now: float) -> int:
+        self._trim(now)
+        p95 = self._latency_p95()
+        by_latency = sum(1 for t in DEGRADE_LATENCY_S if p95 is not None and p95 >= t)
+        by_backlog = sum(1 for t in DEGRADE_BACKLOG if backlog >= t)
+        target = max(by_latency, by_backlog)
+        self.last_signals = {
+            "turn_p95_s": round(p95, 3) if p95 is not None else None,
+            "backlog": backlog,
+            "target": target,
+        }
+        if target > self.level:
+            self._set(target)
+            self._below_since = None
+        elif target < self.level:
+            if self._below_since is None:
+                self._below_since = now
+            elif now - self._below_since >= DEGRADE_COOLDOWN_S:
+                self._set(self.level - 1)  # вниз по ступеньке
+                self._below_since = now if target < self.level else None
+        else:
+            self._below_since = None
+        return self.level
+
+    def _set(self, level: int) -> None:
+        prev, self.level = self.level, level
+        self.transitions += 1
+        _LEVEL.set(level)
+        _TRANSITIONS.inc(str(prev), str(level))
+        log = logger.error if level == LEVEL_MAX else logger.warning
+        log("degradation: level %d -> %d %s", prev, level, self.last_signals)
+
+
+_controller = _Controller()
+
+
+def _backlog() -> int:
+    from bot.update_processor import get_update_stats
+    from shared.llm_client import get_queue_depth
+
+    return get_update_stats().get("pending", 0) + get_queue_depth()
+
+
+def level() -> int:
+    """Текущий уровень (пересчитывается лениво, не чаще _EVAL_INTERVAL_S)."""
+    if not DEGRADE_ENABLED:
+        return LEVEL_NORMAL
+    now = time.monotonic()
+    if now - _controller._evaluated_at >= _EVAL_INTERVAL_S:
+        _controller._evaluated_at = now
+        _controller.evaluate(_backlog(), now)
+    return _controller.level
+
+
+def policy() -> Policy:
+    return _POLICIES[level()]
+
+
+def observe_turn(seconds: float) -> None:
+    """Латентность завершённого хода (от апдейта до ответа)."""
+    _controller.observe_turn(seconds)
+
+
+def get_degradation_stats() -> dict:
+    """Для /health: уровень, сигналы последней оценки, число переключений."""
+    return {
+        "level": _controller.level,
+        "transitions": _controller.transitions,
+        **_controller.last_signals,
+    }
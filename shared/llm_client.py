@@ -2,14 +2,31 @@
 from __future__ import annotations
 
 import asyncio
+import functools
+import hashlib
+import json
 import logging
 import time
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
 
 import anthropic
 import openai
 
+from bot.memory import database
+from shared import llm_transport
 from shared.config import (
     ANTHROPIC_API_KEY,
+    BREAKER_ERROR_RATE,
+    BREAKER_MIN_CALLS,
+    BREAKER_OPEN_S,
+    BREAKER_PROBES,
+    BREAKER_SLOW_CALL_S,
+    BREAKER_SLOW_RATE,
+    BREAKER_WINDOW_S,
     CLAUDE_MODEL,
     CLAUDE_TIMEOUT,
     FALLBACK_RESPONSE,
@@ -18,71 +35,847 @@ from shared.config import (
     GEMINI_TIMEOUT,
     GPT_MODEL,
     GPT_TIMEOUT,
+    HEDGE_DEFAULT_DELAY_S,
+    HEDGE_MIN_DELAY_S,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_PERCENTILE,
+    HEDGE_WINDOW,
+    LLM_CACHE_DB_ROWS,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_MEMORY_SIZE,
+    LLM_CACHE_TTL_S,
+    LLM_QUEUE_DEADLINE_S,
+    LLM_QUEUE_LIMIT,
+    LLM_RPM,
+    LLM_TPM,
+    LLM_TRANSPORT,
     OPENAI_API_KEY,
 )
+from shared import metrics
+from shared.tracing import span
 
 logger = logging.getLogger(__name__)
 
-_claude_client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
-_gpt_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+if LLM_TRANSPORT not in llm_transport.MODES:
+    raise ValueError(f'LLM_TRANSPORT must be one of {llm_transport.MODES}, got {LLM_TRANSPORT!r}')
 
-# Gemini через OpenAI-совместимый API
-_gemini_client: openai.AsyncOpenAI | None = None
-if GEMINI_API_KEY:
-    _gemini_client = openai.AsyncOpenAI(
-        api_key=GEMINI_API_KEY,
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-    )
+if LLM_TRANSPORT in ('replay', 'synthetic'):
+    # Без сети и без ключей: заглушки с тем же интерфейсом SDK
+    _claude_client, _gpt_client, _gemini_client = llm_transport.offline_clients(LLM_TRANSPORT)
+else:
+    _claude_client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+    _gpt_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+    # Gemini через OpenAI-совместимый API
+    _gemini_client: openai.AsyncOpenAI | None = None
+    if GEMINI_API_KEY:
+        _gemini_client = openai.AsyncOpenAI(
+            api_key=GEMINI_API_KEY,
+            base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
+        )
+
+    if LLM_TRANSPORT == 'record':
+        _claude_client, _gpt_client, _gemini_client = llm_transport.recording_clients(
+            _claude_client, _gpt_client, _gemini_client,
+        )
 
 
 class LLMError(Exception):
     """Ошибка LLM-вызова (auth, превышение лимита, невосстановимая)."""
 
 
+class CircuitOpenError(LLMError):
+    """Провайдер отключён circuit breaker'ом — вызов отклонён без запроса."""
+
+
+def _usage_tokens(usage, name: str) -> int:
+    """Счётчик токенов из usage (0 если поля нет — старый SDK / без кэша)."""
+    value = getattr(usage, name, 0)
+    return value if isinstance(value, int) else 0
+
+
+# ---------------------------------------------------------------------------
+# Метрики (/metrics)
+# ---------------------------------------------------------------------------
+
+_LLM_SECONDS = metrics.histogram(
+    'llm_request_seconds', 'Длительность запроса к провайдеру (стрим — целиком)',
+    ('provider', 'model'),
+)
+_LLM_REQUESTS = metrics.counter(
+    'llm_requests_total', 'Запросы к провайдеру по исходу: ok, error, rejected (breaker)',
+    ('provider', 'model', 'outcome'),
+)
+_LLM_TOKENS = metrics.counter(
+    'llm_tokens_total', 'Токены по типу: input, output, cache_read, cache_write',
+    ('provider', 'model', 'kind'),
+)
+_LLM_CACHE = metrics.counter(
+    'llm_cache_requests_total', 'Кэш ответов: memory_hits, db_hits, misses, stored',
+    ('site', 'result'),
+)
+_FALLBACKS = metrics.counter(
+    'fallback_responses_total', 'Ответы-заглушки вместо LLM', ('source',),
+)
+
+
+def _count_tokens(
+    provider: str, model: str, input_tokens: int, output_tokens: int,
+    cache_read: int = 0, cache_write: int = 0,
+) -> None:
+    _LLM_TOKENS.inc(provider, model, 'input', amount=input_tokens)
+    _LLM_TOKENS.inc(provider, model, 'output', amount=output_tokens)
+    if cache_read:
+        _LLM_TOKENS.inc(provider, model, 'cache_read', amount=cache_read)
+    if cache_write:
+        _LLM_TOKENS.inc(provider, model, 'cache_write', amount=cache_write)
+
+
+# ---------------------------------------------------------------------------
+# Circuit breaker: провайдер+модель, fail fast при деградации
+# ---------------------------------------------------------------------------
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+# Ошибки, которые считаются отказом провайдера (остальные — нейтральны)
+_PROVIDER_ERRORS = (TimeoutError, anthropic.APIError, openai.APIError, LLMError)
+
+# Подписчики на смену состояния: fn(name, state, info) — alerter и т.п.
+_breaker_listeners: list[Callable[[str, str, dict], None]] = []
+
+
+def add_breaker_listener(fn: Callable[[str, str, dict], None]) -> None:
+    """Подписка на смену состояния breaker'ов (синхронный колбэк)."""
+    if fn not in _breaker_listeners:
+        _breaker_listeners.append(fn)
+
+
+class _CircuitBreaker:
+    """closed -> open (доля ошибок / медленных в окне) -> half_open (пробы) -> closed."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.labels = tuple(name.split(':', 1))  # (provider, model) для метрик
+        self.state = CIRCUIT_CLOSED
+        # (время, ok, латентность) за BREAKER_WINDOW_S
+        self._calls: deque[tuple[float, bool, float]] = deque()
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.opened_count = 0
+        self.rejected = 0
+
+    def _trim(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > BREAKER_WINDOW_S:
+            self._calls.popleft()
+
+    def window_stats(self) -> dict:
+        self._trim(time.monotonic())
+        n = len(self._calls)
+        errors = sum(1 for _, ok, _ in self._calls if not ok)
+        slow = sum(1 for _, _, lat in self._calls if lat >= BREAKER_SLOW_CALL_S)
+        latencies = sorted(lat for _, _, lat in self._calls)
+        return {
+            'calls': n,
+            'error_rate': round(errors / n, 3) if n else 0.0,
+            'slow_rate': round(slow / n, 3) if n else 0.0,
+            'p50_s': round(latencies[n // 2], 3) if n else None,
+        }
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        prev, self.state = self.state, state
+        info = {'from': prev, **self.window_stats()}
+        log = logger.error if state == CIRCUIT_OPEN else logger.warning
+        log('circuit %s: %s -> %s %s', self.name, prev, state, info)
+        for fn in list(_breaker_listeners):
+            try:
+                fn(self.name, state, info)
+            except Exception:
+                logger.exception('breaker listener failed')
+
+    def _open(self) -> None:
+        self._opened_at = time.monotonic()
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.opened_count += 1
+        self._set_state(CIRCUIT_OPEN)
+
+    def available(self) -> bool:
+        """Можно ли сейчас идти к провайдеру (без занятия слота пробы)."""
+        if self.state == CIRCUIT_OPEN:
+            if time.monotonic() - self._opened_at < BREAKER_OPEN_S:
+                return False
+            self._set_state(CIRCUIT_HALF_OPEN)
+        if self.state == CIRCUIT_HALF_OPEN:
+            return self._probes_in_flight < BREAKER_PROBES
+        return True
+
+    def check(self) -> None:
+        """Fail fast: CircuitOpenError, если провайдер отключён."""
+        if not self.available():
+            self.rejected += 1
+            _LLM_REQUESTS.inc(*self.labels, 'rejected')
+            raise CircuitOpenError(f'{self.name}: circuit {self.state}')
+
+    def _record(self, ok: bool, latency: float, probe: bool) -> None:
+        now = time.monotonic()
+        if probe:
+            self._probes_in_flight -= 1
+            if not ok:
+                self._open()
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= BREAKER_PROBES:
+                self._calls.clear()
+                self._set_state(CIRCUIT_CLOSED)
+            return
+        if self.state != CIRCUIT_CLOSED:
+            return  # поздний ответ из прошлого окна — не в счёт
+        self._calls.append((now, ok, latency))
+        self._trim(now)
+        if len(self._calls) < BREAKER_MIN_CALLS:
+            return
+        stats = self.window_stats()
+        if stats['error_rate'] >= BREAKER_ERROR_RATE or stats['slow_rate'] >= BREAKER_SLOW_RATE:
+            self._open()
+
+    @contextmanager
+    def guard(self):
+        """Обёртка одного запроса к провайдеру: допуск + учёт исхода.
+
+        Отмена (проигравший hedge, отменённый ход) не считается ни успехом,
+        ни отказом — только освобождает слот пробы.
+        """
+        self.check()
+        probe = self.state == CIRCUIT_HALF_OPEN
+        if probe:
+            self._probes_in_flight += 1
+        t0 = time.monotonic()
+        try:
+            yield
+        except _PROVIDER_ERRORS:
+            elapsed = time.monotonic() - t0
+            self._record(False, elapsed, probe)
+            _LLM_SECONDS.observe(elapsed, *self.labels)
+            _LLM_REQUESTS.inc(*self.labels, 'error')
+            raise
+        except BaseException:
+            if probe:
+                self._probes_in_flight -= 1
+            raise
+        elapsed = time.monotonic() - t0
+        self._record(True, elapsed, probe)
+        _LLM_SECONDS.observe(elapsed, *self.labels)
+        _LLM_REQUESTS.inc(*self.labels, 'ok')
+
+
+_breakers: dict[str, _CircuitBreaker] = {}
+
+
+def _breaker(provider: str, model: str) -> _CircuitBreaker:
+    name = f'{provider}:{model}'
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = _CircuitBreaker(name)
+    return breaker
+
+
+def llm_available(provider: str, model: str) -> bool:
+    """False, пока breaker провайдера открыт — фоновым задачам стоит пропустить ход."""
+    return _breaker(provider, model).available()
+
+
+def get_breaker_stats() -> dict:
+    return {
+        name: {
+            'state': b.state,
+            'opened': b.opened_count,
+            'rejected': b.rejected,
+            **b.window_stats(),
+        }
+        for name, b in _breakers.items()
+    }
+
+
+# ---------------------------------------------------------------------------
+# Планировщик: классы приоритета + token bucket на провайдера
+# ---------------------------------------------------------------------------
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_SAFETY = 'safety'
+PRIORITY_BACKGROUND = 'background'
+_PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_SAFETY, PRIORITY_BACKGROUND)
+
+# Доля ёмкости бакета, которую класс занять не может — запас для классов выше
+_RESERVE = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_SAFETY: 0.1, PRIORITY_BACKGROUND: 0.3}
+
+# Класс текущих LLM-вызовов; по умолчанию фон (джобы, API, всё без явной метки)
+_priority: ContextVar[str] = ContextVar('llm_priority', default=PRIORITY_BACKGROUND)
+
+
+def llm_priority(cls: str):
+    """Декоратор async-функции: LLM-вызовы внутри (и в её задачах) идут классом cls."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            token = _priority.set(cls)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _priority.reset(token)
+        return wrapper
+    return decorator
+
+
+class _TokenBucket:
+    """per_minute единиц в минуту, ёмкость — минутный запас. Может уйти в минус
+    (фактический расход токенов больше оценки)."""
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = self.capacity
+        self.stamp = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def shortfall_s(self, amount: float, reserve: float) -> float:
+        """Сколько ждать, чтобы после списания amount осталось >= reserve ёмкости."""
+        floor = reserve * self.capacity
+        amount = min(amount, self.capacity - floor)  # крупный запрос не ждёт вечно
+        need = amount + floor - self.level
+        return need / self.rate if need > 0 else 0.0
+
+
+@dataclass
+class _Waiter:
+    cls: str
+    tokens: int
+    future: asyncio.Future
+
+
+def _new_class_stats() -> dict:
+    return {
+        'granted': 0, 'queued': 0, 'waited': 0, 'rejected': 0, 'expired': 0,
+        'wait_total_ms': 0.0, 'wait_max_ms': 0.0,
+    }
+
+
+_sched_stats: dict[str, dict] = {cls: _new_class_stats() for cls in _PRIORITIES}
+
+
+class _ProviderScheduler:
+    """Допуск вызовов к провайдеру: строгий приоритет классов, лимиты RPM/TPM."""
+
+    def __init__(self, name: str, rpm: int, tpm: int) -> None:
+        self.name = name
+        self.requests = _TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = _TokenBucket(tpm) if tpm > 0 else None
+        self.queues: dict[str, deque[_Waiter]] = {cls: deque() for cls in _PRIORITIES}
+        self._timer: asyncio.TimerHandle | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _delay_s(self, cls: str, tokens: int, now: float) -> float:
+        delay = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                delay = max(delay, bucket.shortfall_s(amount, _RESERVE[cls]))
+        return delay
+
+    def _take(self, tokens: int) -> None:
+        if self.requests is not None:
+            self.requests.level -= 1
+        if self.tokens is not None:
+            self.tokens.level -= tokens
+
+    def _pump(self) -> None:
+        """Пускает головы очередей по приоритету; младший класс ждёт, пока старший
+        не пуст. Нехватка бюджета — таймер до момента, когда его хватит."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        for cls in _PRIORITIES:
+            queue = self.queues[cls]
+            while queue:
+                waiter = queue[0]
+                if waiter.future.done():  # дедлайн/отмена
+                    queue.popleft()
+                    continue
+                delay = self._delay_s(cls, waiter.tokens, now)
+                if delay > 0:
+                    self._timer = self._loop.call_later(delay, self._pump)
+                    return
+                queue.popleft()
+                self._take(waiter.tokens)
+                waiter.future.set_result(None)
+
+    async def acquire(self, cls: str, tokens: int) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Новый event loop (рестарт, тесты): ожидающие старого не переживут
+            self._loop = loop
+            self._timer = None
+            for queue in self.queues.values():
+                queue.clear()
+        stats = _sched_stats[cls]
+        ahead = any(self.queues[c] for c in _PRIORITIES[:_PRIORITIES.index(cls) + 1])
+        if not ahead and self._delay_s(cls, tokens, time.monotonic()) == 0:
+            self._take(tokens)
+            stats['granted'] += 1
+            return
+        if len(self.queues[cls]) >= LLM_QUEUE_LIMIT[cls]:
+            stats['rejected'] += 1
+            raise LLMError(f'{self.name}: {cls} queue full')
+
+        waiter = _Waiter(cls, tokens, loop.create_future())
+        self.queues[cls].append(waiter)
+        stats['queued'] += 1
+        self._pump()
+        t0 = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter.future, timeout=LLM_QUEUE_DEADLINE_S[cls])
+        except TimeoutError:
+            stats['expired'] += 1
+            logger.warning('llm scheduler: %s %s deadline expired', self.name, cls)
+            raise LLMError(f'{self.name}: {cls} queue deadline') from None
+        finally:
+            if not waiter.future.done():
+                waiter.future.cancel()
+            if waiter in self.queues[cls]:
+                # Ушедшая голова могла держать младшие классы
+                self.queues[cls].remove(waiter)
+                self._pump()
+        wait_ms = (time.monotonic() - t0) * 1000
+        stats['granted'] += 1
+        stats['waited'] += 1
+        stats['wait_total_ms'] += wait_ms
+        stats['wait_max_ms'] = max(stats['wait_max_ms'], wait_ms)
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Поправка бюджета токенов по фактическому usage (0 — usage неизвестен)."""
+        if self.tokens is not None and isinstance(actual, int) and actual:
+            self.tokens.level += estimated - actual
+
+
+_schedulers: dict[str, _ProviderScheduler] = {}
+
+
+def _scheduler(provider: str) -> _ProviderScheduler:
+    sched = _schedulers.get(provider)
+    if sched is None:
+        sched = _schedulers[provider] = _ProviderScheduler(
+            provider, LLM_RPM.get(provider, 0), LLM_TPM.get(provider, 0),
+        )
+    return sched
+
+
+def _estimate_tokens(messages: list[dict], system, max_tokens: int) -> int:
+    """Грубая оценка до вызова: ~3 символа кириллицы на токен + max_tokens."""
+    chars = sum(len(str(m.get('content', ''))) for m in messages)
+    if isinstance(system, str):
+        chars += len(system)
+    elif system:
+        chars += sum(len(b) for b in system)
+    return chars // 3 + max_tokens
+
+
+async def _admit(provider: str, estimated: int) -> None:
+    """Ждёт допуска вызова классом текущего контекста. Очередь/дедлайн -> LLMError."""
+    await _scheduler(provider).acquire(_priority.get(), estimated)
+
+
+def get_queue_depth() -> int:
+    """Сколько вызовов сейчас ждут допуска у планировщиков (все провайдеры)."""
+    return sum(len(q) for sched in _schedulers.values() for q in sched.queues.values())
+
+
+def get_scheduler_stats() -> dict:
+    """Ожидание в очереди по классам + текущие очереди и бюджет провайдеров."""
+    classes = {}
+    for cls, st in _sched_stats.items():
+        classes[cls] = {
+            **{k: v for k, v in st.items() if k != 'wait_total_ms'},
+            'wait_avg_ms': round(st['wait_total_ms'] / st['waited'], 3) if st['waited'] else 0.0,
+            'wait_max_ms': round(st['wait_max_ms'], 3),
+        }
+    providers = {
+        name: {
+            'queued': {cls: len(q) for cls, q in sched.queues.items()},
+            'requests_left': round(sched.requests.level, 1) if sched.requests else None,
+            'tokens_left': round(sched.tokens.level) if sched.tokens else None,
+        }
+        for name, sched in _schedulers.items()
+    }
+    return {'classes': classes, 'providers': providers}
+
+
+# ---------------------------------------------------------------------------
+# Кэш ответов: детерминированные фоновые промпты, opt-in по месту вызова
+# ---------------------------------------------------------------------------
+
+# Сколько записей в SQLite между чистками просроченного/лишнего
+_CACHE_PRUNE_EVERY = 200
+
+
+def _cache_key(
+    model: str,
+    system: str | None,
+    messages: list[dict],
+    response_format: dict | None,
+    max_tokens: int,
+) -> str:
+    """sha256 от запроса целиком: любое отличие в промпте — другой ключ."""
+    payload = json.dumps(
+        [model, system, messages, response_format, max_tokens],
+        ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class _ResponseCache:
+    """LRU в памяти перед таблицей llm_cache (переживает рестарт).
+
+    Ошибки SQLite не ломают вызов: кэш просто промахивается.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._mem: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._puts = 0
+        self.evictions = 0
+        self.stats: dict[str, dict[str, int]] = {}
+
+    def _count(self, site: str, field: str) -> None:
+        st = self.stats.get(site)
+        if st is None:
+            st = self.stats[site] = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stored': 0}
+        st[field] += 1
+        _LLM_CACHE.inc(site, field)
+
+    def _remember(self, key: str, expires_at: float, value: str) -> None:
+        self._mem[key] = (expires_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.size:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, site: str, key: str) -> str | None:
+        now = time.time()
+        entry = self._mem.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._mem.move_to_end(key)
+                self._count(site, 'memory_hits')
+                return entry[1]
+            del self._mem[key]
+        try:
+            row = await database.get_llm_cache(key, now)
+        except Exception as e:
+            logger.warning('llm cache read failed: %s', e)
+            row = None
+        if row is not None:
+            value, expires_at = row
+            self._remember(key, expires_at, value)
+            self._count(site, 'db_hits')
+            return value
+        self._count(site, 'misses')
+        return None
+
+    async def put(self, site: str, key: str, model: str, value: str, ttl: float) -> None:
+        expires_at = time.time() + ttl
+        self._remember(key, expires_at, value)
+        self._count(site, 'stored')
+        try:
+            await database.put_llm_cache(key, site, model, value, expires_at)
+            self._puts += 1
+            if self._puts % _CACHE_PRUNE_EVERY == 0:
+                await database.prune_llm_cache(time.time(), LLM_CACHE_DB_ROWS)
+        except Exception as e:
+            logger.warning('llm cache write failed: %s', e)
+
+    def clear(self) -> None:
+        self._mem.clear()
+        self.stats.clear()
+        self.evictions = 0
+
+
+_response_cache = _ResponseCache(LLM_CACHE_MEMORY_SIZE)
+
+
+def get_cache_stats() -> dict:
+    """Попадания по местам вызова (память / SQLite) и заполненность LRU."""
+    sites = {}
+    for site, st in _response_cache.stats.items():
+        lookups = st['memory_hits'] + st['db_hits'] + st['misses']
+        hits = st['memory_hits'] + st['db_hits']
+        sites[site] = {**st, 'hit_rate': round(hits / lookups, 3) if lookups else 0.0}
+    return {
+        'enabled': LLM_CACHE_ENABLED,
+        'memory_entries': len(_response_cache._mem),
+        'memory_size': _response_cache.size,
+        'evictions': _response_cache.evictions,
+        'sites': sites,
+    }
+
+
 async def call_claude(
     messages: list[dict],
-    system: str,
+    system: str | list[str],
     max_tokens: int = 1024,
     timeout: int = CLAUDE_TIMEOUT,
+    fallback: bool = True,
 ) -> str:
-    """Claude Sonnet для диалога. Prompt caching через cache_control."""
-    system_block = [
-        {'type': 'text', 'text': system, 'cache_control': {'type': 'ephemeral'}},
-    ]
+    """Claude Sonnet для диалога. Prompt caching через cache_control.
+
+    system — строка или упорядоченные блоки (от стабильного к волатильному);
+    на каждый блок ставится свой cache breakpoint (API допускает до 4).
+    fallback=False — после неудачных попыток LLMError вместо FALLBACK_RESPONSE
+    (нужно hedged_call, чтобы отличить отказ от ответа).
+    """
+    blocks = [system] if isinstance(system, str) else [b for b in system if b]
+    system_block = [{'type': 'text', 'text': text} for text in blocks]
+    for block in system_block[:4]:
+        block['cache_control'] = {'type': 'ephemeral'}
+    estimated = _estimate_tokens(messages, blocks, max_tokens)
+    breaker = _breaker('claude', CLAUDE_MODEL)
     attempt = 0
     max_attempts = 2
     while attempt < max_attempts:
         attempt += 1
-        t0 = time.monotonic()
         try:
-            coro = _claude_client.messages.create(
-                model=CLAUDE_MODEL,
-                system=system_block,
-                messages=messages,
-                max_tokens=max_tokens,
-            )
-            response = await asyncio.wait_for(coro, timeout=timeout)
+            breaker.check()  # fail fast ещё до очереди планировщика
+            with span('call_claude.admit'):
+                await _admit('claude', estimated)
+            t0 = time.monotonic()
+            with breaker.guard(), span('call_claude'):
+                coro = _claude_client.messages.create(
+                    model=CLAUDE_MODEL,
+                    system=system_block,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                )
+                response = await asyncio.wait_for(coro, timeout=timeout)
             latency_ms = int((time.monotonic() - t0) * 1000)
+            _scheduler('claude').settle(
+                estimated,
+                _usage_tokens(response.usage, 'input_tokens')
+                + _usage_tokens(response.usage, 'output_tokens'),
+            )
+            _count_tokens(
+                'claude', CLAUDE_MODEL,
+                _usage_tokens(response.usage, 'input_tokens'),
+                _usage_tokens(response.usage, 'output_tokens'),
+                _usage_tokens(response.usage, 'cache_read_input_tokens'),
+                _usage_tokens(response.usage, 'cache_creation_input_tokens'),
+            )
             logger.info(
-                'call_claude model=%s input_tokens=%d output_tokens=%d latency_ms=%d',
+                'call_claude model=%s input_tokens=%d output_tokens=%d '
+                'cache_read_tokens=%d cache_write_tokens=%d latency_ms=%d',
                 CLAUDE_MODEL,
                 response.usage.input_tokens,
                 response.usage.output_tokens,
+                _usage_tokens(response.usage, 'cache_read_input_tokens'),
+                _usage_tokens(response.usage, 'cache_creation_input_tokens'),
                 latency_ms,
             )
             if not response.content:
                 raise LLMError("Claude returned empty response")
             return response.content[0].text
+        except CircuitOpenError:
+            if not fallback:
+                raise
+            _FALLBACKS.inc('call_claude')
+            return FALLBACK_RESPONSE
         except anthropic.AuthenticationError as e:
             logger.error('call_claude error: %s', str(e))
             raise LLMError(str(e)) from e
         except (asyncio.TimeoutError, anthropic.APIError) as e:
             logger.error('call_claude error: %s', str(e))
-            if attempt >= max_attempts:
+            # Breaker открылся — повтор бессмыслен
+            if attempt >= max_attempts or not breaker.available():
+                if not fallback:
+                    raise LLMError(str(e) or 'timeout') from e
+                _FALLBACKS.inc('call_claude')
                 return FALLBACK_RESPONSE
             await asyncio.sleep(1)
 
 
+_STREAM_END = object()
+
+
+async def _next_before(it: AsyncIterator, deadline: float):
+    """Следующий элемент стрима до deadline (loop.time()). _STREAM_END — конец.
+
+    Таймаут охватывает только ожидание провайдера, не код потребителя между
+    элементами (yield под asyncio.timeout отменил бы чужой await).
+    """
+    async with asyncio.timeout_at(deadline):
+        try:
+            return await anext(it)
+        except StopAsyncIteration:
+            return _STREAM_END
+
+
+async def stream_claude(
+    messages: list[dict],
+    system: str | list[str],
+    max_tokens: int = 1024,
+    timeout: int = CLAUDE_TIMEOUT,
+) -> AsyncIterator[str]:
+    """Стриминг Claude: async-итератор текстовых дельт.
+
+    Без retry (часть ответа уже могла уйти пользователю): любая ошибка
+    и таймаут стрима -> LLMError, вызывающий решает про fallback.
+    """
+    blocks = [system] if isinstance(system, str) else [b for b in system if b]
+    system_block = [{'type': 'text', 'text': text} for text in blocks]
+    for block in system_block[:4]:
+        block['cache_control'] = {'type': 'ephemeral'}
+    estimated = _estimate_tokens(messages, blocks, max_tokens)
+    breaker = _breaker('claude', CLAUDE_MODEL)
+    breaker.check()
+    with span('stream_claude.admit'):
+        await _admit('claude', estimated)
+    t0 = time.monotonic()
+    deadline = asyncio.get_running_loop().time() + timeout
+    first_token_ms = None
+    try:
+        with breaker.guard(), span('stream_claude'):
+            async with _claude_client.messages.stream(
+                model=CLAUDE_MODEL,
+                system=system_block,
+                messages=messages,
+                max_tokens=max_tokens,
+            ) as stream:
+                it = aiter(stream.text_stream)
+                while (delta := await _next_before(it, deadline)) is not _STREAM_END:
+                    if first_token_ms is None:
+                        first_token_ms = int((time.monotonic() - t0) * 1000)
+                    yield delta
+                final = await stream.get_final_message()
+    except (TimeoutError, anthropic.APIError) as e:
+        logger.error('stream_claude error: %s', str(e))
+        raise LLMError(str(e) or 'timeout') from e
+    _scheduler('claude').settle(
+        estimated,
+        _usage_tokens(final.usage, 'input_tokens') + _usage_tokens(final.usage, 'output_tokens'),
+    )
+    _count_tokens(
+        'claude', CLAUDE_MODEL,
+        _usage_tokens(final.usage, 'input_tokens'),
+        _usage_tokens(final.usage, 'output_tokens'),
+        _usage_tokens(final.usage, 'cache_read_input_tokens'),
+        _usage_tokens(final.usage, 'cache_creation_input_tokens'),
+    )
+    logger.info(
+        'stream_claude model=%s input_tokens=%d output_tokens=%d '
+        'cache_read_tokens=%d cache_write_tokens=%d first_token_ms=%s latency_ms=%d',
+        CLAUDE_MODEL,
+        final.usage.input_tokens,
+        final.usage.output_tokens,
+        _usage_tokens(final.usage, 'cache_read_input_tokens'),
+        _usage_tokens(final.usage, 'cache_creation_input_tokens'),
+        first_token_ms,
+        int((time.monotonic() - t0) * 1000),
+    )
+
+
+async def _stream_openai_compatible(
+    client: openai.AsyncOpenAI,
+    name: str,
+    provider: str,
+    model: str,
+    messages: list[dict],
+    max_tokens: int,
+    timeout: int,
+) -> AsyncIterator[str]:
+    """Стриминг chat.completions (GPT и Gemini через OpenAI-совместимый API)."""
+    estimated = _estimate_tokens(messages, None, max_tokens)
+    breaker = _breaker(provider, model)
+    breaker.check()
+    with span(f'{name}.admit'):
+        await _admit(provider, estimated)
+    t0 = time.monotonic()
+    deadline = asyncio.get_running_loop().time() + timeout
+    first_token_ms = None
+    in_tok = out_tok = 0
+    try:
+        with breaker.guard(), span(name):
+            async with asyncio.timeout_at(deadline):
+                stream = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    stream=True,
+                    stream_options={'include_usage': True},
+                )
+            it = aiter(stream)
+            while (chunk := await _next_before(it, deadline)) is not _STREAM_END:
+                if chunk.usage:
+                    in_tok = chunk.usage.prompt_tokens
+                    out_tok = chunk.usage.completion_tokens
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token_ms is None:
+                        first_token_ms = int((time.monotonic() - t0) * 1000)
+                    yield delta
+    except (TimeoutError, openai.APIError) as e:
+        logger.error('%s error: %s', name, str(e))
+        raise LLMError(str(e) or 'timeout') from e
+    _scheduler(provider).settle(estimated, in_tok + out_tok)
+    _count_tokens(provider, model, in_tok, out_tok)
+    logger.info(
+        '%s model=%s input_tokens=%d output_tokens=%d first_token_ms=%s latency_ms=%d',
+        name, model, in_tok, out_tok, first_token_ms,
+        int((time.monotonic() - t0) * 1000),
+    )
+
+
+def stream_gpt(
+    messages: list[dict],
+    system: str | None = None,
+    max_tokens: int = 500,
+    timeout: int = GPT_TIMEOUT,
+    model_override: str | None = None,
+) -> AsyncIterator[str]:
+    """Стриминг GPT: async-итератор текстовых дельт. Ошибки -> LLMError."""
+    full_messages = list(messages)
+    if system is not None:
+        full_messages = [{'role': 'system', 'content': system}, *full_messages]
+    return _stream_openai_compatible(
+        _gpt_client, 'stream_gpt', 'openai', model_override or GPT_MODEL,
+        full_messages, max_tokens, timeout,
+    )
+
+
+async def stream_gemini(
+    messages: list[dict],
+    system: str,
+    max_tokens: int = 500,
+    timeout: int = GEMINI_TIMEOUT,
+    model_override: str | None = None,
+) -> AsyncIterator[str]:
+    """Стриминг Gemini: async-итератор текстовых дельт. Ошибки -> LLMError."""
+    if _gemini_client is None:
+        raise LLMError("GEMINI_API_KEY not configured")
+    full_messages = [{"role": "system", "content": system}, *messages]
+    async for delta in _stream_openai_compatible(
+        _gemini_client, 'stream_gemini', 'gemini', model_override or GEMINI_MODEL,
+        full_messages, max_tokens, timeout,
+    ):
+        yield delta
+
+
 async def call_gpt(
     messages: list[dict],
     system: str | None = None,
@@ -90,16 +883,32 @@ async def call_gpt(
     timeout: int = GPT_TIMEOUT,
     response_format: dict | None = None,
     model_override: str | None = None,
+    cache: str | None = None,
 ) -> str:
-    """GPT для фоновых задач или диалога (с model_override)."""
+    """GPT для фоновых задач или диалога (с model_override).
+
+    cache — место вызова из LLM_CACHE_TTL_S: одинаковый запрос в пределах
+    TTL отдаётся из кэша без обращения к API. Диалог не кэшируется.
+    """
     full_messages = list(messages)
     if system is not None:
         full_messages = [{'role': 'system', 'content': system}, *full_messages]
 
     use_model = model_override or GPT_MODEL
+    ttl = LLM_CACHE_TTL_S.get(cache, 0) if cache and LLM_CACHE_ENABLED else 0
+    if ttl > 0:
+        key = _cache_key(use_model, system, messages, response_format, max_tokens)
+        cached = await _response_cache.get(cache, key)
+        if cached is not None:
+            return cached
+    estimated = _estimate_tokens(full_messages, None, max_tokens)
+    breaker = _breaker('openai', use_model)
     max_attempts = 3
     last_error: Exception | None = None
     for attempt in range(1, max_attempts + 1):
+        breaker.check()  # CircuitOpenError — без очереди и без ретраев
+        with span('call_gpt.admit'):
+            await _admit('openai', estimated)
         t0 = time.monotonic()
         try:
             kwargs: dict = {
@@ -109,9 +918,20 @@ async def call_gpt(
             }
             if response_format is not None:
                 kwargs['response_format'] = response_format
-            coro = _gpt_client.chat.completions.create(**kwargs)
-            response = await asyncio.wait_for(coro, timeout=timeout)
+            with breaker.guard(), span('call_gpt'):
+                coro = _gpt_client.chat.completions.create(**kwargs)
+                response = await asyncio.wait_for(coro, timeout=timeout)
             latency_ms = int((time.monotonic() - t0) * 1000)
+            _scheduler('openai').settle(
+                estimated,
+                _usage_tokens(response.usage, 'prompt_tokens')
+                + _usage_tokens(response.usage, 'completion_tokens'),
+            )
+            _count_tokens(
+                'openai', use_model,
+                _usage_tokens(response.usage, 'prompt_tokens'),
+                _usage_tokens(response.usage, 'completion_tokens'),
+            )
             logger.info(
                 'call_gpt model=%s input_tokens=%d output_tokens=%d latency_ms=%d',
                 use_model,
@@ -121,13 +941,18 @@ async def call_gpt(
             )
             if not response.choices:
                 raise LLMError("GPT returned empty response")
-            return response.choices[0].message.content
+            text = response.choices[0].message.content
+            if ttl > 0 and isinstance(text, str) and text:
+                await _response_cache.put(cache, key, use_model, text, ttl)
+            return text
         except openai.AuthenticationError as e:
             logger.error('call_gpt error: %s', str(e))
             raise LLMError(str(e)) from e
         except (asyncio.TimeoutError, openai.APIError) as e:
             logger.error('call_gpt error: %s', str(e))
             last_error = e
+            if not breaker.available():
+                break
             if attempt < max_attempts:
                 delay = attempt
                 await asyncio.sleep(delay)
@@ -148,20 +973,28 @@ async def call_gemini(
 
     full_messages = [{"role": "system", "content": system}, *messages]
     use_model = model_override or GEMINI_MODEL
+    estimated = _estimate_tokens(full_messages, None, max_tokens)
+    breaker = _breaker('gemini', use_model)
     max_attempts = 2
     last_error: Exception | None = None
     for attempt in range(1, max_attempts + 1):
+        breaker.check()
+        with span('call_gemini.admit'):
+            await _admit('gemini', estimated)
         t0 = time.monotonic()
         try:
-            coro = _gemini_client.chat.completions.create(
-                model=use_model,
-                messages=full_messages,
-                max_tokens=max_tokens,
-            )
-            response = await asyncio.wait_for(coro, timeout=timeout)
+            with breaker.guard(), span('call_gemini'):
+                coro = _gemini_client.chat.completions.create(
+                    model=use_model,
+                    messages=full_messages,
+                    max_tokens=max_tokens,
+                )
+                response = await asyncio.wait_for(coro, timeout=timeout)
             latency_ms = int((time.monotonic() - t0) * 1000)
             in_tok = response.usage.prompt_tokens if response.usage else 0
             out_tok = response.usage.completion_tokens if response.usage else 0
+            _scheduler('gemini').settle(estimated, in_tok + out_tok)
+            _count_tokens('gemini', use_model, in_tok, out_tok)
             logger.info(
                 'call_gemini model=%s input_tokens=%d output_tokens=%d latency_ms=%d',
                 use_model, in_tok, out_tok, latency_ms,
@@ -175,7 +1008,224 @@ async def call_gemini(
         except (asyncio.TimeoutError, openai.APIError) as e:
             logger.error('call_gemini error: %s', str(e))
             last_error = e
+            if not breaker.available():
+                break
             if attempt < max_attempts:
                 await asyncio.sleep(1)
 
     raise LLMError(str(last_error))
+
+
+# ---------------------------------------------------------------------------
+# Hedging: дублирующий запрос ко второму провайдеру на хвосте латентности
+# ---------------------------------------------------------------------------
+
+# (имя провайдера, фабрика вызова); фабрика бросает LLMError при отказе
+Attempt = tuple[str, Callable[[], Awaitable[str]]]
+StreamAttempt = tuple[str, Callable[[], AsyncIterator[str]]]
+
+
+class _LatencyTracker:
+    """Скользящее окно латентностей провайдера -> порог для hedge."""
+
+    def __init__(self, size: int = HEDGE_WINDOW) -> None:
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def hedge_delay(self) -> float:
+        """HEDGE_PERCENTILE окна (не меньше HEDGE_MIN_DELAY_S); пока данных мало — дефолт."""
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_S
+        ordered = sorted(self._samples)
+        idx = min(len(ordered) - 1, int(HEDGE_PERCENTILE * len(ordered)))
+        return max(HEDGE_MIN_DELAY_S, ordered[idx])
+
+
+# (провайдер, 'total' | 'first_token') -> трекер
+_latency: dict[tuple[str, str], _LatencyTracker] = {}
+_hedge_stats: dict[str, int] = {
+    'calls': 0,
+    'hedged': 0,
+    'failovers': 0,
+    'primary_wins': 0,
+    'backup_wins': 0,
+    'failures': 0,
+}
+
+
+def _tracker(name: str, kind: str) -> _LatencyTracker:
+    return _latency.setdefault((name, kind), _LatencyTracker())
+
+
+def get_hedge_stats() -> dict:
+    """Решения роутера и доля побед backup среди хеджированных вызовов."""
+    stats = dict(_hedge_stats)
+    hedged = stats['hedged'] + stats['failovers']
+    stats['backup_win_rate'] = round(stats['backup_wins'] / hedged, 3) if hedged else 0.0
+    stats['hedge_delay_s'] = {
+        f'{name}:{kind}': round(t.hedge_delay(), 3) for (name, kind), t in _latency.items()
+    }
+    return stats
+
+
+async def _timed(name: str, factory: Callable[[], Awaitable[str]]) -> str:
+    """Вызов с записью латентности. Отменённый (проигравший) тоже пишется:
+    его время — нижняя оценка, без неё окно теряло бы хвост и порог полз вниз."""
+    t0 = time.monotonic()
+    try:
+        result = await factory()
+    except asyncio.CancelledError:
+        _tracker(name, 'total').record(time.monotonic() - t0)
+        raise
+    _tracker(name, 'total').record(time.monotonic() - t0)
+    return result
+
+
+def _log_decision(primary: str, backup: str, reason: str, winner: str | None, delay: float, t0: float) -> None:
+    _hedge_stats[{'hedge': 'hedged', 'failover': 'failovers'}[reason]] += 1
+    if winner is None:
+        _hedge_stats['failures'] += 1
+    else:
+        _hedge_stats['primary_wins' if winner == primary else 'backup_wins'] += 1
+    logger.info(
+        'hedge primary=%s backup=%s reason=%s winner=%s delay_ms=%d latency_ms=%d '
+        'backup_win_rate=%.2f',
+        primary, backup, reason, winner, int(delay * 1000),
+        int((time.monotonic() - t0) * 1000), get_hedge_stats()['backup_win_rate'],
+    )
+
+
+async def _first_success(tasks: dict[asyncio.Task, str]) -> tuple[str, object]:
+    """(имя, результат) первого успешного; остальные отменяет. Все упали -> LLMError."""
+    pending = set(tasks)
+    last_error: BaseException | None = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return tasks[task], task.result()
+                last_error = task.exception()
+        raise LLMError(str(last_error))
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def hedged_call(primary: Attempt, backup: Attempt | None = None) -> str:
+    """Вызов primary; если он не ответил за порог (перцентиль его латентности) —
+    параллельно backup, берём первый ответ, второй отменяем.
+    Отказ primary до порога — сразу failover на backup.
+    """
+    p_name, p_factory = primary
+    if backup is None or backup[0] == p_name:
+        return await _timed(p_name, p_factory)
+
+    b_name, b_factory = backup
+    _hedge_stats['calls'] += 1
+    delay = _tracker(p_name, 'total').hedge_delay()
+    t0 = time.monotonic()
+    p_task = asyncio.create_task(_timed(p_name, p_factory))
+    try:
+        done, _ = await asyncio.wait({p_task}, timeout=delay)
+        if done and p_task.exception() is None:
+            _hedge_stats['primary_wins'] += 1
+            return p_task.result()
+        if done:
+            reason = 'failover'
+            logger.warning('hedge: %s failed (%s), failover to %s', p_name, p_task.exception(), b_name)
+            tasks = {}
+        else:
+            reason = 'hedge'
+            tasks = {p_task: p_name}
+        b_task = asyncio.create_task(_timed(b_name, b_factory))
+        tasks[b_task] = b_name
+        try:
+            winner, result = await _first_success(tasks)
+        except LLMError:
+            _log_decision(p_name, b_name, reason, None, delay, t0)
+            raise
+        _log_decision(p_name, b_name, reason, winner, delay, t0)
+        return result
+    finally:
+        if not p_task.done():
+            p_task.cancel()
+
+
+async def _first_delta(name: str, it: AsyncIterator[str]) -> str:
+    """Первая непустая дельта стрима (с записью time-to-first-token)."""
+    t0 = time.monotonic()
+    try:
+        async for delta in it:
+            if delta:
+                _tracker(name, 'first_token').record(time.monotonic() - t0)
+                return delta
+    except asyncio.CancelledError:
+        _tracker(name, 'first_token').record(time.monotonic() - t0)
+        raise
+    raise LLMError(f'{name}: empty stream')
+
+
+async def _close_stream(it: AsyncIterator[str]) -> None:
+    aclose = getattr(it, 'aclose', None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception:
+            pass
+
+
+async def hedged_stream(
+    primary: StreamAttempt,
+    backup: StreamAttempt | None = None,
+) -> AsyncIterator[str]:
+    """Стрим с hedging по первому токену: нет дельты от primary за порог —
+    стартует backup, дальше читаем тот, кто первым дал токен.
+    После первой дельты ошибки не перехватываются (LLMError вызывающему).
+    """
+    p_name, p_factory = primary
+    if backup is None or backup[0] == p_name:
+        async for delta in p_factory():
+            yield delta
+        return
+
+    b_name, b_factory = backup
+    _hedge_stats['calls'] += 1
+    delay = _tracker(p_name, 'first_token').hedge_delay()
+    t0 = time.monotonic()
+    streams = {p_name: aiter(p_factory())}
+    p_task = asyncio.create_task(_first_delta(p_name, streams[p_name]))
+    tasks: dict[asyncio.Task, str] = {p_task: p_name}
+    try:
+        done, _ = await asyncio.wait({p_task}, timeout=delay)
+        if done and p_task.exception() is None:
+            _hedge_stats['primary_wins'] += 1
+            winner, first = p_name, p_task.result()
+        else:
+            if done:
+                reason = 'failover'
+                logger.warning('hedge: %s stream failed (%s), failover to %s', p_name, p_task.exception(), b_name)
+                tasks = {}
+            else:
+                reason = 'hedge'
+            streams[b_name] = aiter(b_factory())
+            tasks[asyncio.create_task(_first_delta(b_name, streams[b_name]))] = b_name
+            try:
+                winner, first = await _first_success(tasks)
+            except LLMError:
+                _log_decision(p_name, b_name, reason, None, delay, t0)
+                raise
+            _log_decision(p_name, b_name, reason, winner, delay, t0)
+        yield first
+        async for delta in streams[winner]:
+            yield delta
+    finally:
+        losers = [task for task in tasks if not task.done()]
+        for task in losers:
+            task.cancel()
+        # Проигравший должен выйти из anext, иначе aclose() стрима упадёт
+        await asyncio.gather(*losers, return_exceptions=True)
+        for it in streams.values():
+            await _close_stream(it)
@@ -0,0 +1,505 @@
+"""Подменяемый транспорт LLM: запись, воспроизведение и синтетика.
+
+Клиенты-заглушки повторяют ту часть SDK anthropic/openai, которой пользуется
+llm_client (messages.create/stream, chat.completions.create), поэтому
+планировщик, breaker, hedging и метрики работают как с настоящим API.
+
+    record    — настоящие клиенты, каждый ответ дописывается в кассету (JSONL)
+    replay    — ответы из кассеты с записанной латентностью; промах —
+                синтетический ответ с латентностью из записанного распределения
+    synthetic — сгенерированные ответы (JSON под промпт) с логнормальной
+                латентностью
+
+В кассету пишется хэш запроса, а не сам промпт: там переписка пользователей.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import time
+from types import SimpleNamespace
+from typing import Any
+
+from bot.prompts.memory_prompts import (
+    CRISIS_VERIFICATION_PROMPT,
+    EPISODE_SELECTION_PROMPT,
+    EPISODE_SUMMARY_PROMPT,
+    GOAL_STEPS_PROMPT,
+    PHASE_EVALUATION_PROMPT,
+    PROFILE_UPDATE_PROMPT,
+    WEEKLY_ANALYSIS_PROMPT,
+)
+from shared.config import (
+    LLM_CASSETTE,
+    LLM_LATENCY_SCALE,
+    LLM_SYNTHETIC_JITTER,
+    LLM_SYNTHETIC_LATENCY_MS,
+    LLM_TRANSPORT,
+)
+
+logger = logging.getLogger(__name__)
+
+MODES = ('live', 'record', 'replay', 'synthetic')
+
+# Доля латентности до первого токена, если в записи её нет
+_TTFT_SHARE = 0.35
+
+_stats = {'recorded': 0, 'replayed': 0, 'missed': 0, 'synthetic': 0}
+
+
+def request_key(provider: str, model: str, system: Any, messages: list[dict],
+                response_format: dict | None, max_tokens: int) -> str:
+    """Хэш запроса — ключ кассеты."""
+    payload = json.dumps(
+        [provider, model, system, messages, response_format, max_tokens],
+        ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _chars(system: Any, messages: list[dict]) -> int:
+    return len(str(system or '')) + sum(len(str(m.get('content', ''))) for m in messages)
+
+
+def _prompt_text(system: Any, messages: list[dict]) -> str:
+    if isinstance(system, list):
+        system = ' '.join(str(b.get('text', '')) if isinstance(b, dict) else str(b) for b in system)
+    return '\n'.join([str(system or ''), *(str(m.get('content', '')) for m in messages)])
+
+
+# ---------------------------------------------------------------------------
+# Синтетические ответы
+# ---------------------------------------------------------------------------
+
+_SYNTHETIC_REPLY = (
+    'Слышу тебя. Похоже, сейчас на тебе много всего сразу, и это выматывает. '
+    'Давай посмотрим, что из этого самое тяжёлое прямо сейчас. '
+    'Что бы ты хотела, чтобы изменилось в первую очередь?'
+)
+
+# Первая строка шаблона промпта -> правдоподобный JSON в формате этого промпта
+_JSON_SAMPLES: list[tuple[str, dict]] = [
+    (EPISODE_SUMMARY_PROMPT, {
+        'title': 'Разговор о тревоге перед сменой работы',
+        'summary': 'Обсуждали страх перемен и что поддерживает в трудные дни.',
+        'emotional_tone': 'тревога → облегчение',
+        'key_insight': None,
+        'commitments': [],
+        'techniques_worked': ['отражение слов'],
+        'techniques_failed': [],
+    }),
+    (EPISODE_SELECTION_PROMPT, {'selected': [1]}),
+    (PROFILE_UPDATE_PROMPT, {'set_fields': {}, 'add_to_lists': {}, 'remove_fields': []}),
+    (PHASE_EVALUATION_PROMPT, {'recommendation': 'stay', 'confidence': 0.4, 'criteria_met': []}),
+    (GOAL_STEPS_PROMPT, {'steps': [
+        {'title': 'Записать, что мешает начать', 'deadline_days': 1},
+        {'title': 'Поговорить с подругой о планах', 'deadline_days': 3},
+        {'title': 'Сделать первый маленький шаг', 'deadline_days': 7},
+    ]}),
+    # Большинство срабатываний мягких триггеров — фигуры речи
+    (CRISIS_VERIFICATION_PROMPT, {'is_real_crisis': False, 'reason': 'фигура речи'}),
+    (WEEKLY_ANALYSIS_PROMPT, {'sessions': [], 'weekly_summary': '', 'recommendation': ''}),
+]
+_JSON_MARKERS = [(template.split('\n', 1)[0], sample) for template, sample in _JSON_SAMPLES]
+
+
+def _from_schema(schema: dict) -> Any:
+    """Минимальное значение, проходящее JSON Schema (response_format json_schema)."""
+    if 'enum' in schema:
+        return schema['enum'][0]
+    kind = schema.get('type')
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != 'null'), 'null')
+    if kind == 'object':
+        props = schema.get('properties', {})
+        return {name: _from_schema(sub) for name, sub in props.items()}
+    if kind == 'array':
+        return [_from_schema(schema.get('items', {}))]
+    if kind == 'integer':
+        return int(schema.get('minimum', 1))
+    if kind == 'number':
+        return float(schema.get('minimum', 0.5))
+    if kind == 'boolean':
+        return False
+    if kind == 'string':
+        return 'текст'
+    return None
+
+
+def synthetic_text(system: Any, messages: list[dict],
+                   response_format: dict | None, max_tokens: int) -> str:
+    """Ответ в формате, которого ждёт вызывающий код."""
+    fmt = (response_format or {}).get('type')
+    if fmt == 'json_schema':
+        schema = response_format.get('json_schema', {}).get('schema', {})
+        return json.dumps(_from_schema(schema), ensure_ascii=False)
+    if fmt == 'json_object':
+        prompt = _prompt_text(system, messages)
+        for marker, sample in _JSON_MARKERS:
+            if marker in prompt:
+                return json.dumps(sample, ensure_ascii=False)
+        return '{}'
+    return _SYNTHETIC_REPLY[: max(40, max_tokens * 3)]
+
+
+def _synthetic_latency_ms() -> float:
+    return LLM_SYNTHETIC_LATENCY_MS * math.exp(random.gauss(0.0, LLM_SYNTHETIC_JITTER))
+
+
+# ---------------------------------------------------------------------------
+# Кассета
+# ---------------------------------------------------------------------------
+
+
+class Cassette:
+    """JSONL: одна строка на ответ. Индекс по ключу и латентности по модели."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries: dict[str, list[dict]] = {}
+        self.latencies: dict[str, list[float]] = {}
+        self._cursor: dict[str, int] = {}
+
+    def load(self) -> 'Cassette':
+        if not os.path.exists(self.path):
+            logger.warning('LLM cassette %s not found, replay is synthetic only', self.path)
+            return self
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    self._index(json.loads(line))
+        logger.info('LLM cassette %s: %d requests', self.path, len(self.entries))
+        return self
+
+    def _index(self, entry: dict) -> None:
+        self.entries.setdefault(entry['key'], []).append(entry)
+        self.latencies.setdefault(f"{entry['provider']}:{entry['model']}", []).append(
+            entry['latency_ms']
+        )
+
+    def append(self, entry: dict) -> None:
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._index(entry)
+        _stats['recorded'] += 1
+
+    def lookup(self, key: str) -> dict | None:
+        """Записанный ответ; повторы одного запроса идут по кругу."""
+        found = self.entries.get(key)
+        if not found:
+            return None
+        i = self._cursor.get(key, 0)
+        self._cursor[key] = i + 1
+        return found[i % len(found)]
+
+    def sample_latency_ms(self, provider: str, model: str) -> float | None:
+        observed = self.latencies.get(f'{provider}:{model}')
+        return random.choice(observed) if observed else None
+
+
+def _entry(key: str, provider: str, model: str, response_format: dict | None,
+           max_tokens: int, text: str, in_tok: int, out_tok: int,
+           latency_ms: float, ttft_ms: float | None) -> dict:
+    return {
+        'key': key,
+        'provider': provider,
+        'model': model,
+        'response_format': (response_format or {}).get('type'),
+        'max_tokens': max_tokens,
+        'text': text,
+        'usage': [in_tok, out_tok],
+        'latency_ms': round(latency_ms, 1),
+        'ttft_ms': round(ttft_ms, 1) if ttft_ms is not None else None,
+        'ts': time.time(),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Офлайн-ответы: replay и synthetic
+# ---------------------------------------------------------------------------
+
+
+class _Responder:
+    """Текст + латентность ответа для replay/synthetic."""
+
+    def __init__(self, mode: str, cassette: Cassette | None) -> None:
+        self.mode = mode
+        self.cassette = cassette
+
+    def answer(self, provider: str, model: str, system: Any, messages: list[dict],
+               response_format: dict | None, max_tokens: int) -> dict:
+        if self.cassette is not None:
+            key = request_key(provider, model, system, messages, response_format, max_tokens)
+            recorded = self.cassette.lookup(key)
+            if recorded is not None:
+                _stats['replayed'] += 1
+                return recorded
+            _stats['missed'] += 1
+            latency = self.cassette.sample_latency_ms(provider, model)
+        else:
+            _stats['synthetic'] += 1
+            latency = None
+        text = synthetic_text(system, messages, response_format, max_tokens)
+        return {
+            'text': text,
+            'usage': [_chars(system, messages) // 3, len(text) // 3],
+            'latency_ms': latency if latency is not None else _synthetic_latency_ms(),
+            'ttft_ms': None,
+        }
+
+
+async def _sleep_ms(ms: float) -> None:
+    if ms > 0 and LLM_LATENCY_SCALE > 0:
+        await asyncio.sleep(ms * LLM_LATENCY_SCALE / 1000)
+
+
+def _split(text: str, parts: int = 8) -> list[str]:
+    """Текст -> куски для стрима (по словам, склейка даёт исходный текст)."""
+    words = text.split(' ')
+    step = max(1, math.ceil(len(words) / parts))
+    chunks = [' '.join(words[i:i + step]) for i in range(0, len(words), step)]
+    return [c + ' ' for c in chunks[:-1]] + chunks[-1:] if chunks else ['']
+
+
+async def _timed_chunks(answer: dict):
+    """Куски ответа с задержками: первый после TTFT, остальные равномерно."""
+    latency = answer['latency_ms']
+    ttft = answer.get('ttft_ms') or latency * _TTFT_SHARE
+    chunks = _split(answer['text'])
+    await _sleep_ms(ttft)
+    gap = max(0.0, latency - ttft) / max(1, len(chunks) - 1)
+    for i, chunk in enumerate(chunks):
+        if i:
+            await _sleep_ms(gap)
+        yield chunk
+
+
+def _anthropic_message(answer: dict) -> SimpleNamespace:
+    in_tok, out_tok = answer['usage']
+    return SimpleNamespace(
+        content=[SimpleNamespace(type='text', text=answer['text'])],
+        usage=SimpleNamespace(
+            input_tokens=in_tok, output_tokens=out_tok,
+            cache_read_input_tokens=0, cache_creation_input_tokens=0,
+        ),
+    )
+
+
+def _openai_usage(answer: dict) -> SimpleNamespace:
+    in_tok, out_tok = answer['usage']
+    return SimpleNamespace(prompt_tokens=in_tok, completion_tokens=out_tok)
+
+
+class _OfflineAnthropicStream:
+    def __init__(self, answer: dict) -> None:
+        self._answer = answer
+        self.text_stream = _timed_chunks(answer)
+
+    async def __aenter__(self) -> '_OfflineAnthropicStream':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.text_stream.aclose()
+
+    async def get_final_message(self) -> SimpleNamespace:
+        return _anthropic_message(self._answer)
+
+
+class _OfflineAnthropicMessages:
+    def __init__(self, responder: _Responder) -> None:
+        self._responder = responder
+
+    async def create(self, *, model, messages, max_tokens, system=None, **_) -> SimpleNamespace:
+        answer = self._responder.answer('claude', model, system, messages, None, max_tokens)
+        await _sleep_ms(answer['latency_ms'])
+        return _anthropic_message(answer)
+
+    def stream(self, *, model, messages, max_tokens, system=None, **_) -> _OfflineAnthropicStream:
+        answer = self._responder.answer('claude', model, system, messages, None, max_tokens)
+        return _OfflineAnthropicStream(answer)
+
+
+class _OfflineCompletions:
+    def __init__(self, provider: str, responder: _Responder) -> None:
+        self._provider = provider
+        self._responder = responder
+
+    async def create(self, *, model, messages, max_tokens, response_format=None,
+                     stream=False, **_) -> Any:
+        answer = self._responder.answer(
+            self._provider, model, None, messages, response_format, max_tokens,
+        )
+        if stream:
+            return self._chunks(answer)
+        await _sleep_ms(answer['latency_ms'])
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=answer['text']))],
+            usage=_openai_usage(answer),
+        )
+
+    @staticmethod
+    async def _chunks(answer: dict):
+        async for text in _timed_chunks(answer):
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None,
+            )
+        yield SimpleNamespace(choices=[], usage=_openai_usage(answer))
+
+
+def offline_clients(mode: str) -> tuple[Any, Any, Any]:
+    """(claude, gpt, gemini) без сети: replay по кассете или synthetic."""
+    cassette = Cassette(LLM_CASSETTE).load() if mode == 'replay' else None
+    responder = _Responder(mode, cassette)
+    claude = SimpleNamespace(messages=_OfflineAnthropicMessages(responder))
+    gpt = SimpleNamespace(chat=SimpleNamespace(completions=_OfflineCompletions('openai', responder)))
+    gemini = SimpleNamespace(chat=SimpleNamespace(completions=_OfflineCompletions('gemini', responder)))
+    logger.warning('LLM transport: %s (no network)', mode)
+    return claude, gpt, gemini
+
+
+# ---------------------------------------------------------------------------
+# Запись: обёртки над настоящими клиентами
+# ---------------------------------------------------------------------------
+
+
+class _RecordingAnthropicStream:
+    def __init__(self, inner_cm, record) -> None:
+        self._inner_cm = inner_cm
+        self._record = record
+        self._stream = None
+        self._parts: list[str] = []
+        self._t0 = 0.0
+        self._ttft_ms: float | None = None
+
+    async def __aenter__(self) -> '_RecordingAnthropicStream':
+        self._t0 = time.monotonic()
+        self._stream = await self._inner_cm.__aenter__()
+        self.text_stream = self._text()
+        return self
+
+    async def __aexit__(self, *exc) -> Any:
+        return await self._inner_cm.__aexit__(*exc)
+
+    async def _text(self):
+        async for delta in self._stream.text_stream:
+            if self._ttft_ms is None:
+                self._ttft_ms = (time.monotonic() - self._t0) * 1000
+            self._parts.append(delta)
+            yield delta
+
+    async def get_final_message(self) -> Any:
+        final = await self._stream.get_final_message()
+        self._record(
+            ''.join(self._parts), final.usage.input_tokens, final.usage.output_tokens,
+            (time.monotonic() - self._t0) * 1000, self._ttft_ms,
+        )
+        return final
+
+
+class _RecordingAnthropicMessages:
+    def __init__(self, inner, cassette: Cassette) -> None:
+        self._inner = inner
+        self._cassette = cassette
+
+    def _recorder(self, kwargs: dict):
+        key = request_key(
+            'claude', kwargs['model'], kwargs.get('system'), kwargs['messages'],
+            None, kwargs['max_tokens'],
+        )
+
+        def record(text, in_tok, out_tok, latency_ms, ttft_ms):
+            self._cassette.append(_entry(
+                key, 'claude', kwargs['model'], None, kwargs['max_tokens'],
+                text, in_tok, out_tok, latency_ms, ttft_ms,
+            ))
+        return record
+
+    async def create(self, **kwargs) -> Any:
+        t0 = time.monotonic()
+        response = await self._inner.create(**kwargs)
+        text = response.content[0].text if response.content else ''
+        self._recorder(kwargs)(
+            text, response.usage.input_tokens, response.usage.output_tokens,
+            (time.monotonic() - t0) * 1000, None,
+        )
+        return response
+
+    def stream(self, **kwargs) -> _RecordingAnthropicStream:
+        return _RecordingAnthropicStream(self._inner.stream(**kwargs), self._recorder(kwargs))
+
+
+class _RecordingCompletions:
+    def __init__(self, provider: str, inner, cassette: Cassette) -> None:
+        self._provider = provider
+        self._inner = inner
+        self._cassette = cassette
+
+    def _record(self, kwargs: dict, text: str, in_tok: int, out_tok: int,
+                latency_ms: float, ttft_ms: float | None) -> None:
+        fmt = kwargs.get('response_format')
+        key = request_key(
+            self._provider, kwargs['model'], None, kwargs['messages'], fmt, kwargs['max_tokens'],
+        )
+        self._cassette.append(_entry(
+            key, self._provider, kwargs['model'], fmt, kwargs['max_tokens'],
+            text, in_tok, out_tok, latency_ms, ttft_ms,
+        ))
+
+    async def create(self, **kwargs) -> Any:
+        t0 = time.monotonic()
+        response = await self._inner.create(**kwargs)
+        if kwargs.get('stream'):
+            return self._chunks(kwargs, response, t0)
+        text = response.choices[0].message.content if response.choices else ''
+        self._record(
+            kwargs, text or '', response.usage.prompt_tokens, response.usage.completion_tokens,
+            (time.monotonic() - t0) * 1000, None,
+        )
+        return response
+
+    async def _chunks(self, kwargs: dict, stream, t0: float):
+        parts: list[str] = []
+        ttft_ms = None
+        in_tok = out_tok = 0
+        async for chunk in stream:
+            if chunk.usage:
+                in_tok, out_tok = chunk.usage.prompt_tokens, chunk.usage.completion_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                if ttft_ms is None:
+                    ttft_ms = (time.monotonic() - t0) * 1000
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        self._record(
+            kwargs, ''.join(parts), in_tok, out_tok, (time.monotonic() - t0) * 1000, ttft_ms,
+        )
+
+
+def recording_clients(claude, gpt, gemini) -> tuple[Any, Any, Any]:
+    """Настоящие клиенты, которые дописывают каждый ответ в LLM_CASSETTE."""
+    cassette = Cassette(LLM_CASSETTE)
+    logger.warning('LLM transport: record -> %s', LLM_CASSETTE)
+
+    def wrap_openai(provider, client):
+        if client is None:
+            return None
+        return SimpleNamespace(chat=SimpleNamespace(
+            completions=_RecordingCompletions(provider, client.chat.completions, cassette),
+        ))
+
+    return (
+        SimpleNamespace(messages=_RecordingAnthropicMessages(claude.messages, cassette)),
+        wrap_openai('openai', gpt),
+        wrap_openai('gemini', gemini),
+    )
+
+
+def get_transport_stats() -> dict:
+    """Счётчики транспорта ({} для live)."""
+    if LLM_TRANSPORT == 'live':
+        return {}
+    return {'mode': LLM_TRANSPORT, **_stats}
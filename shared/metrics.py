@@ -0,0 +1,208 @@
+"""
+Реестр метрик в текстовом формате Prometheus (без prometheus_client).
+
+    LLM_SECONDS = histogram("llm_request_seconds", "...", ("provider", "model"))
+    LLM_SECONDS.observe(0.42, "claude", CLAUDE_MODEL)
+
+Значения меток передаются позиционно и служат ключом словаря — на горячем
+пути ни строк, ни объектов сверх одного кортежа. Гистограммы с
+фиксированными бакетами: bisect + инкремент счётчика в списке.
+Gauge с fn вычисляется при выдаче /metrics (глубина очередей и т.п.).
+"""
+
+from __future__ import annotations
+
+import logging
+from bisect import bisect_left
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Секунды: от быстрых SQL-запросов до долгих LLM-вызовов
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...]) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...]) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_num(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Текущее значение; fn — вычислить при выдаче (число или {метки: число})."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...],
+        fn: Optional[Callable[[], float | dict]] = None,
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple, float] = {}
+        self.fn = fn
+
+    def set(self, value: float, *labels) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def render(self) -> list[str]:
+        values = self._values
+        if self.fn is not None:
+            try:
+                got = self.fn()
+            except Exception:
+                logger.warning("gauge %s fn failed", self.name, exc_info=True)
+                got = {}
+            values = got if isinstance(got, dict) else {(): got}
+        lines = self._header()
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_num(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...],
+        buckets: tuple[float, ...],
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._le = [f'le="{_num(b)}"' for b in self.buckets] + ['le="+Inf"']
+        # метки -> [счётчики по бакетам..., +Inf, sum]
+        self._series: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return int(sum(series[:-1])) if series else 0
+
+    def clear(self) -> None:
+        self._series.clear()
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for i, le in enumerate(self._le):
+                cumulative += series[i]
+                lines.append(
+                    f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+_registry: dict[str, _Metric] = {}
+
+
+def _register(metric: _Metric) -> _Metric:
+    existing = _registry.get(metric.name)
+    if existing is not None:
+        if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+            raise ValueError(f"metric {metric.name} already registered differently")
+        return existing
+    _registry[metric.name] = metric
+    return metric
+
+
+def counter(name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+    return _register(Counter(name, help_text, labelnames))
+
+
+def gauge(
+    name: str,
+    help_text: str,
+    labelnames: tuple[str, ...] = (),
+    fn: Optional[Callable[[], float | dict]] = None,
+) -> Gauge:
+    return _register(Gauge(name, help_text, labelnames, fn))
+
+
+def histogram(
+    name: str,
+    help_text: str,
+    labelnames: tuple[str, ...] = (),
+    buckets: tuple[float, ...] = LATENCY_BUCKETS,
+) -> Histogram:
+    return _register(Histogram(name, help_text, labelnames, buckets))
+
+
+def render() -> str:
+    """Все метрики в text exposition format 0.0.4."""
+    lines: list[str] = []
+    for name in sorted(_registry):
+        lines.extend(_registry[name].render())
+    return "\n".join(lines) + "\n"
@@ -115,6 +115,24 @@ class ContextMeta(BaseModel):
     tokens_per_var: dict[str, int] = Field(default_factory=dict)
     was_truncated: bool = False
     truncated_vars: list[str] = Field(default_factory=list)
+    # Тот же system_prompt, разбитый на блоки для prompt caching:
+    # [статичный (персона+фаза), память юзера, волатильный]
+    system_blocks: list[str] = Field(default_factory=list)
+
+
+class ContextSnapshot(BaseModel):
+    """Согласованный срез памяти для build_context (одна read-транзакция)."""
+
+    model_config = ConfigDict(from_attributes=True)
+    user: dict[str, Any]
+    profile_json: Optional[dict[str, Any]] = None
+    procedural_json: Optional[dict[str, Any]] = None
+    patterns: list[dict[str, Any]] = Field(default_factory=list)
+    active_goal: Optional[dict[str, Any]] = None
+    goal_steps: list[dict[str, Any]] = Field(default_factory=list)
+    running_summary: str = ""
+    pending_facts: list[dict[str, Any]] = Field(default_factory=list)
+    episode_headers: list[dict[str, Any]] = Field(default_factory=list)
 
 
 class DailyMessage(BaseModel):
@@ -10,7 +10,8 @@ from __future__ import annotations
 import json
 import logging
 
-from shared.llm_client import call_gpt, LLMError
+from shared import degradation
+from shared.llm_client import PRIORITY_SAFETY, LLMError, call_gpt, llm_priority
 from shared.models import CrisisResult
 from bot.prompts.memory_prompts import CRISIS_VERIFICATION_PROMPT
 
@@ -91,11 +92,16 @@ _LEVEL1_KEYWORDS: list[str] = [
 # LLM-верификация (false positive check)
 # ---------------------------------------------------------------------------
 
+@llm_priority(PRIORITY_SAFETY)
 async def _verify_crisis(text: str, trigger: str) -> bool:
     """Проверяет через GPT-4o-mini, реальный ли кризис.
 
     Returns True если кризис реальный (или при любой ошибке -- conservative).
+    Под перегрузкой (degradation 3) GPT не зовётся -- тоже conservative.
     """
+    if not degradation.policy().verify_crisis:
+        logger.warning("Crisis verification skipped (degraded): trigger=%r", trigger)
+        return True
     prompt = CRISIS_VERIFICATION_PROMPT.format(text=text, trigger=trigger)
     try:
         raw = await call_gpt(
@@ -103,6 +109,7 @@ async def _verify_crisis(text: str, trigger: str) -> bool:
             timeout=10,
             max_tokens=100,
             response_format={"type": "json_object"},
+            cache="verify_crisis",
         )
         data = json.loads(raw)
         result = bool(data["is_real_crisis"])
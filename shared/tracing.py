@@ -0,0 +1,160 @@
+"""
+Трассировка хода по шагам: лёгкие спаны без внешнего коллектора.
+
+    async with trace(message_id, telegram_id):   # ход целиком
+        with span("crisis"):                     # шаг внутри хода
+            ...
+
+Текущая трасса живёт в contextvar: спаны из вложенных вызовов и задач,
+созданных внутри хода, попадают в неё же; вне трассы span() ничего не стоит.
+Завершённые трассы — в кольцевом буфере (TRACE_BUFFER_SIZE), при
+TRACE_PERSIST=1 ещё и в таблице message_traces по message_id.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+from shared.config import TRACE_BUFFER_SIZE, TRACE_PERSIST
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """Один ход: список спанов (name, offset_ms, duration_ms, ok)."""
+
+    __slots__ = ("message_id", "telegram_id", "started_at", "start", "spans",
+                 "total_ms", "error", "finished")
+
+    def __init__(self, message_id: int, telegram_id: int) -> None:
+        self.message_id = message_id
+        self.telegram_id = telegram_id
+        self.started_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        self.start = time.monotonic()
+        self.spans: list[tuple[str, float, float, bool]] = []
+        self.total_ms: float = 0.0
+        self.error: Optional[str] = None
+        self.finished = False
+
+    def to_dict(self) -> dict:
+        return {
+            "message_id": self.message_id,
+            "telegram_id": self.telegram_id,
+            "started_at": self.started_at,
+            "total_ms": self.total_ms,
+            "error": self.error,
+            "spans": [
+                {"name": n, "offset_ms": o, "duration_ms": d, "ok": ok}
+                for n, o, d, ok in self.spans
+            ],
+        }
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("_current_trace", default=None)
+_traces: deque[Trace] = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+@contextmanager
+def span(name: str):
+    """Замер шага текущей трассы; исключение помечает спан ok=False."""
+    tr = _current.get()
+    if tr is None or tr.finished:
+        yield
+        return
+    t0 = time.monotonic()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        t1 = time.monotonic()
+        tr.spans.append((
+            name,
+            round((t0 - tr.start) * 1000, 1),
+            round((t1 - t0) * 1000, 1),
+            ok,
+        ))
+
+
+@asynccontextmanager
+async def trace(message_id: int, telegram_id: int):
+    """Трасса хода: по выходу — в буфер и (TRACE_PERSIST) в message_traces.
+
+    Вложенный trace() присоединяется к внешнему.
+    """
+    if _current.get() is not None:
+        yield _current.get()
+        return
+    tr = Trace(message_id, telegram_id)
+    token = _current.set(tr)
+    try:
+        yield tr
+    except BaseException as e:
+        tr.error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        tr.total_ms = round((time.monotonic() - tr.start) * 1000, 1)
+        tr.finished = True  # поздние спаны фоновых задач не дописываются
+        _traces.append(tr)
+    if TRACE_PERSIST:
+        await _persist(tr)
+
+
+async def _persist(tr: Trace) -> None:
+    from bot.memory import database
+
+    try:
+        await database.save_message_trace(
+            tr.message_id, tr.telegram_id, tr.total_ms, tr.to_dict()["spans"],
+        )
+    except Exception:
+        logger.warning("save_message_trace failed for %s", tr.message_id, exc_info=True)
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    idx = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[idx]
+
+
+def recent_traces(limit: int = 50) -> list[dict]:
+    """Последние трассы, новые первыми."""
+    return [tr.to_dict() for tr in list(_traces)[::-1][:limit]]
+
+
+def get_step_percentiles() -> dict[str, dict]:
+    """p50/p95/p99 по каждому шагу (и total) на трассах из буфера."""
+    by_name: dict[str, list[float]] = {}
+    for tr in _traces:
+        by_name.setdefault("total", []).append(tr.total_ms)
+        for name, _, duration, _ in tr.spans:
+            by_name.setdefault(name, []).append(duration)
+    result = {}
+    for name, values in sorted(by_name.items()):
+        values.sort()
+        result[name] = {
+            "count": len(values),
+            "p50": _percentile(values, 0.50),
+            "p95": _percentile(values, 0.95),
+            "p99": _percentile(values, 0.99),
+            "max": values[-1],
+        }
+    return result
+
+
+def get_trace_stats() -> dict:
+    """Сводка для /health: сколько трасс в буфере и p95 хода."""
+    if not _traces:
+        return {}
+    totals = sorted(tr.total_ms for tr in _traces)
+    return {
+        "traces": len(totals),
+        "total_p95_ms": _percentile(totals, 0.95),
+        "errors": sum(1 for tr in _traces if tr.error),
+    }
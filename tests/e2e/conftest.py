@@ -47,9 +47,12 @@ async def real_db(tmp_path, monkeypatch):
 def clear_module_state():
     """Очищает модуль-уровневое состояние перед каждым тестом."""
     from bot.analytics.alerter import alerter
+    from bot.memory.episode_index import _indexes
     from bot.memory.full_memory_update import _error_counts
     from bot.session_manager import (
         _consecutive_errors,
+        _inboxes,
+        _inflight,
         _rate_counters,
         _user_locks,
     )
@@ -57,17 +60,25 @@ def clear_module_state():
     _user_locks.clear()
     _rate_counters.clear()
     _consecutive_errors.clear()
+    _inboxes.clear()
+    _inflight.clear()
     _error_counts.clear()
+    _indexes.clear()
     alerter._counters.clear()
     alerter._last_alert.clear()
     alerter._bot = None
 
-    yield
+    # Без debounce-окна: сообщения в тестах идут по одному
+    with patch("bot.session_manager.COALESCE_WINDOW_S", 0):
+        yield
 
     _user_locks.clear()
     _rate_counters.clear()
     _consecutive_errors.clear()
+    _inboxes.clear()
+    _inflight.clear()
     _error_counts.clear()
+    _indexes.clear()
     alerter._counters.clear()
     alerter._last_alert.clear()
     alerter._bot = None
@@ -58,6 +58,8 @@ class TestE2E5PauseContext:
             # Fallback: проверяем call_args
             call_args = mock_llm["session_manager_claude"].call_args
             system = call_args.kwargs.get("system", "")
+        # call_claude получает блоки для prompt caching
+        system = "\n\n".join(system)
 
         assert "Пауза" in system
         assert "2 ч" in system
@@ -190,3 +190,46 @@ class TestE2E3PhaseTransition:
         assert len(transitions) >= 1
         assert transitions[-1]["from_phase"] == "ЗНАКОМСТВО"
         assert transitions[-1]["to_phase"] == "ЗЕРКАЛО"
+
+
+# ===========================================================================
+# Атомарность хода (unit of work)
+# ===========================================================================
+
+
+class TestTurnAtomicity:
+    """Записи хода коммитятся вместе: нет processed-маркера без ответа."""
+
+    @pytest.mark.asyncio
+    async def test_turn_writes_committed_together(self, e2e_user, mock_llm):
+        """Успешный ход: сообщение, ответ, маркер и счётчики в БД, история с текущим сообщением."""
+        mock_llm["session_manager_claude"].return_value = "Слышу тебя."
+
+        await process_message(E2E_TELEGRAM_ID, 501, "Первое", "Маша")
+        await process_message(E2E_TELEGRAM_ID, 502, "Второе", "Маша")
+
+        recent = await get_recent_messages(E2E_TELEGRAM_ID, limit=10)
+        assert [m["content"] for m in recent] == [
+            "Первое", "Слышу тебя.", "Второе", "Слышу тебя.",
+        ]
+        assert await is_message_processed(502) is True
+        user = await get_user(E2E_TELEGRAM_ID)
+        assert user["messages_total"] == 2
+
+        # LLM получил текущее (ещё не закоммиченное) сообщение последним
+        sent = mock_llm["session_manager_claude"].call_args.kwargs["messages"]
+        assert sent[-1] == {"role": "user", "content": "Второе"}
+        assert [m["content"] for m in sent].count("Второе") == 1
+
+    @pytest.mark.asyncio
+    async def test_crash_mid_turn_leaves_nothing(self, e2e_user, mock_llm):
+        """Непойманная ошибка после шага 8 → ни сообщения, ни processed-маркера."""
+        mock_llm["session_manager_claude"].side_effect = RuntimeError("crash")
+
+        response = await process_message(E2E_TELEGRAM_ID, 601, "Привет", "Маша")
+
+        assert response is not None  # fallback
+        assert await is_message_processed(601) is False
+        assert await get_recent_messages(E2E_TELEGRAM_ID, limit=10) == []
+        user = await get_user(E2E_TELEGRAM_ID)
+        assert user["messages_total"] == 0
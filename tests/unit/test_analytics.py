@@ -1,13 +1,14 @@
 """
 Тесты для модулей аналитики шага 14:
-- bot/analytics/alerter.py (6 тестов)
+- bot/analytics/alerter.py (7 тестов)
 - bot/analytics/feedback_collector.py (8 тестов)
 - bot/analytics/daily_report.py (3 теста)
 - bot/analytics/weekly_report.py (3 теста)
 
-Итого: 20 тестов.
+Итого: 21 тест.
 """
 
+import asyncio
 import json
 import os
 import sys
@@ -165,6 +166,23 @@ async def test_alerter_bot_none() -> None:
     # Просто проверяем отсутствие исключения — тест пройдёт если нет crash
 
 
+@pytest.mark.asyncio
+async def test_alerter_circuit_change() -> None:
+    """Breaker LLM открылся / восстановился -> алерт; переход в half_open — молча."""
+    from bot.analytics.alerter import Alerter
+
+    a = Alerter()
+    a._maybe_send = AsyncMock()
+
+    a.on_circuit_change("openai:gpt-4o-mini", "open", {"from": "closed"})
+    a.on_circuit_change("openai:gpt-4o-mini", "half_open", {"from": "open"})
+    a.on_circuit_change("openai:gpt-4o-mini", "closed", {"from": "half_open"})
+    await asyncio.sleep(0)
+
+    events = [c.args[1] for c in a._maybe_send.await_args_list]
+    assert events == ["circuit_open:openai:gpt-4o-mini", "circuit_closed:openai:gpt-4o-mini"]
+
+
 # ---------------------------------------------------------------------------
 # 7. test_ask_feeling_all_conditions_met
 # ---------------------------------------------------------------------------
@@ -815,3 +815,25 @@ async def test_delete_user(mock_auth, auth_headers):
     assert resp.status_code == 200
     assert resp.json()["ok"] is True
     mock_del.assert_called_once_with(TELEGRAM_ID)
+
+
+# ---------------------------------------------------------------------------
+# 25. test_metrics_endpoint -> text exposition по ADMIN_KEY
+# ---------------------------------------------------------------------------
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    """/metrics: без ключа 403, с ключом — text format Prometheus."""
+    with patch("shared.config.ADMIN_KEY", "secret"):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            denied = await client.get("/metrics")
+            resp = await client.get("/metrics", params={"key": "secret"})
+
+    assert denied.status_code == 403
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE llm_request_seconds histogram" in resp.text
+    assert "# TYPE db_query_seconds histogram" in resp.text
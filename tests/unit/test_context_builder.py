@@ -9,7 +9,7 @@ from unittest.mock import AsyncMock, patch
 
 import pytest
 
-from shared.models import Episode
+from shared.models import ContextSnapshot, Episode
 
 
 # ---------------------------------------------------------------------------
@@ -59,6 +59,11 @@ _SAMPLE_STEPS = [
     {"title": "Поговорить с мамой", "status": "completed", "deadline_at": None},
 ]
 
+def _snapshot(user: dict, **kwargs) -> ContextSnapshot:
+    """Снимок контекста для мока database.load_context_snapshot."""
+    return ContextSnapshot(user=user, **kwargs)
+
+
 # Длинный base prompt (~1600 токенов) для тестов обрезки
 _LONG_BASE = "Ты — Ева. " * 500
 
@@ -83,15 +88,13 @@ def _default_patches():
 
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.build_system_prompt")
-@patch("bot.memory.context_builder.get_procedural_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_procedural_json")
 @patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
-@patch("bot.memory.context_builder.get_profile_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
 @patch("bot.memory.context_builder.database")
 async def test_new_user_basic(mock_db, mock_prof, mock_eps, mock_proc, mock_bsp):
     """Новый юзер (пустая память): was_truncated=False, fallback-профиль, token_count > 0."""
-    mock_db.get_user = AsyncMock(return_value=_BASE_USER.copy())
-    mock_db.get_patterns = AsyncMock(return_value=[])
-    mock_db.get_active_goal = AsyncMock(return_value=None)
+    mock_db.load_context_snapshot = AsyncMock(return_value=_snapshot(_BASE_USER.copy()))
     mock_prof.return_value = ""
     mock_eps.return_value = []
     mock_proc.return_value = ""
@@ -108,17 +111,15 @@ async def test_new_user_basic(mock_db, mock_prof, mock_eps, mock_proc, mock_bsp)
 
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.build_system_prompt")
-@patch("bot.memory.context_builder.get_procedural_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_procedural_json")
 @patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
-@patch("bot.memory.context_builder.get_profile_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
 @patch("bot.memory.context_builder.database")
 async def test_new_user_procedural_fallback(
     mock_db, mock_prof, mock_eps, mock_proc, mock_bsp,
 ):
     """Новый юзер: procedural пуст -> fallback 'Стиль не определён' в промпте."""
-    mock_db.get_user = AsyncMock(return_value=_BASE_USER.copy())
-    mock_db.get_patterns = AsyncMock(return_value=[])
-    mock_db.get_active_goal = AsyncMock(return_value=None)
+    mock_db.load_context_snapshot = AsyncMock(return_value=_snapshot(_BASE_USER.copy()))
     mock_prof.return_value = ""
     mock_eps.return_value = []
     mock_proc.return_value = ""
@@ -164,9 +165,9 @@ async def test_profile_truncation_removes_strengths_first():
 
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.build_system_prompt")
-@patch("bot.memory.context_builder.get_procedural_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_procedural_json")
 @patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
-@patch("bot.memory.context_builder.get_profile_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
 @patch("bot.memory.context_builder.database")
 async def test_returning_user_pause_in_prompt(
     mock_db, mock_prof, mock_eps, mock_proc, mock_bsp,
@@ -174,9 +175,7 @@ async def test_returning_user_pause_in_prompt(
     """Вернувшийся юзер (пауза > 24ч): 'Пауза' в промпте и pause_context в filled_vars."""
     user = _ACTIVE_USER.copy()
     user["last_message_at"] = "2026-02-25 10:00:00"
-    mock_db.get_user = AsyncMock(return_value=user)
-    mock_db.get_patterns = AsyncMock(return_value=[])
-    mock_db.get_active_goal = AsyncMock(return_value=None)
+    mock_db.load_context_snapshot = AsyncMock(return_value=_snapshot(user))
     mock_prof.return_value = "=== ПРОФИЛЬ ===\nИмя: Лена"
     mock_eps.return_value = []
     mock_proc.return_value = ""
@@ -221,18 +220,20 @@ async def test_truncation_commitments_only_pending():
 
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.build_system_prompt")
-@patch("bot.memory.context_builder.get_procedural_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_procedural_json")
 @patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
-@patch("bot.memory.context_builder.get_profile_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
 @patch("bot.memory.context_builder.database")
 async def test_active_user_all_sections(
     mock_db, mock_prof, mock_eps, mock_proc, mock_bsp,
 ):
     """Активный юзер с заполненными секциями: filled_vars содержит все ключи."""
-    mock_db.get_user = AsyncMock(return_value=_ACTIVE_USER.copy())
-    mock_db.get_patterns = AsyncMock(return_value=_SAMPLE_PATTERNS)
-    mock_db.get_active_goal = AsyncMock(return_value=_SAMPLE_GOAL.copy())
-    mock_db.get_goal_steps = AsyncMock(return_value=_SAMPLE_STEPS)
+    mock_db.load_context_snapshot = AsyncMock(return_value=_snapshot(
+        _ACTIVE_USER.copy(),
+        patterns=_SAMPLE_PATTERNS,
+        active_goal=_SAMPLE_GOAL.copy(),
+        goal_steps=_SAMPLE_STEPS,
+    ))
     mock_prof.return_value = "=== ПРОФИЛЬ ===\nИмя: Маша\nВозраст: 28"
     mock_eps.return_value = _SAMPLE_EPISODES
     mock_proc.return_value = "=== ПРОЦЕДУРНАЯ ПАМЯТЬ ===\nРаботает: отражение слов"
@@ -249,9 +250,9 @@ async def test_active_user_all_sections(
 
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.build_system_prompt")
-@patch("bot.memory.context_builder.get_procedural_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_procedural_json")
 @patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
-@patch("bot.memory.context_builder.get_profile_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
 @patch("bot.memory.context_builder.database")
 async def test_truncation_removes_pause_first(
     mock_db, mock_prof, mock_eps, mock_proc, mock_bsp,
@@ -260,10 +261,12 @@ async def test_truncation_removes_pause_first(
     # Юзер с паузой > 60 мин
     user = _ACTIVE_USER.copy()
     user["last_message_at"] = "2026-01-01 10:00:00"  # давно
-    mock_db.get_user = AsyncMock(return_value=user)
-    mock_db.get_patterns = AsyncMock(return_value=_SAMPLE_PATTERNS)
-    mock_db.get_active_goal = AsyncMock(return_value=_SAMPLE_GOAL.copy())
-    mock_db.get_goal_steps = AsyncMock(return_value=_SAMPLE_STEPS)
+    mock_db.load_context_snapshot = AsyncMock(return_value=_snapshot(
+        user,
+        patterns=_SAMPLE_PATTERNS,
+        active_goal=_SAMPLE_GOAL.copy(),
+        goal_steps=_SAMPLE_STEPS,
+    ))
 
     # Длинные тексты чтобы превысить бюджет
     mock_prof.return_value = "=== ПРОФИЛЬ ===\n" + "Важная информация. " * 300
@@ -281,19 +284,17 @@ async def test_truncation_removes_pause_first(
 
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.build_system_prompt")
-@patch("bot.memory.context_builder.get_procedural_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_procedural_json")
 @patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
-@patch("bot.memory.context_builder.get_profile_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
 @patch("bot.memory.context_builder.database")
 async def test_safe_call_handles_error(
     mock_db, mock_prof, mock_eps, mock_proc, mock_bsp,
 ):
-    """get_profile_as_text бросает Exception -> build_context НЕ падает, fallback подставлен."""
-    mock_db.get_user = AsyncMock(return_value=_BASE_USER.copy())
-    mock_db.get_patterns = AsyncMock(return_value=[])
-    mock_db.get_active_goal = AsyncMock(return_value=None)
+    """format_profile_json бросает Exception -> build_context НЕ падает, fallback подставлен."""
+    mock_db.load_context_snapshot = AsyncMock(return_value=_snapshot(_BASE_USER.copy()))
     mock_prof.side_effect = RuntimeError("DB connection lost")
-    mock_prof.__name__ = "get_profile_as_text"  # _safe_call логирует fn.__name__
+    mock_prof.__name__ = "format_profile_json"  # _safe_call логирует fn.__name__
     mock_eps.return_value = []
     mock_proc.return_value = ""
     mock_bsp.return_value = "Ты — Ева. ЗНАКОМСТВО"
@@ -311,8 +312,8 @@ async def test_safe_call_handles_error(
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.database")
 async def test_user_not_found_raises_valueerror(mock_db):
-    """get_user вернул None -> ValueError."""
-    mock_db.get_user = AsyncMock(return_value=None)
+    """load_context_snapshot вернул None -> ValueError."""
+    mock_db.load_context_snapshot = AsyncMock(return_value=None)
 
     from bot.memory.context_builder import build_context
 
@@ -322,18 +323,16 @@ async def test_user_not_found_raises_valueerror(mock_db):
 
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.build_system_prompt")
-@patch("bot.memory.context_builder.get_procedural_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_procedural_json")
 @patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
-@patch("bot.memory.context_builder.get_profile_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
 @patch("bot.memory.context_builder.database")
 async def test_base_prompt_always_first(
     mock_db, mock_prof, mock_eps, mock_proc, mock_bsp,
 ):
     """Результат начинается с base_prompt (для prompt caching)."""
     base = "Ты — Ева. Тёплая подруга. ЗНАКОМСТВО"
-    mock_db.get_user = AsyncMock(return_value=_BASE_USER.copy())
-    mock_db.get_patterns = AsyncMock(return_value=[])
-    mock_db.get_active_goal = AsyncMock(return_value=None)
+    mock_db.load_context_snapshot = AsyncMock(return_value=_snapshot(_BASE_USER.copy()))
     mock_prof.return_value = "=== ПРОФИЛЬ ===\nИмя: Маша"
     mock_eps.return_value = []
     mock_proc.return_value = ""
@@ -348,17 +347,15 @@ async def test_base_prompt_always_first(
 
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.build_system_prompt")
-@patch("bot.memory.context_builder.get_procedural_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_procedural_json")
 @patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
-@patch("bot.memory.context_builder.get_profile_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
 @patch("bot.memory.context_builder.database")
 async def test_context_meta_tokens_per_var(
     mock_db, mock_prof, mock_eps, mock_proc, mock_bsp,
 ):
     """tokens_per_var содержит токены для всех заполненных секций."""
-    mock_db.get_user = AsyncMock(return_value=_BASE_USER.copy())
-    mock_db.get_patterns = AsyncMock(return_value=[])
-    mock_db.get_active_goal = AsyncMock(return_value=None)
+    mock_db.load_context_snapshot = AsyncMock(return_value=_snapshot(_BASE_USER.copy()))
     mock_prof.return_value = "=== ПРОФИЛЬ ===\nИмя: Маша"
     mock_eps.return_value = []
     mock_proc.return_value = ""
@@ -376,20 +373,18 @@ async def test_context_meta_tokens_per_var(
 
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.build_system_prompt")
-@patch("bot.memory.context_builder.get_procedural_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_procedural_json")
 @patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
-@patch("bot.memory.context_builder.get_profile_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
 @patch("bot.memory.context_builder.database")
 async def test_running_summary_in_prompt(
     mock_db, mock_prof, mock_eps, mock_proc, mock_bsp,
 ):
     """running_summary непустой -> секция СОДЕРЖАНИЕ РАЗГОВОРА в промпте."""
-    mock_db.get_user = AsyncMock(return_value=_BASE_USER.copy())
-    mock_db.get_patterns = AsyncMock(return_value=[])
-    mock_db.get_active_goal = AsyncMock(return_value=None)
-    mock_db.get_running_summary = AsyncMock(
-        return_value="ФАКТЫ: Маша, 28 лет.\nЭМОЦИИ: тревога."
-    )
+    mock_db.load_context_snapshot = AsyncMock(return_value=_snapshot(
+        _BASE_USER.copy(),
+        running_summary="ФАКТЫ: Маша, 28 лет.\nЭМОЦИИ: тревога.",
+    ))
     mock_prof.return_value = ""
     mock_eps.return_value = []
     mock_proc.return_value = ""
@@ -406,18 +401,17 @@ async def test_running_summary_in_prompt(
 
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.build_system_prompt")
-@patch("bot.memory.context_builder.get_procedural_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_procedural_json")
 @patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
-@patch("bot.memory.context_builder.get_profile_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
 @patch("bot.memory.context_builder.database")
 async def test_running_summary_empty_not_in_prompt(
     mock_db, mock_prof, mock_eps, mock_proc, mock_bsp,
 ):
     """running_summary пустой -> секция НЕ в промпте."""
-    mock_db.get_user = AsyncMock(return_value=_BASE_USER.copy())
-    mock_db.get_patterns = AsyncMock(return_value=[])
-    mock_db.get_active_goal = AsyncMock(return_value=None)
-    mock_db.get_running_summary = AsyncMock(return_value="")
+    mock_db.load_context_snapshot = AsyncMock(
+        return_value=_snapshot(_BASE_USER.copy(), running_summary=""),
+    )
     mock_prof.return_value = ""
     mock_eps.return_value = []
     mock_proc.return_value = ""
@@ -433,17 +427,15 @@ async def test_running_summary_empty_not_in_prompt(
 
 @pytest.mark.asyncio
 @patch("bot.memory.context_builder.build_system_prompt")
-@patch("bot.memory.context_builder.get_procedural_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_procedural_json")
 @patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
-@patch("bot.memory.context_builder.get_profile_as_text", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
 @patch("bot.memory.context_builder.database")
 async def test_empty_profile_fallback(
     mock_db, mock_prof, mock_eps, mock_proc, mock_bsp,
 ):
-    """get_profile_as_text вернул '' -> 'Новый пользователь' в промпте."""
-    mock_db.get_user = AsyncMock(return_value=_BASE_USER.copy())
-    mock_db.get_patterns = AsyncMock(return_value=[])
-    mock_db.get_active_goal = AsyncMock(return_value=None)
+    """format_profile_json вернул '' -> 'Новый пользователь' в промпте."""
+    mock_db.load_context_snapshot = AsyncMock(return_value=_snapshot(_BASE_USER.copy()))
     mock_prof.return_value = ""
     mock_eps.return_value = []
     mock_proc.return_value = ""
@@ -454,3 +446,37 @@ async def test_empty_profile_fallback(
     prompt, _, _ = await build_context(111, "Привет")
 
     assert "Новый пользователь" in prompt
+
+
+@pytest.mark.asyncio
+@patch("bot.memory.context_builder.build_system_prompt")
+@patch("bot.memory.context_builder.format_procedural_json")
+@patch("bot.memory.context_builder.find_relevant_episodes", new_callable=AsyncMock)
+@patch("bot.memory.context_builder.format_profile_json")
+@patch("bot.memory.context_builder.database")
+async def test_system_blocks_stable_prefix(
+    mock_db, mock_prof, mock_eps, mock_proc, mock_bsp,
+):
+    """system_blocks: [персона, память, волатильное]; время и факты не в префиксе."""
+    base = "Ты — Ева. ЗЕРКАЛО"
+    mock_db.load_context_snapshot = AsyncMock(return_value=_snapshot(
+        _ACTIVE_USER.copy(),
+        running_summary="ФАКТЫ: Маша",
+        pending_facts=[{"fact_type": "city", "content": "Москва"}],
+    ))
+    mock_prof.return_value = "=== ПРОФИЛЬ ===\nИмя: Маша"
+    mock_eps.return_value = _SAMPLE_EPISODES
+    mock_proc.return_value = ""
+    mock_bsp.return_value = base
+
+    from bot.memory.context_builder import build_context
+
+    prompt, _, meta = await build_context(222, "Привет")
+
+    static, memory, volatile = meta.system_blocks
+    assert static == base
+    assert "Имя: Маша" in memory and "ФАКТЫ: Маша" in memory
+    assert "Сейчас:" not in memory and "Москва" not in memory
+    assert volatile.startswith("Сейчас:")
+    assert "Москва" in volatile and "Разговор про работу" in volatile
+    assert prompt == "\n\n".join(meta.system_blocks)
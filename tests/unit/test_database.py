@@ -20,6 +20,7 @@ from bot.memory.database import (
     add_pending_fact,
     add_webapp_event,
     clear_pending_facts,
+    close_db,
     create_daily_message,
     create_episode,
     create_feedback,
@@ -32,6 +33,9 @@ from bot.memory.database import (
     get_active_goal,
     get_all_users,
     get_episode_headers,
+    get_llm_cache,
+    get_message_traces,
+    get_db,
     get_episodes_by_ids,
     get_goal_steps,
     get_messages_since,
@@ -39,7 +43,9 @@ from bot.memory.database import (
     get_pending_facts,
     get_procedural,
     get_profile,
+    get_pool_stats,
     get_profile_version,
+    get_read_db,
     get_recent_emotions,
     get_recent_messages,
     get_running_summary,
@@ -47,11 +53,16 @@ from bot.memory.database import (
     get_users_needing_update,
     init_db,
     is_message_processed,
+    load_context_snapshot,
     mark_daily_responded,
     mark_message_processed,
+    prune_llm_cache,
+    put_llm_cache,
     retention_cleanup,
+    save_message_trace,
     save_running_summary,
     save_weekly_report,
+    transaction,
     update_enactment,
     update_feeling,
     update_goal_status,
@@ -84,15 +95,15 @@ def test_db(tmp_path, monkeypatch):
 
 
 @pytest.mark.asyncio
-async def test_init_db_creates_18_tables(test_db):
-    """init_db() создаёт ровно 18 таблиц."""
+async def test_init_db_creates_20_tables(test_db):
+    """init_db() создаёт ровно 20 таблиц."""
     await init_db()
     async with aiosqlite.connect(test_db) as db:
         async with db.execute(
             "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
         ) as cur:
             tables = [row[0] for row in await cur.fetchall()]
-    assert len(tables) == 18, f"Ожидалось 18 таблиц, получено {len(tables)}: {tables}"
+    assert len(tables) == 20, f"Ожидалось 20 таблиц, получено {len(tables)}: {tables}"
 
 
 @pytest.mark.asyncio
@@ -131,6 +142,179 @@ async def test_checkins_table_dropped(test_db):
     assert row is None, "Таблица checkins должна быть удалена"
 
 
+# ===========================================================================
+# Пул соединений
+# ===========================================================================
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connections(test_db):
+    """Повторные get_db/get_read_db отдают те же соединения, без переподключений."""
+    await init_db()
+    async with get_db() as w1:
+        pass
+    async with get_db() as w2:
+        pass
+    async with get_read_db() as r1:
+        pass
+    assert w1 is w2
+    assert r1 is not w1
+    stats = get_pool_stats()
+    assert stats["path"] == test_db
+    assert stats["checked_out"] == 0
+    assert stats["reconnects"] == 0
+    assert stats["acquisitions"] >= 3
+
+
+@pytest.mark.asyncio
+async def test_pool_nested_get_db_no_deadlock(test_db):
+    """Вложенный get_db в той же задаче переиспользует соединение писателя."""
+    await init_db()
+    async with get_db() as outer:
+        async with get_db() as inner:
+            assert inner is outer
+        async with get_read_db() as reader:
+            assert reader is outer
+
+
+@pytest.mark.asyncio
+async def test_pool_rolls_back_uncommitted_on_error(test_db):
+    """Ошибка посреди записи — транзакция откатывается при возврате в пул."""
+    await init_db()
+    with pytest.raises(RuntimeError):
+        async with get_db() as db:
+            await db.execute(
+                "INSERT INTO users (telegram_id, name) VALUES (?, ?)", (USER_ID, "X"),
+            )
+            raise RuntimeError("boom")
+    assert await get_user(USER_ID) is None
+    await create_user(USER_ID_2, name="Б")
+    assert (await get_user(USER_ID_2))["name"] == "Б"
+
+
+@pytest.mark.asyncio
+async def test_close_db_reopens_lazily(test_db):
+    """close_db закрывает пул; следующий вызов открывает новый."""
+    await init_db()
+    await create_user(USER_ID, name="Маша")
+    await close_db()
+    assert get_pool_stats() == {}
+    user = await get_user(USER_ID)
+    assert user["name"] == "Маша"
+
+
+@pytest.mark.asyncio
+async def test_group_commit_batches_concurrent_writes(test_db):
+    """Параллельные add_message уходят меньшим числом транзакций, id уникальны."""
+    import asyncio
+
+    await init_db()
+    await create_user(USER_ID, name="Маша")
+    ids = await asyncio.gather(
+        *(add_message(USER_ID, "user", f"msg {i}") for i in range(50))
+    )
+    assert len(set(ids)) == 50
+    assert all(isinstance(i, int) and i > 0 for i in ids)
+    stats = get_pool_stats()
+    assert stats["batches"] < 50 + 1  # +1: create_user
+    assert stats["writes_per_batch"] > 1
+    msgs = await get_recent_messages(USER_ID, limit=100)
+    assert len(msgs) == 50
+
+
+@pytest.mark.asyncio
+async def test_group_commit_isolates_failed_write(test_db):
+    """Упавшая запись в батче не откатывает соседние."""
+    import asyncio
+
+    await init_db()
+    await create_user(USER_ID, name="Маша")
+    results = await asyncio.gather(
+        add_message(USER_ID, "user", "ok 1"),
+        add_message(999999, "user", "FK violation"),  # нет такого users
+        add_message(USER_ID, "user", "ok 2"),
+        return_exceptions=True,
+    )
+    assert isinstance(results[1], aiosqlite.IntegrityError)
+    assert isinstance(results[0], int) and isinstance(results[2], int)
+    msgs = await get_recent_messages(USER_ID, limit=10)
+    assert [m["content"] for m in msgs] == ["ok 1", "ok 2"]
+
+
+@pytest.mark.asyncio
+async def test_group_commit_write_is_durable_after_await(test_db):
+    """После await add_message запись видна другому соединению (COMMIT прошёл)."""
+    await init_db()
+    await create_user(USER_ID, name="Маша")
+    msg_id = await add_message(USER_ID, "user", "Привет")
+    async with aiosqlite.connect(test_db) as db:
+        async with db.execute("SELECT content FROM messages WHERE id = ?", (msg_id,)) as cur:
+            row = await cur.fetchone()
+    assert row[0] == "Привет"
+
+
+@pytest.mark.asyncio
+async def test_transaction_commits_all_writes_together(test_db):
+    """Записи внутри transaction() не видны до выхода, потом — все сразу."""
+    await init_db()
+    await create_user(USER_ID, name="Маша")
+    async with transaction() as tx:
+        assert await add_message(USER_ID, "user", "Привет") is None
+        await mark_message_processed(777, USER_ID)
+        await add_message(USER_ID, "assistant", "Привет!")
+        await update_user(USER_ID, messages_total=1)
+        # Ещё не закоммичено
+        assert await is_message_processed(777) is False
+        assert len(tx.ops) == 4
+    assert len(tx.rowids) == 4
+    assert await is_message_processed(777) is True
+    assert len(await get_recent_messages(USER_ID)) == 2
+    assert (await get_user(USER_ID))["messages_total"] == 1
+
+
+@pytest.mark.asyncio
+async def test_transaction_discarded_on_exception(test_db):
+    """Исключение внутри transaction() — ни одна запись не попадает в БД."""
+    await init_db()
+    await create_user(USER_ID, name="Маша")
+    with pytest.raises(RuntimeError):
+        async with transaction():
+            await add_message(USER_ID, "user", "Привет")
+            await mark_message_processed(778, USER_ID)
+            raise RuntimeError("crash")
+    assert await is_message_processed(778) is False
+    assert await get_recent_messages(USER_ID) == []
+
+
+@pytest.mark.asyncio
+async def test_transaction_failed_statement_rolls_back_unit(test_db):
+    """Ошибка одной записи при коммите откатывает весь unit of work."""
+    import sqlite3
+
+    await init_db()
+    await create_user(USER_ID, name="Маша")
+    with pytest.raises(sqlite3.IntegrityError):
+        async with transaction():
+            await add_message(USER_ID, "user", "Привет")
+            await add_message(999999, "user", "FK violation")
+    assert await get_recent_messages(USER_ID) == []
+
+
+@pytest.mark.asyncio
+async def test_transaction_after_commit_hooks(test_db):
+    """after_commit вызывается после COMMIT, вложенный transaction() присоединяется."""
+    await init_db()
+    await create_user(USER_ID, name="Маша")
+    seen = []
+    async with transaction() as tx:
+        async with transaction() as inner:
+            assert inner is tx
+            await add_message(USER_ID, "user", "Привет")
+        tx.after_commit(lambda: seen.append(len(tx.rowids)))
+        assert seen == []
+    assert seen == [1]
+
+
 # ===========================================================================
 # Users CRUD
 # ===========================================================================
@@ -651,6 +835,61 @@ async def test_goal_steps_order(test_db):
     assert steps[2]["title"] == "Шаг C"
 
 
+# ===========================================================================
+# Context snapshot
+# ===========================================================================
+
+
+@pytest.mark.asyncio
+async def test_load_context_snapshot_unknown_user(test_db):
+    """Нет юзера -> None."""
+    await init_db()
+    assert await load_context_snapshot(USER_ID) is None
+
+
+@pytest.mark.asyncio
+async def test_load_context_snapshot_collects_all(test_db):
+    """Снимок содержит профиль, процедурку, паттерны, цель+шаги, факты, эпизоды."""
+    await init_db()
+    await create_user(USER_ID, name="Маша")
+    await upsert_profile(USER_ID, {"name": "Маша"}, tokens_count=10)
+    await upsert_procedural(USER_ID, {"what_works": ["юмор"]}, tokens_count=5)
+    await add_or_increment_pattern(USER_ID, "avoidance", "избегание конфликтов")
+    goal_id = await create_goal(USER_ID, "Цель")
+    await add_goal_step(goal_id, USER_ID, "Шаг B", sort_order=2)
+    await add_goal_step(goal_id, USER_ID, "Шаг A", sort_order=1)
+    await add_pending_fact(USER_ID, "city", "Москва")
+    await save_running_summary(USER_ID, "ФАКТЫ: Маша")
+    await create_episode(USER_ID, title="Эпизод 1", summary="Первый")
+
+    snap = await load_context_snapshot(USER_ID)
+
+    assert snap.user["name"] == "Маша"
+    assert snap.profile_json == {"name": "Маша"}
+    assert snap.procedural_json == {"what_works": ["юмор"]}
+    assert [p["pattern_text"] for p in snap.patterns] == ["избегание конфликтов"]
+    assert snap.active_goal["id"] == goal_id
+    assert [s["title"] for s in snap.goal_steps] == ["Шаг A", "Шаг B"]
+    assert [f["content"] for f in snap.pending_facts] == ["Москва"]
+    assert snap.running_summary == "ФАКТЫ: Маша"
+    assert [h["title"] for h in snap.episode_headers] == ["Эпизод 1"]
+
+
+@pytest.mark.asyncio
+async def test_load_context_snapshot_inside_held_writer(test_db):
+    """Под удерживаемым writer'ом снимок читает его транзакцию и не откатывает её."""
+    await init_db()
+    await create_user(USER_ID, name="Маша")
+    async with get_db() as db:
+        await db.execute(
+            "UPDATE users SET name = ? WHERE telegram_id = ?", ("Лена", USER_ID),
+        )
+        snap = await load_context_snapshot(USER_ID)
+        assert snap.user["name"] == "Лена"
+        await db.commit()
+    assert (await get_user(USER_ID))["name"] == "Лена"
+
+
 # ===========================================================================
 # Daily messages
 # ===========================================================================
@@ -926,3 +1165,34 @@ async def test_delete_user_completely(test_db):
 
     # Processed messages удалены
     assert await is_message_processed(12345) is False
+
+
+@pytest.mark.asyncio
+async def test_llm_cache_ttl_and_prune(test_db):
+    """llm_cache: просроченное не читается; prune оставляет max_rows самых долгоживущих."""
+    await init_db()
+    await put_llm_cache("k1", "goal_steps", "gpt-4o-mini", "ответ 1", expires_at=1000.0)
+    await put_llm_cache("k2", "goal_steps", "gpt-4o-mini", "ответ 2", expires_at=3000.0)
+    await put_llm_cache("k3", "goal_steps", "gpt-4o-mini", "ответ 3", expires_at=2000.0)
+
+    assert await get_llm_cache("k1", now=1500.0) is None
+    assert await get_llm_cache("k2", now=1500.0) == ("ответ 2", 3000.0)
+
+    await prune_llm_cache(now=1500.0, max_rows=1)
+    assert await get_llm_cache("k3", now=0.0) is None
+    assert await get_llm_cache("k2", now=0.0) == ("ответ 2", 3000.0)
+
+
+@pytest.mark.asyncio
+async def test_message_traces_roundtrip(test_db):
+    """message_traces: повтор по тому же message_id заменяет запись."""
+    await init_db()
+    spans = [{"name": "crisis", "offset_ms": 0.1, "duration_ms": 2.5, "ok": True}]
+    await save_message_trace(1, USER_ID, 10.0, [])
+    await save_message_trace(1, USER_ID, 12.5, spans)
+    await save_message_trace(2, USER_ID, 7.0, spans)
+
+    traces = await get_message_traces(limit=10)
+    assert [t["message_id"] for t in traces] == [2, 1]
+    assert traces[1]["total_ms"] == 12.5
+    assert traces[1]["spans"] == spans
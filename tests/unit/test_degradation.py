@@ -0,0 +1,75 @@
+"""Тесты shared/degradation.py — уровни, гистерезис, политики."""
+
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from shared import degradation
+from shared.safety import detect_crisis
+
+
+@pytest.fixture
+def controller():
+    """Свежий контроллер с детерминированными порогами."""
+    ctl = degradation._Controller()
+    with (
+        patch.object(degradation, "_controller", ctl),
+        patch.object(degradation, "DEGRADE_LATENCY_S", (5.0, 10.0, 20.0)),
+        patch.object(degradation, "DEGRADE_BACKLOG", (10, 20, 40)),
+        patch.object(degradation, "DEGRADE_COOLDOWN_S", 30.0),
+        patch.object(degradation, "DEGRADE_MIN_SAMPLES", 3),
+    ):
+        yield ctl
+
+
+def test_latency_raises_level_immediately(controller):
+    for _ in range(3):
+        controller.observe_turn(12.0)
+    assert controller.evaluate(backlog=0, now=controller._turns[-1][0]) == 2
+    assert controller.last_signals["turn_p95_s"] == 12.0
+
+
+def test_backlog_raises_level(controller):
+    assert controller.evaluate(backlog=45, now=100.0) == 3
+    assert controller.transitions == 1
+
+
+def test_steps_down_one_level_after_cooldown(controller):
+    controller.evaluate(backlog=45, now=100.0)
+    assert controller.evaluate(backlog=0, now=101.0) == 3  # ниже порога — отсчёт
+    assert controller.evaluate(backlog=0, now=120.0) == 3
+    assert controller.evaluate(backlog=0, now=131.0) == 2
+    assert controller.evaluate(backlog=0, now=150.0) == 2
+    assert controller.evaluate(backlog=0, now=161.0) == 1
+    # всплеск во время спуска — снова вверх сразу
+    assert controller.evaluate(backlog=25, now=162.0) == 2
+
+
+def test_disabled_is_always_normal(controller):
+    controller.evaluate(backlog=45, now=100.0)
+    with patch.object(degradation, "DEGRADE_ENABLED", False):
+        assert degradation.level() == degradation.LEVEL_NORMAL
+
+
+def test_policies_are_cumulative():
+    levels = [degradation._POLICIES[i] for i in range(degradation.LEVEL_MAX + 1)]
+    assert levels[0] == degradation.Policy()
+    assert not levels[1].llm_episode_selection and levels[1].memory_update_trigger
+    assert not levels[2].memory_update_trigger
+    assert not levels[3].verify_crisis
+    assert [p.history_limit for p in levels] == sorted((p.history_limit for p in levels), reverse=True)
+
+
+@pytest.mark.asyncio
+async def test_max_level_skips_verification_but_not_level3():
+    """Уровень 3: кризис 2 — без GPT и консервативно; кризис 3 — как всегда."""
+    gpt = AsyncMock()
+    with (
+        patch("shared.degradation.level", return_value=degradation.LEVEL_MAX),
+        patch("shared.safety.call_gpt", gpt),
+    ):
+        assert (await detect_crisis("муж бьёт меня")).level == 2
+        result = await detect_crisis("я не хочу жить")
+
+    gpt.assert_not_called()
+    assert result.level == 3
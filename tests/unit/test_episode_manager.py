@@ -1,6 +1,6 @@
 """
 Тесты для bot/memory/episode_manager.py
-9 тестов: create_episode, find_relevant_episodes, get_episode_titles.
+create_episode, find_relevant_episodes (BM25 и LLM-режим), get_episode_titles.
 Все database и LLM вызовы замоканы.
 """
 
@@ -119,6 +119,7 @@ async def test_create_episode_llm_error_propagates(mock_gpt, mock_db):
 
 
 @pytest.mark.asyncio
+@patch("bot.memory.episode_manager.EPISODE_RETRIEVER", "llm")
 @patch("bot.memory.episode_manager.EPISODE_SELECTION_PROMPT", _TEST_SELECTION_PROMPT)
 @patch("bot.memory.episode_manager.database")
 @patch("bot.memory.episode_manager.call_gpt")
@@ -175,6 +176,7 @@ async def test_find_relevant_episodes_empty_headers(mock_gpt, mock_db):
 
 
 @pytest.mark.asyncio
+@patch("bot.memory.episode_manager.EPISODE_RETRIEVER", "llm")
 @patch("bot.memory.episode_manager.EPISODE_SELECTION_PROMPT", _TEST_SELECTION_PROMPT)
 @patch("bot.memory.episode_manager.database")
 @patch("bot.memory.episode_manager.call_gpt")
@@ -204,6 +206,7 @@ async def test_find_relevant_episodes_llm_error_keyword_fallback(mock_gpt, mock_
 
 
 @pytest.mark.asyncio
+@patch("bot.memory.episode_manager.EPISODE_RETRIEVER", "llm")
 @patch("bot.memory.episode_manager.EPISODE_SELECTION_PROMPT", _TEST_SELECTION_PROMPT)
 @patch("bot.memory.episode_manager.database")
 @patch("bot.memory.episode_manager.call_gpt")
@@ -231,6 +234,103 @@ async def test_find_relevant_episodes_invalid_json_keyword_fallback(mock_gpt, mo
     assert len(result) >= 1
 
 
+def _episode_row(ep_id: int, title: str, summary: str, key_insight=None) -> dict:
+    return {
+        "id": ep_id, "title": title, "summary": summary,
+        "emotional_tone": "", "key_insight": key_insight,
+        "commitments_json": [], "techniques_worked_json": [],
+        "techniques_failed_json": [],
+    }
+
+
+_BM25_ROWS = [
+    _episode_row(10, "Разговор про маму", "Мама опять критиковала за выбор работы"),
+    _episode_row(20, "Работа и усталость", "Выгорание, начальник давит сроками"),
+    _episode_row(30, "Цели на месяц", "Спорт и сон", key_insight="Нужен план"),
+]
+
+
+def _rows_by_ids(ids):
+    return [r for r in _BM25_ROWS if r["id"] in ids]
+
+
+@pytest.mark.asyncio
+@patch("bot.memory.episode_index.database")
+@patch("bot.memory.episode_manager.database")
+@patch("bot.memory.episode_manager.call_gpt")
+async def test_find_relevant_episodes_bm25_no_llm(mock_gpt, mock_db, mock_idx_db):
+    """BM25 по умолчанию: стемминг (маме -> мам), без вызова GPT, порядок по score."""
+    from bot.memory import episode_index
+    from bot.memory.episode_manager import find_relevant_episodes
+
+    episode_index.drop(111)
+    headers = [{"id": r["id"], "title": r["title"]} for r in _BM25_ROWS]
+    mock_idx_db.get_episodes_by_ids = AsyncMock(side_effect=_rows_by_ids)
+    mock_db.get_episodes_by_ids = AsyncMock(side_effect=_rows_by_ids)
+
+    result = await find_relevant_episodes(111, "Позвонила маме, снова про работу", headers=headers)
+
+    assert [ep.id for ep in result] == [10, 20]
+    mock_gpt.assert_not_awaited()
+    episode_index.drop(111)
+
+
+@pytest.mark.asyncio
+@patch("bot.memory.episode_index.database")
+@patch("bot.memory.episode_manager.database")
+@patch("bot.memory.episode_manager.call_gpt")
+async def test_bm25_index_incremental_and_sync(mock_gpt, mock_db, mock_idx_db):
+    """create_episode добавляет в индекс без перечитывания; удалённый эпизод выпадает."""
+    from bot.memory import episode_index
+    from bot.memory.episode_manager import create_episode
+
+    episode_index.drop(111)
+    mock_idx_db.get_episodes_by_ids = AsyncMock(side_effect=_rows_by_ids)
+    headers = [{"id": 10, "title": "Разговор про маму"}]
+    assert [i for i, _ in await episode_index.search(111, "мама", headers)] == [10]
+
+    mock_gpt.return_value = json.dumps({"title": "Ссора с мужем", "summary": "Конфликт"})
+    mock_db.create_episode = AsyncMock(return_value=40)
+    await create_episode(111, [{"role": "user", "content": "Поссорились"}])
+
+    headers.append({"id": 40, "title": "Ссора с мужем"})
+    hits = await episode_index.search(111, "опять конфликт с мужем", headers)
+    assert [i for i, _ in hits] == [40]
+    # Эпизод 40 добавлен инкрементально — догрузки из БД не было
+    assert mock_idx_db.get_episodes_by_ids.await_count == 1
+
+    assert await episode_index.search(111, "мама", headers[1:]) == []
+    episode_index.drop(111)
+
+
+@pytest.mark.asyncio
+@patch("bot.memory.episode_manager._RERANK_MARGIN", 0.0)
+@patch("bot.memory.episode_manager.EPISODE_LLM_RERANK", True)
+@patch("bot.memory.episode_manager.EPISODE_SELECTION_PROMPT", _TEST_SELECTION_PROMPT)
+@patch("bot.memory.episode_index.database")
+@patch("bot.memory.episode_manager.database")
+@patch("bot.memory.episode_manager.call_gpt")
+async def test_bm25_ambiguous_llm_rerank(mock_gpt, mock_db, mock_idx_db):
+    """Неоднозначный топ -> GPT выбирает среди BM25-кандидатов."""
+    from bot.memory import episode_index
+    from bot.memory.episode_manager import find_relevant_episodes
+
+    episode_index.drop(111)
+    headers = [{"id": r["id"], "title": r["title"]} for r in _BM25_ROWS]
+    mock_idx_db.get_episodes_by_ids = AsyncMock(side_effect=_rows_by_ids)
+    mock_db.get_episodes_by_ids = AsyncMock(side_effect=_rows_by_ids)
+    # Кандидаты в порядке BM25: [10 (мама+работа), 20 (работа)]; GPT берёт второй
+    mock_gpt.return_value = json.dumps({"selected": [2]})
+
+    result = await find_relevant_episodes(
+        111, "Мама и работа", limit=1, headers=headers,
+    )
+
+    assert [ep.id for ep in result] == [20]
+    mock_gpt.assert_awaited_once()
+    episode_index.drop(111)
+
+
 # ---------------------------------------------------------------------------
 # get_episode_titles
 # ---------------------------------------------------------------------------
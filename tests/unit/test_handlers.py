@@ -22,6 +22,7 @@ from bot.handlers import (
     handle_voice,
     handle_other_media,
     callback_handler,
+    _StreamingReply,
 )
 
 
@@ -250,3 +251,73 @@ async def test_handle_voice_transcription_fails(mock_transcribe: AsyncMock) -> N
     update.message.reply_text.assert_called_once()
     text = update.message.reply_text.call_args[0][0]
     assert "не расслышала" in text
+
+
+# ---------------------------------------------------------------------------
+# Стриминг ответа
+# ---------------------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_streaming_reply_first_sentence_then_throttled_edits() -> None:
+    """Первое предложение — reply_text, дальше правки не чаще интервала, finish — финальный текст."""
+    update = make_update()
+    sent = MagicMock()
+    sent.edit_text = AsyncMock()
+    update.message.reply_text.return_value = sent
+    reply = _StreamingReply(update.message)
+
+    with patch("bot.handlers.STREAM_EDIT_INTERVAL_S", 100.0):
+        await reply.on_delta("Привет")
+        update.message.reply_text.assert_not_called()
+        await reply.on_delta("Привет! Как ты")
+        await reply.on_delta("Привет! Как ты сегодня")
+        await reply.finish("Привет! Как ты сегодня?")
+
+    update.message.reply_text.assert_awaited_once_with("Привет!")
+    # Промежуточных правок нет (интервал не прошёл), только финальная
+    sent.edit_text.assert_awaited_once_with("Привет! Как ты сегодня?")
+
+
+@pytest.mark.asyncio
+async def test_streaming_reply_edits_at_word_boundary() -> None:
+    """Когда интервал прошёл — правка по границе слова, без недописанного слова."""
+    update = make_update()
+    sent = MagicMock()
+    sent.edit_text = AsyncMock()
+    update.message.reply_text.return_value = sent
+    reply = _StreamingReply(update.message)
+
+    with patch("bot.handlers.STREAM_EDIT_INTERVAL_S", 0.0):
+        await reply.on_delta("Привет! Ка")
+        await reply.on_delta("Привет! Как ты сег")
+
+    sent.edit_text.assert_awaited_once_with("Привет! Как ты")
+
+
+@pytest.mark.asyncio
+async def test_streaming_reply_nothing_sent_replies_full() -> None:
+    """Стрима не было (или не дошёл до конца предложения) — finish отправляет ответ целиком."""
+    update = make_update()
+    reply = _StreamingReply(update.message)
+
+    await reply.on_delta("Без точки")
+    await reply.finish("Без точки в конце")
+
+    update.message.reply_text.assert_awaited_once_with("Без точки в конце")
+
+
+@pytest.mark.asyncio
+async def test_streaming_reply_edit_failure_sends_full() -> None:
+    """Финальная правка не прошла — ответ уходит новым сообщением."""
+    from telegram.error import TelegramError
+
+    update = make_update()
+    sent = MagicMock()
+    sent.edit_text = AsyncMock(side_effect=TelegramError("message to edit not found"))
+    update.message.reply_text.return_value = sent
+    reply = _StreamingReply(update.message)
+
+    await reply.on_delta("Привет.")
+    await reply.finish("Привет. Всё хорошо.")
+
+    assert update.message.reply_text.await_args_list[-1].args == ("Привет. Всё хорошо.",)
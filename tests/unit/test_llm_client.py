@@ -15,7 +15,29 @@ import anthropic
 import openai
 import pytest
 
-from shared.llm_client import FALLBACK_RESPONSE, LLMError, call_claude, call_gpt
+from shared.llm_client import (
+    FALLBACK_RESPONSE,
+    LLMError,
+    _LatencyTracker,
+    _ProviderScheduler,
+    call_claude,
+    call_gpt,
+    get_hedge_stats,
+    hedged_call,
+    hedged_stream,
+    stream_claude,
+    stream_gpt,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_breakers():
+    """Circuit breaker'ы — модульное состояние: сбрасываем между тестами."""
+    from shared import llm_client
+
+    llm_client._breakers.clear()
+    yield
+    llm_client._breakers.clear()
 
 
 # ---------------------------------------------------------------------------
@@ -152,6 +174,28 @@ async def test_call_claude_prompt_caching(mock_client):
     assert block["cache_control"] == {"type": "ephemeral"}
 
 
+@pytest.mark.asyncio
+@patch("shared.llm_client._claude_client")
+async def test_call_claude_system_blocks_breakpoints(mock_client):
+    """system блоками: порядок сохранён, на каждом блоке свой cache_control, usage кэша в логе."""
+    response = make_claude_response("OK")
+    response.usage.cache_read_input_tokens = 1200
+    response.usage.cache_creation_input_tokens = 80
+    mock_client.messages.create = AsyncMock(return_value=response)
+
+    with patch("shared.llm_client.logger") as mock_logger:
+        await call_claude(
+            messages=[{"role": "user", "content": "Привет"}],
+            system=["Персона", "Память", "", "Сейчас: 10:00"],
+        )
+
+    system_arg = mock_client.messages.create.call_args.kwargs["system"]
+    assert [b["text"] for b in system_arg] == ["Персона", "Память", "Сейчас: 10:00"]
+    assert all(b["cache_control"] == {"type": "ephemeral"} for b in system_arg)
+    log_args = mock_logger.info.call_args.args
+    assert 1200 in log_args and 80 in log_args
+
+
 # ===========================================================================
 # call_gpt
 # ===========================================================================
@@ -365,3 +409,627 @@ async def test_call_gpt_no_system(mock_client):
     sent_messages = call_kwargs.kwargs.get("messages")
     assert len(sent_messages) == 1
     assert sent_messages[0] == {"role": "user", "content": "Вопрос"}
+
+
+# ===========================================================================
+# stream_claude / stream_gpt
+# ===========================================================================
+
+
+async def _agen(items):
+    for item in items:
+        yield item
+
+
+def make_claude_stream(deltas):
+    stream = MagicMock()
+    stream.text_stream = _agen(deltas)
+    stream.get_final_message = AsyncMock(return_value=make_claude_response("".join(deltas)))
+    ctx = MagicMock()
+    ctx.__aenter__ = AsyncMock(return_value=stream)
+    ctx.__aexit__ = AsyncMock(return_value=False)
+    return ctx
+
+
+def make_gpt_chunk(content=None, usage=None):
+    chunk = MagicMock()
+    chunk.usage = usage
+    if content is None:
+        chunk.choices = []
+    else:
+        choice = MagicMock()
+        choice.delta.content = content
+        chunk.choices = [choice]
+    return chunk
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client._claude_client")
+async def test_stream_claude_yields_deltas(mock_client):
+    """stream_claude отдаёт дельты по порядку, system — блоками с cache_control."""
+    mock_client.messages.stream = MagicMock(return_value=make_claude_stream(["При", "вет!"]))
+
+    deltas = [
+        d async for d in stream_claude(
+            messages=[{"role": "user", "content": "Привет"}],
+            system=["Персона", "Память"],
+        )
+    ]
+
+    assert deltas == ["При", "вет!"]
+    system_arg = mock_client.messages.stream.call_args.kwargs["system"]
+    assert [b["text"] for b in system_arg] == ["Персона", "Память"]
+    assert all(b["cache_control"] == {"type": "ephemeral"} for b in system_arg)
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client._claude_client")
+async def test_stream_claude_api_error(mock_client):
+    """Ошибка API при открытии стрима -> LLMError, без retry."""
+    ctx = MagicMock()
+    ctx.__aenter__ = AsyncMock(
+        side_effect=anthropic.APIError(message="overloaded", request=MagicMock(), body=None)
+    )
+    ctx.__aexit__ = AsyncMock(return_value=False)
+    mock_client.messages.stream = MagicMock(return_value=ctx)
+
+    with pytest.raises(LLMError):
+        async for _ in stream_claude(
+            messages=[{"role": "user", "content": "Привет"}], system="Ты Ева",
+        ):
+            pass
+    assert mock_client.messages.stream.call_count == 1
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client._gpt_client")
+async def test_stream_gpt_yields_content(mock_client):
+    """stream_gpt: пустые чанки и чанк с usage пропускаются, stream=True в запросе."""
+    chunks = [
+        make_gpt_chunk("Ok"),
+        make_gpt_chunk(""),
+        make_gpt_chunk(", го"),
+        make_gpt_chunk(usage=MagicMock(prompt_tokens=10, completion_tokens=3)),
+    ]
+    mock_client.chat.completions.create = AsyncMock(return_value=_agen(chunks))
+
+    deltas = [d async for d in stream_gpt(messages=[{"role": "user", "content": "?"}], system="S")]
+
+    assert deltas == ["Ok", ", го"]
+    kwargs = mock_client.chat.completions.create.call_args.kwargs
+    assert kwargs["stream"] is True
+    assert kwargs["messages"][0] == {"role": "system", "content": "S"}
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client._gpt_client")
+async def test_stream_gpt_timeout(mock_client):
+    """Стрим, не уложившийся в timeout -> LLMError."""
+    async def slow():
+        yield make_gpt_chunk("a")
+        await asyncio.sleep(1)
+        yield make_gpt_chunk("b")
+
+    mock_client.chat.completions.create = AsyncMock(return_value=slow())
+
+    got = []
+    with pytest.raises(LLMError):
+        async for d in stream_gpt(messages=[{"role": "user", "content": "?"}], timeout=0.05):
+            got.append(d)
+    assert got == ["a"]
+
+
+# ===========================================================================
+# hedged_call / hedged_stream
+# ===========================================================================
+
+
+@pytest.fixture
+def hedge_state():
+    """Чистые трекеры/счётчики и короткий порог hedge."""
+    from shared import llm_client
+
+    llm_client._latency.clear()
+    for key in llm_client._hedge_stats:
+        llm_client._hedge_stats[key] = 0
+    with patch("shared.llm_client.HEDGE_DEFAULT_DELAY_S", 0.05):
+        yield
+    llm_client._latency.clear()
+
+
+def _answer(text, delay=0.0, error=None, log=None):
+    async def call():
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if log is not None:
+                log.append(f"cancelled {text}")
+            raise
+        if error is not None:
+            raise error
+        return text
+    return call
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client.asyncio.sleep", new_callable=AsyncMock)
+@patch("shared.llm_client._claude_client")
+async def test_call_claude_no_fallback_raises(mock_client, mock_sleep):
+    """fallback=False: после всех попыток LLMError вместо FALLBACK_RESPONSE."""
+    mock_client.messages.create = AsyncMock(
+        side_effect=anthropic.APIError(message="overloaded", request=MagicMock(), body=None)
+    )
+    with pytest.raises(LLMError):
+        await call_claude(
+            messages=[{"role": "user", "content": "Привет"}], system="Ты Ева", fallback=False,
+        )
+
+
+@pytest.mark.asyncio
+async def test_hedged_call_primary_fast(hedge_state):
+    """Primary ответил до порога — backup не запускается."""
+    backup = AsyncMock(return_value="backup")
+    result = await hedged_call(("claude", _answer("primary")), ("openai", backup))
+    assert result == "primary"
+    backup.assert_not_called()
+    assert get_hedge_stats()["primary_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_call_slow_primary_backup_wins(hedge_state):
+    """Primary не ответил за порог → backup; победил backup, primary отменён."""
+    log: list[str] = []
+    result = await hedged_call(
+        ("claude", _answer("primary", delay=1.0, log=log)),
+        ("openai", _answer("backup", delay=0.01)),
+    )
+    await asyncio.sleep(0)
+    assert result == "backup"
+    assert log == ["cancelled primary"]
+    stats = get_hedge_stats()
+    assert stats["hedged"] == 1 and stats["backup_wins"] == 1
+    assert stats["backup_win_rate"] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_hedged_call_primary_wins_after_hedge(hedge_state):
+    """Hedge запущен, но primary всё равно ответил первым — backup отменён."""
+    log: list[str] = []
+    result = await hedged_call(
+        ("claude", _answer("primary", delay=0.08)),
+        ("openai", _answer("backup", delay=1.0, log=log)),
+    )
+    await asyncio.sleep(0)
+    assert result == "primary"
+    assert log == ["cancelled backup"]
+    assert get_hedge_stats()["primary_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_call_failover(hedge_state):
+    """Primary упал до порога → сразу backup (failover)."""
+    result = await hedged_call(
+        ("claude", _answer("x", error=LLMError("overloaded"))),
+        ("openai", _answer("backup")),
+    )
+    assert result == "backup"
+    assert get_hedge_stats()["failovers"] == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_call_both_fail(hedge_state):
+    """Оба провайдера упали → LLMError."""
+    with pytest.raises(LLMError):
+        await hedged_call(
+            ("claude", _answer("x", error=LLMError("a"))),
+            ("openai", _answer("y", error=LLMError("b"))),
+        )
+    assert get_hedge_stats()["failures"] == 1
+
+
+def test_latency_tracker_percentile():
+    """Порог = перцентиль окна, не ниже HEDGE_MIN_DELAY_S; мало данных — дефолт."""
+    tracker = _LatencyTracker(size=100)
+    with (
+        patch("shared.llm_client.HEDGE_PERCENTILE", 0.9),
+        patch("shared.llm_client.HEDGE_MIN_DELAY_S", 0.5),
+        patch("shared.llm_client.HEDGE_DEFAULT_DELAY_S", 8.0),
+    ):
+        tracker.record(1.0)
+        assert tracker.hedge_delay() == 8.0
+        for i in range(1, 101):
+            tracker.record(i / 10)
+        assert tracker.hedge_delay() == pytest.approx(9.1)
+        for _ in range(100):
+            tracker.record(0.1)
+        assert tracker.hedge_delay() == 0.5
+
+
+@pytest.mark.asyncio
+async def test_hedged_stream_backup_first_token(hedge_state):
+    """Нет первого токена от primary за порог → читаем backup, primary закрыт."""
+    closed: list[str] = []
+
+    def slow_primary():
+        async def gen():
+            try:
+                await asyncio.sleep(1.0)
+                yield "primary"
+            finally:
+                closed.append("primary")
+        return gen()
+
+    def backup():
+        return _agen(["Ба", "кап"])
+
+    deltas = [d async for d in hedged_stream(("claude", slow_primary), ("openai", backup))]
+
+    assert deltas == ["Ба", "кап"]
+    assert closed == ["primary"]
+    assert get_hedge_stats()["backup_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_stream_primary_failover(hedge_state):
+    """Стрим primary упал до первого токена → backup."""
+    async def broken():
+        raise LLMError("overloaded")
+        yield  # noqa: unreachable — делает функцию генератором
+
+    deltas = [
+        d async for d in hedged_stream(("claude", broken), ("openai", lambda: _agen(["ok"])))
+    ]
+    assert deltas == ["ok"]
+    assert get_hedge_stats()["failovers"] == 1
+
+
+# ===========================================================================
+# Планировщик: приоритеты, token bucket, очереди
+# ===========================================================================
+
+
+@pytest.fixture
+def sched_stats():
+    """Чистые счётчики планировщика."""
+    from shared import llm_client
+
+    for cls in llm_client._sched_stats:
+        llm_client._sched_stats[cls] = llm_client._new_class_stats()
+    yield llm_client._sched_stats
+
+
+@pytest.mark.asyncio
+async def test_scheduler_unlimited_admits_immediately(sched_stats):
+    """Без лимитов — допуск без очереди."""
+    sched = _ProviderScheduler("test", rpm=0, tpm=0)
+    await sched.acquire("background", 1000)
+    assert sched_stats["background"]["granted"] == 1
+    assert sched_stats["background"]["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_interactive_before_background(sched_stats):
+    """Бюджет кончился: interactive, пришедший позже, пускается раньше background."""
+    sched = _ProviderScheduler("test", rpm=600, tpm=0)  # 10 запросов/сек
+    sched.requests.level = 0
+    order: list[str] = []
+
+    async def call(cls):
+        await sched.acquire(cls, 10)
+        order.append(cls)
+
+    bg = asyncio.create_task(call("background"))
+    await asyncio.sleep(0)
+    inter = asyncio.create_task(call("interactive"))
+    await asyncio.wait_for(inter, timeout=1)
+
+    assert order == ["interactive"]
+    assert not bg.done()  # background ждёт свой запас (_RESERVE)
+    assert sched_stats["interactive"]["waited"] == 1
+    assert sched_stats["interactive"]["wait_max_ms"] > 0
+    bg.cancel()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_background_keeps_reserve(sched_stats):
+    """Background не забирает последние 30% бюджета — они для interactive."""
+    sched = _ProviderScheduler("test", rpm=0, tpm=1000)
+    sched.tokens.level = 350
+
+    with patch.dict("shared.llm_client.LLM_QUEUE_DEADLINE_S", {"background": 0.05}):
+        with pytest.raises(LLMError, match="deadline"):
+            await sched.acquire("background", 100)
+    await sched.acquire("interactive", 100)
+
+    assert sched_stats["background"]["expired"] == 1
+    assert sched_stats["interactive"]["granted"] == 1
+    assert sched.queues["background"] == type(sched.queues["background"])()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_queue_full_rejects(sched_stats):
+    """Очередь класса переполнена → LLMError сразу."""
+    sched = _ProviderScheduler("test", rpm=6, tpm=0)
+    sched.requests.level = 0
+    with patch.dict("shared.llm_client.LLM_QUEUE_LIMIT", {"background": 1}):
+        waiting = asyncio.create_task(sched.acquire("background", 1))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMError, match="queue full"):
+            await sched.acquire("background", 1)
+    waiting.cancel()
+    assert sched_stats["background"]["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_scheduler_settle_adjusts_tokens():
+    """Фактический usage больше оценки — бюджет уходит в долг."""
+    sched = _ProviderScheduler("test", rpm=0, tpm=600)
+    await sched.acquire("interactive", 100)
+    sched.settle(estimated=100, actual=400)
+    assert sched.tokens.level == pytest.approx(200, abs=1)
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client._gpt_client")
+async def test_call_gpt_uses_context_priority(mock_client, sched_stats):
+    """Класс вызова берётся из llm_priority; без метки — background."""
+    from shared.llm_client import llm_priority
+
+    mock_client.chat.completions.create = AsyncMock(return_value=make_gpt_response("ok"))
+
+    @llm_priority("interactive")
+    async def dialog():
+        return await call_gpt(messages=[{"role": "user", "content": "?"}])
+
+    await dialog()
+    await call_gpt(messages=[{"role": "user", "content": "?"}])
+
+    assert sched_stats["interactive"]["granted"] == 1
+    assert sched_stats["background"]["granted"] == 1
+
+
+# ===========================================================================
+# Circuit breaker
+# ===========================================================================
+
+
+def _api_error(msg="down"):
+    return openai.APIError(message=msg, request=MagicMock(), body=None)
+
+
+@pytest.fixture
+def small_breaker():
+    """Маленькое окно: открывается после 3 вызовов, открыт 50 мс."""
+    with patch("shared.llm_client.BREAKER_MIN_CALLS", 3), \
+            patch("shared.llm_client.BREAKER_OPEN_S", 0.05), \
+            patch("shared.llm_client.BREAKER_PROBES", 2):
+        yield
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client.asyncio.sleep", new_callable=AsyncMock)
+@patch("shared.llm_client._gpt_client")
+async def test_breaker_opens_and_fails_fast(mock_client, mock_sleep, small_breaker):
+    """Ошибки в окне открывают breaker: ретраи обрываются, следующий вызов — без API."""
+    from shared.llm_client import CircuitOpenError, get_breaker_stats
+
+    mock_client.chat.completions.create = AsyncMock(side_effect=_api_error())
+
+    with pytest.raises(LLMError):
+        await call_gpt(messages=[{"role": "user", "content": "?"}])
+    with pytest.raises(LLMError):
+        await call_gpt(messages=[{"role": "user", "content": "?"}])
+    # 3 попытки первого вызова + 0 у второго: на третьей ошибке breaker открылся
+    assert mock_client.chat.completions.create.await_count == 3
+
+    with pytest.raises(CircuitOpenError):
+        await call_gpt(messages=[{"role": "user", "content": "?"}])
+    stats = get_breaker_stats()["openai:gpt-4o-mini"]
+    assert stats["state"] == "open"
+    assert stats["opened"] == 1
+    assert stats["rejected"] == 2
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client._claude_client")
+async def test_breaker_open_claude_returns_fallback(mock_client, small_breaker):
+    """Открытый breaker: call_claude сразу отдаёт fallback, без fallback — CircuitOpenError."""
+    from shared import llm_client
+    from shared.llm_client import CircuitOpenError
+
+    llm_client._breaker("claude", llm_client.CLAUDE_MODEL)._open()
+    mock_client.messages.create = AsyncMock(return_value=make_claude_response())
+
+    assert await call_claude([{"role": "user", "content": "?"}], "s") == FALLBACK_RESPONSE
+    with pytest.raises(CircuitOpenError):
+        await call_claude([{"role": "user", "content": "?"}], "s", fallback=False)
+    mock_client.messages.create.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_breaker_half_open_probes_close(small_breaker):
+    """После BREAKER_OPEN_S — пробы; BREAKER_PROBES успехов закрывают breaker."""
+    from shared.llm_client import CircuitOpenError, _CircuitBreaker
+
+    b = _CircuitBreaker("test")
+    b._open()
+    with pytest.raises(CircuitOpenError):
+        b.check()
+    await asyncio.sleep(0.06)
+
+    with b.guard():
+        assert b.state == "half_open"
+        # Пока одна проба в полёте — вторая пропускается, третья уже нет
+        with b.guard():
+            with pytest.raises(CircuitOpenError):
+                b.check()
+    assert b.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_breaker_probe_failure_reopens(small_breaker):
+    from shared.llm_client import _CircuitBreaker
+
+    b = _CircuitBreaker("test")
+    b._open()
+    await asyncio.sleep(0.06)
+    with pytest.raises(openai.APIError):
+        with b.guard():
+            raise _api_error()
+    assert b.state == "open"
+    assert b.opened_count == 2
+
+
+def test_breaker_slow_calls_open(small_breaker):
+    """Доля медленных вызовов выше порога тоже открывает breaker."""
+    from shared.llm_client import _CircuitBreaker
+
+    b = _CircuitBreaker("test")
+    with patch("shared.llm_client.BREAKER_SLOW_CALL_S", 0.0):
+        for _ in range(3):
+            with b.guard():
+                pass
+    assert b.state == "open"
+
+
+def test_breaker_cancellation_is_neutral(small_breaker):
+    """Отмена (проигравший hedge) не считается отказом провайдера."""
+    from shared.llm_client import _CircuitBreaker
+
+    b = _CircuitBreaker("test")
+    for _ in range(5):
+        with pytest.raises(asyncio.CancelledError):
+            with b.guard():
+                raise asyncio.CancelledError()
+    assert b.state == "closed"
+    assert b.window_stats()["calls"] == 0
+
+
+def test_breaker_listener_notified(small_breaker):
+    from shared import llm_client
+    from shared.llm_client import _CircuitBreaker, add_breaker_listener
+
+    events = []
+
+    def listener(name, state, info):
+        events.append((name, state, info["from"]))
+
+    add_breaker_listener(listener)
+    try:
+        b = _CircuitBreaker("test")
+        for _ in range(3):
+            with pytest.raises(LLMError):
+                with b.guard():
+                    raise LLMError("x")
+    finally:
+        llm_client._breaker_listeners.remove(listener)
+    assert events == [("test", "open", "closed")]
+
+
+# ===========================================================================
+# Кэш ответов call_gpt
+# ===========================================================================
+
+
+@pytest.fixture
+def llm_cache():
+    """Чистый LRU; SQLite-уровень — словарь вместо таблицы."""
+    from shared import llm_client
+
+    llm_client._response_cache.clear()
+    rows = {}
+
+    async def get(key, now):
+        row = rows.get(key)
+        return row if row and row[1] > now else None
+
+    async def put(key, site, model, value, expires_at):
+        rows[key] = (value, expires_at)
+
+    with patch("shared.llm_client.database") as db, \
+            patch.dict("shared.llm_client.LLM_CACHE_TTL_S", {"site": 60}, clear=True):
+        db.get_llm_cache = AsyncMock(side_effect=get)
+        db.put_llm_cache = AsyncMock(side_effect=put)
+        db.prune_llm_cache = AsyncMock()
+        yield rows
+    llm_client._response_cache.clear()
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client._gpt_client")
+async def test_cache_hit_skips_api(mock_client, llm_cache):
+    """Повтор того же запроса с cache= — без вызова API; другой промпт — промах."""
+    from shared.llm_client import get_cache_stats
+
+    mock_client.chat.completions.create = AsyncMock(return_value=make_gpt_response("{}"))
+    msgs = [{"role": "user", "content": "шаги для цели"}]
+
+    assert await call_gpt(messages=msgs, cache="site") == "{}"
+    assert await call_gpt(messages=msgs, cache="site") == "{}"
+    await call_gpt(messages=[{"role": "user", "content": "другое"}], cache="site")
+
+    assert mock_client.chat.completions.create.await_count == 2
+    site = get_cache_stats()["sites"]["site"]
+    assert site["memory_hits"] == 1 and site["misses"] == 2
+    assert site["hit_rate"] == pytest.approx(0.333, abs=0.001)
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client._gpt_client")
+async def test_cache_survives_memory_eviction(mock_client, llm_cache):
+    """Вытесненное из LRU читается из SQLite и снова попадает в память."""
+    from shared import llm_client
+
+    mock_client.chat.completions.create = AsyncMock(return_value=make_gpt_response("ok"))
+    llm_client._response_cache._mem.clear()
+    await call_gpt(messages=[{"role": "user", "content": "a"}], cache="site")
+    llm_client._response_cache._mem.clear()
+
+    assert await call_gpt(messages=[{"role": "user", "content": "a"}], cache="site") == "ok"
+    assert mock_client.chat.completions.create.await_count == 1
+    assert llm_client._response_cache.stats["site"]["db_hits"] == 1
+    assert len(llm_client._response_cache._mem) == 1
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client._gpt_client")
+async def test_cache_opt_in_only(mock_client, llm_cache):
+    """Без cache= (диалог) и для места без TTL — всегда запрос к API."""
+    mock_client.chat.completions.create = AsyncMock(return_value=make_gpt_response("ok"))
+    msgs = [{"role": "user", "content": "привет"}]
+
+    for _ in range(2):
+        await call_gpt(messages=msgs, model_override="gpt-4.1-mini")
+        await call_gpt(messages=msgs, cache="unknown_site")
+
+    assert mock_client.chat.completions.create.await_count == 4
+    assert llm_cache == {}
+
+
+def test_cache_lru_bound():
+    from shared.llm_client import _ResponseCache
+
+    cache = _ResponseCache(size=2)
+    for key in ("a", "b", "c"):
+        cache._remember(key, 1e12, key)
+    assert list(cache._mem) == ["b", "c"]
+    assert cache.evictions == 1
+
+
+@pytest.mark.asyncio
+@patch("shared.llm_client._gpt_client")
+async def test_metrics_recorded_per_provider(mock_client):
+    """Латентность, исход и токены пишутся в метрики по провайдеру и модели."""
+    from shared import llm_client
+
+    mock_client.chat.completions.create = AsyncMock(return_value=make_gpt_response("ok"))
+    labels = ("openai", llm_client.GPT_MODEL)
+    before_ok = llm_client._LLM_REQUESTS.value(*labels, "ok")
+    before_in = llm_client._LLM_TOKENS.value(*labels, "input")
+    before_n = llm_client._LLM_SECONDS.count(*labels)
+
+    await call_gpt(messages=[{"role": "user", "content": "?"}])
+
+    assert llm_client._LLM_REQUESTS.value(*labels, "ok") == before_ok + 1
+    assert llm_client._LLM_TOKENS.value(*labels, "input") == before_in + 100
+    assert llm_client._LLM_SECONDS.count(*labels) == before_n + 1
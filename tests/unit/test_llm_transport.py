@@ -0,0 +1,144 @@
+"""Тесты shared/llm_transport.py — synthetic / record / replay без сети."""
+
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from bot.prompts.memory_prompts import (
+    CRISIS_VERIFICATION_PROMPT,
+    GOAL_STEPS_PROMPT,
+    PHASE_EVALUATION_PROMPT,
+)
+from shared import llm_transport
+from shared.llm_client import call_claude, call_gpt, stream_claude, stream_gpt
+from shared.models import PhaseEvaluation
+
+
+@pytest.fixture(autouse=True)
+def no_delay():
+    """Задержки транспорта в тестах не нужны."""
+    with patch("shared.llm_transport.LLM_LATENCY_SCALE", 0):
+        yield
+
+
+def _patch_clients(clients):
+    claude, gpt, _ = clients
+    return patch.multiple("shared.llm_client", _claude_client=claude, _gpt_client=gpt)
+
+
+# ---------------------------------------------------------------------------
+# synthetic
+# ---------------------------------------------------------------------------
+
+
+def test_synthetic_json_matches_prompt():
+    """json_object: формат подбирается по шаблону промпта."""
+    fmt = {"type": "json_object"}
+
+    phase = PHASE_EVALUATION_PROMPT.format(
+        current_phase="ЗНАКОМСТВО", transition_criteria="-", recent_messages="-",
+    )
+    PhaseEvaluation(**json.loads(
+        llm_transport.synthetic_text(None, [{"role": "user", "content": phase}], fmt, 300)
+    ))
+
+    steps = GOAL_STEPS_PROMPT.format(goal_title="бегать", context="-")
+    data = json.loads(
+        llm_transport.synthetic_text(None, [{"role": "user", "content": steps}], fmt, 500)
+    )
+    assert 3 <= len(data["steps"]) <= 7
+
+    crisis = CRISIS_VERIFICATION_PROMPT.format(text="-", trigger="-")
+    data = json.loads(
+        llm_transport.synthetic_text(None, [{"role": "user", "content": crisis}], fmt, 100)
+    )
+    assert data["is_real_crisis"] is False
+
+
+def test_synthetic_json_schema():
+    schema = {
+        "type": "object",
+        "properties": {
+            "mood": {"enum": ["ok", "bad"]},
+            "score": {"type": "integer", "minimum": 1},
+            "tags": {"type": "array", "items": {"type": "string"}},
+        },
+    }
+    fmt = {"type": "json_schema", "json_schema": {"name": "x", "schema": schema}}
+    data = json.loads(llm_transport.synthetic_text(None, [], fmt, 100))
+    assert data == {"mood": "ok", "score": 1, "tags": ["текст"]}
+
+
+@pytest.mark.asyncio
+async def test_synthetic_clients_through_llm_client():
+    """call_*/stream_* работают поверх заглушек: тот же код, что и с API."""
+    with _patch_clients(llm_transport.offline_clients("synthetic")):
+        text = await call_claude([{"role": "user", "content": "привет"}], "system")
+        streamed = [d async for d in stream_claude([{"role": "user", "content": "привет"}], "s")]
+        gpt_streamed = [d async for d in stream_gpt([{"role": "user", "content": "привет"}], "s")]
+        raw = await call_gpt(
+            messages=[{"role": "user", "content": "?"}],
+            response_format={"type": "json_object"},
+        )
+
+    assert text and "".join(streamed) == text
+    assert "".join(gpt_streamed) == text
+    assert json.loads(raw) == {}
+
+
+# ---------------------------------------------------------------------------
+# record -> replay
+# ---------------------------------------------------------------------------
+
+
+def _real_gpt(text):
+    response = MagicMock()
+    response.choices = [MagicMock(message=MagicMock(content=text))]
+    response.usage = MagicMock(prompt_tokens=10, completion_tokens=5)
+    return SimpleNamespace(chat=SimpleNamespace(
+        completions=SimpleNamespace(create=AsyncMock(return_value=response)),
+    ))
+
+
+@pytest.mark.asyncio
+async def test_record_then_replay(tmp_path):
+    """Записанный ответ воспроизводится по тому же запросу; другой — синтетика."""
+    cassette = str(tmp_path / "cassette.jsonl")
+    msgs = [{"role": "user", "content": "шаги"}]
+
+    with patch("shared.llm_transport.LLM_CASSETTE", cassette):
+        claude = SimpleNamespace(messages=MagicMock())
+        recording = llm_transport.recording_clients(claude, _real_gpt('{"a": 1}'), None)
+        with _patch_clients(recording):
+            assert await call_gpt(messages=msgs, response_format={"type": "json_object"}) == '{"a": 1}'
+
+        lines = [json.loads(line) for line in open(cassette, encoding="utf-8")]
+        assert len(lines) == 1
+        assert lines[0]["text"] == '{"a": 1}'
+        assert "шаги" not in json.dumps(lines[0], ensure_ascii=False)  # промпт не пишется
+
+        with _patch_clients(llm_transport.offline_clients("replay")):
+            assert await call_gpt(messages=msgs, response_format={"type": "json_object"}) == '{"a": 1}'
+            assert await call_gpt(messages=[{"role": "user", "content": "иное"}]) != '{"a": 1}'
+
+    assert llm_transport._stats["replayed"] >= 1
+    assert llm_transport._stats["missed"] >= 1
+
+
+def test_replay_latency_from_recording(tmp_path):
+    """Промах кассеты берёт латентность из записанного распределения модели."""
+    cassette = llm_transport.Cassette(str(tmp_path / "c.jsonl"))
+    for ms in (100.0, 200.0):
+        cassette.append(llm_transport._entry(
+            f"k{ms}", "openai", "gpt-4o-mini", None, 100, "ok", 1, 1, ms, None,
+        ))
+    responder = llm_transport._Responder("replay", cassette)
+    answer = responder.answer("openai", "gpt-4o-mini", None, [{"content": "x"}], None, 100)
+    assert answer["latency_ms"] in (100.0, 200.0)
+
+
+def test_split_preserves_text():
+    text = "раз два три четыре пять шесть семь восемь девять десять"
+    assert "".join(llm_transport._split(text)) == text
@@ -0,0 +1,52 @@
+"""Тесты shared/metrics.py — счётчики, gauge, гистограммы, text format."""
+
+import pytest
+
+from shared import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Пустой реестр на время теста (модульные метрики не трогаем)."""
+    monkeypatch.setattr(metrics, "_registry", {})
+    return metrics._registry
+
+
+def test_counter_and_gauge_render(registry):
+    c = metrics.counter("x_total", "X", ("provider",))
+    c.inc("claude")
+    c.inc("claude", amount=2)
+    c.inc('a"b')
+    metrics.gauge("depth", "D", fn=lambda: 7)
+
+    text = metrics.render()
+    assert "# TYPE x_total counter" in text
+    assert 'x_total{provider="claude"} 3' in text
+    assert 'x_total{provider="a\\"b"} 1' in text
+    assert "depth 7" in text
+    assert text.endswith("\n")
+
+
+def test_histogram_cumulative_buckets(registry):
+    h = metrics.histogram("t_seconds", "T", ("fn",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        h.observe(value, "get_user")
+
+    lines = metrics.render().splitlines()
+    assert 't_seconds_bucket{fn="get_user",le="0.1"} 2' in lines  # le — включительно
+    assert 't_seconds_bucket{fn="get_user",le="1"} 3' in lines
+    assert 't_seconds_bucket{fn="get_user",le="+Inf"} 4' in lines
+    assert 't_seconds_count{fn="get_user"} 4' in lines
+    assert 't_seconds_sum{fn="get_user"} 5.65' in lines
+    assert h.count("get_user") == 4
+
+
+def test_register_is_idempotent(registry):
+    assert metrics.counter("a_total", "A") is metrics.counter("a_total", "A")
+    with pytest.raises(ValueError):
+        metrics.gauge("a_total", "A")
+
+
+def test_failing_gauge_fn_does_not_break_render(registry):
+    metrics.gauge("broken", "B", fn=lambda: 1 / 0)
+    assert "# TYPE broken gauge" in metrics.render()
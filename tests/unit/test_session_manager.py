@@ -16,15 +16,20 @@ from shared.safety import CRISIS_RESPONSE_LEVEL3, CRISIS_INSTRUCTION_LEVEL2
 
 @pytest.fixture(autouse=True)
 def clear_state():
-    """Reset module state before each test."""
+    """Reset module state before each test (без debounce-окна)."""
     from bot import session_manager
     session_manager._user_locks.clear()
     session_manager._rate_counters.clear()
     session_manager._consecutive_errors.clear()
-    yield
+    session_manager._inboxes.clear()
+    session_manager._inflight.clear()
+    with patch("bot.session_manager.COALESCE_WINDOW_S", 0):
+        yield
     session_manager._user_locks.clear()
     session_manager._rate_counters.clear()
     session_manager._consecutive_errors.clear()
+    session_manager._inboxes.clear()
+    session_manager._inflight.clear()
 
 
 # ---------------------------------------------------------------------------
@@ -136,7 +141,8 @@ class TestCorePipeline:
         mock_deps["call_claude"].assert_called_once()
         call_kwargs = mock_deps["call_claude"].call_args
         system_arg = call_kwargs.kwargs.get("system") or call_kwargs[1].get("system", "")
-        assert CRISIS_INSTRUCTION_LEVEL2 in system_arg
+        # Ситуативная инструкция — в последнем (волатильном) блоке
+        assert CRISIS_INSTRUCTION_LEVEL2 in system_arg[-1]
 
     @pytest.mark.asyncio
     async def test_new_user_plus_crisis_level3(self, mock_deps: dict) -> None:
@@ -266,6 +272,23 @@ class TestClaudeCall:
             ]
             assert len(alert_calls) >= 1
 
+    @pytest.mark.asyncio
+    async def test_backup_provider_failover(self, mock_deps: dict) -> None:
+        """DIALOG_BACKUP_PROVIDER: Claude упал → ответ backup-провайдера, Claude без FALLBACK_RESPONSE."""
+        from bot.session_manager import process_message
+        from shared.llm_client import LLMError
+
+        mock_deps["call_claude"].side_effect = LLMError("overloaded")
+        with (
+            patch("bot.session_manager.DIALOG_BACKUP_PROVIDER", "openai"),
+            patch("bot.session_manager.call_gpt", new_callable=AsyncMock, return_value="Ответ GPT") as mock_gpt,
+        ):
+            result = await process_message(111, 1, "привет", "Маша")
+
+        assert result == "Ответ GPT"
+        assert mock_deps["call_claude"].call_args.kwargs["fallback"] is False
+        assert mock_gpt.call_args.kwargs["system"] == "system prompt"
+
     @pytest.mark.asyncio
     async def test_errors_reset_on_success(self, mock_deps: dict) -> None:
         """#13: после ошибок успешный вызов сбрасывает счётчик."""
@@ -279,6 +302,221 @@ class TestClaudeCall:
         assert 111 not in _consecutive_errors
 
 
+# ===========================================================================
+# Стриминг ответа
+# ===========================================================================
+
+
+def _stream_of(*deltas, error=None):
+    """Фабрика для patch(stream_claude): async-генератор дельт, опционально с ошибкой."""
+    async def gen(*args, **kwargs):
+        for d in deltas:
+            yield d
+        if error is not None:
+            raise error
+    return gen
+
+
+class TestStreaming:
+    """Тесты on_delta: стрим ответа и fallback на обычный вызов."""
+
+    @pytest.mark.asyncio
+    async def test_on_delta_receives_accumulated_text(self, mock_deps: dict) -> None:
+        """on_delta получает накопленный текст, результат и запись — финальный ответ."""
+        from bot.session_manager import process_message
+
+        seen: list[str] = []
+
+        async def on_delta(text: str) -> None:
+            seen.append(text)
+
+        with patch("bot.session_manager.stream_claude", _stream_of("Привет", ", Маша!")):
+            result = await process_message(111, 1, "привет", "Маша", on_delta=on_delta)
+
+        assert seen == ["Привет", "Привет, Маша!"]
+        assert result == "Привет, Маша!"
+        mock_deps["call_claude"].assert_not_awaited()
+        assistant_calls = [c for c in mock_deps["add_message"].call_args_list if c.args[1] == "assistant"]
+        assert [c.args[2] for c in assistant_calls] == ["Привет, Маша!"]
+
+    @pytest.mark.asyncio
+    async def test_stream_fails_before_first_token_falls_back(self, mock_deps: dict) -> None:
+        """Стрим упал до первой дельты → обычный call_claude."""
+        from bot.session_manager import process_message
+        from shared.llm_client import LLMError
+
+        on_delta = AsyncMock()
+        with patch("bot.session_manager.stream_claude", _stream_of(error=LLMError("overloaded"))):
+            result = await process_message(111, 1, "привет", "Маша", on_delta=on_delta)
+
+        assert result == "Привет! Рада тебя слышать."
+        mock_deps["call_claude"].assert_awaited_once()
+        on_delta.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_stream_fails_midway_returns_fallback(self, mock_deps: dict) -> None:
+        """Обрыв после первой дельты → LLMError-ветка (fallback-ответ), без повторного вызова."""
+        from bot.session_manager import process_message, _FALLBACK_VARIANTS
+        from shared.llm_client import LLMError
+
+        on_delta = AsyncMock()
+        with patch("bot.session_manager.stream_claude", _stream_of("Нач", error=LLMError("reset"))):
+            result = await process_message(111, 1, "привет", "Маша", on_delta=on_delta)
+
+        assert result in _FALLBACK_VARIANTS
+        mock_deps["call_claude"].assert_not_awaited()
+
+
+# ===========================================================================
+# Склейка пачек сообщений
+# ===========================================================================
+
+
+class TestCoalescing:
+    """Пачка сообщений в окне / во время генерации → один ход."""
+
+    @pytest.mark.asyncio
+    async def test_burst_within_window_one_llm_call(self, mock_deps: dict) -> None:
+        """3 сообщения в окне → один call_claude, каждое сохранено и помечено отдельно."""
+        import asyncio
+        from bot.session_manager import process_message
+
+        with patch("bot.session_manager.COALESCE_WINDOW_S", 0.05):
+            results = await asyncio.gather(
+                process_message(111, 1, "привет", "Маша"),
+                process_message(111, 2, "слушай", "Маша"),
+                process_message(111, 3, "мне грустно", "Маша"),
+            )
+
+        assert results == [None, None, "Привет! Рада тебя слышать."]
+        assert mock_deps["call_claude"].await_count == 1
+        mock_deps["build_context"].assert_awaited_once_with(111, "привет\nслушай\nмне грустно")
+        user_texts = [c.args[2] for c in mock_deps["add_message"].call_args_list if c.args[1] == "user"]
+        assert user_texts == ["привет", "слушай", "мне грустно"]
+        marked = [c.args[0] for c in mock_deps["mark_message_processed"].call_args_list]
+        assert marked == [1, 2, 3]
+        sent = mock_deps["call_claude"].call_args.kwargs["messages"]
+        assert [m["content"] for m in sent[-3:]] == ["привет", "слушай", "мне грустно"]
+
+    @pytest.mark.asyncio
+    async def test_message_during_generation_cancels_obsolete(self, mock_deps: dict) -> None:
+        """Новое сообщение во время генерации → старый ход отменён, ответ один на оба."""
+        import asyncio
+        from bot.session_manager import process_message
+
+        started = asyncio.Event()
+
+        async def slow_then_fast(*args, **kwargs):
+            if not started.is_set():
+                started.set()
+                await asyncio.sleep(10)
+            return "Ответ на оба"
+
+        mock_deps["call_claude"].side_effect = slow_then_fast
+
+        first = asyncio.create_task(process_message(111, 1, "привет", "Маша"))
+        await started.wait()
+        second = await process_message(111, 2, "ты тут?", "Маша")
+
+        assert second == "Ответ на оба"
+        assert await first is None
+        assert mock_deps["call_claude"].await_count == 2
+        sent = mock_deps["call_claude"].call_args.kwargs["messages"]
+        assert [m["content"] for m in sent[-2:]] == ["привет", "ты тут?"]
+
+    @pytest.mark.asyncio
+    async def test_no_cancel_after_first_delta(self, mock_deps: dict) -> None:
+        """Ход, который уже стримит пользователю, не отменяется — второе сообщение ждёт."""
+        import asyncio
+        from bot.session_manager import process_message
+
+        streaming = asyncio.Event()
+        release = asyncio.Event()
+
+        def stream(*args, **kwargs):
+            async def gen():
+                yield "Начало. "
+                streaming.set()
+                await release.wait()
+                yield "Конец."
+            return gen()
+
+        with patch("bot.session_manager.stream_claude", side_effect=stream):
+            first = asyncio.create_task(
+                process_message(111, 1, "привет", "Маша", on_delta=AsyncMock()),
+            )
+            await streaming.wait()
+            second = asyncio.create_task(process_message(111, 2, "ещё", "Маша"))
+            await asyncio.sleep(0.01)
+            release.set()
+            results = await asyncio.gather(first, second)
+
+        assert results[0] == "Начало. Конец."
+        assert results[1] == "Привет! Рада тебя слышать."
+
+    @pytest.mark.asyncio
+    async def test_cancel_disabled_queues_next_turn(self, mock_deps: dict) -> None:
+        """COALESCE_CANCEL_INFLIGHT=0: текущий ход доживает, следующее — своим ходом."""
+        import asyncio
+        from bot.session_manager import process_message
+
+        started = asyncio.Event()
+
+        async def slow_first(*args, **kwargs):
+            if not started.is_set():
+                started.set()
+                await asyncio.sleep(0.05)
+                return "Первый"
+            return "Второй"
+
+        mock_deps["call_claude"].side_effect = slow_first
+
+        with patch("bot.session_manager.COALESCE_CANCEL_INFLIGHT", False):
+            first = asyncio.create_task(process_message(111, 1, "привет", "Маша"))
+            await started.wait()
+            second = await process_message(111, 2, "ты тут?", "Маша")
+
+        assert await first == "Первый"
+        assert second == "Второй"
+
+    @pytest.mark.asyncio
+    async def test_batch_crossing_tenth_message_triggers_update(self, mock_deps: dict) -> None:
+        """Пачка перешагнула кратное 10 → needs_full_update=1."""
+        import asyncio
+        from bot.session_manager import process_message
+
+        mock_deps["get_user"].return_value = {
+            "messages_total": 9, "current_phase": "ЗНАКОМСТВО", "last_message_at": None,
+        }
+        with (
+            patch("bot.session_manager.COALESCE_WINDOW_S", 0.02),
+            patch("bot.session_manager.asyncio.create_task", side_effect=lambda coro: coro.close()),
+        ):
+            await asyncio.gather(
+                process_message(111, 1, "раз", "Маша"),
+                process_message(111, 2, "два", "Маша"),
+            )
+
+        kwargs = mock_deps["update_user"].call_args.kwargs
+        assert kwargs["messages_total"] == 11
+        assert kwargs["needs_full_update"] == 1
+
+    @pytest.mark.asyncio
+    async def test_turn_trace_has_step_spans(self, mock_deps: dict) -> None:
+        """Ход пишет трассу по message_id со спанами шагов и коммита."""
+        from bot.session_manager import process_message
+        from shared import tracing
+
+        await process_message(111, 4242, "привет", "Маша")
+
+        tr = tracing._traces[-1]
+        assert (tr.message_id, tr.telegram_id, tr.error) == (4242, 111, None)
+        names = [s[0] for s in tr.spans]
+        for step in ("get_user", "crisis", "build_context", "dialog", "update_counters", "db_commit"):
+            assert step in names
+        assert tr.total_ms >= max(s[2] for s in tr.spans)
+
+
 # ===========================================================================
 # UX
 # ===========================================================================
@@ -349,7 +587,7 @@ class TestUX:
         mock_deps["call_claude"].assert_called_once()
         call_kwargs = mock_deps["call_claude"].call_args
         system_arg = call_kwargs.kwargs.get("system") or call_kwargs[1].get("system", "")
-        assert "кризисном" in system_arg
+        assert "кризисном" in system_arg[-1]
 
 
 # ===========================================================================
@@ -394,6 +632,28 @@ class TestBackgroundTasks:
             # Должен быть только 1 create_task — для mini_memory_update
             assert mock_create_task.call_count == 1
 
+    @pytest.mark.asyncio
+    async def test_degraded_turn_skips_background_and_trims(self, mock_deps: dict) -> None:
+        """Деградация 2: без phase check / memory update, короче история и ответ."""
+        from bot.session_manager import process_message
+
+        mock_deps["get_user"].return_value = {
+            "messages_total": 9,
+            "current_phase": "ЗНАКОМСТВО",
+            "last_message_at": None,
+        }
+
+        with (
+            patch("shared.degradation.level", return_value=2),
+            patch("bot.session_manager.asyncio.create_task", side_effect=lambda coro: coro.close()) as mock_create_task,
+        ):
+            await process_message(111, 1, "привет", "Маша")
+
+        assert mock_create_task.call_count == 1  # только mini_memory_update
+        assert mock_deps["update_user"].call_args.kwargs["needs_full_update"] == 1
+        assert mock_deps["get_recent_messages"].call_args.kwargs["limit"] == 7
+        assert mock_deps["call_claude"].call_args.kwargs["max_tokens"] == 300
+
 
 # ===========================================================================
 # Mini memory update
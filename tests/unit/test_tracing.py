@@ -0,0 +1,79 @@
+"""Тесты shared/tracing.py — спаны, буфер трасс, перцентили."""
+
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from shared import tracing
+from shared.tracing import get_step_percentiles, get_trace_stats, span, trace
+
+
+@pytest.fixture(autouse=True)
+def clear_traces():
+    tracing._traces.clear()
+    yield
+    tracing._traces.clear()
+
+
+def test_span_outside_trace_is_noop():
+    with span("crisis"):
+        pass
+    assert get_trace_stats() == {}
+
+
+@pytest.mark.asyncio
+async def test_trace_collects_spans_and_errors():
+    """Спаны вложенных вызовов — в трассу; исключение шага помечает ok=False."""
+    async with trace(7, 111) as tr:
+        with span("crisis"):
+            pass
+        with pytest.raises(ValueError):
+            with span("build_context"):
+                raise ValueError
+        async with trace(8, 111) as inner:  # вложенный — та же трасса
+            with span("dialog"):
+                pass
+
+    assert inner is tr
+    assert [(s[0], s[3]) for s in tr.spans] == [
+        ("crisis", True), ("build_context", False), ("dialog", True),
+    ]
+    assert tracing.recent_traces()[0]["message_id"] == 7
+
+    with span("late"):  # после завершения хода спаны не дописываются
+        pass
+    assert len(tr.spans) == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_trace_recorded_not_persisted():
+    save = AsyncMock()
+    with (
+        patch("shared.tracing.TRACE_PERSIST", True),
+        patch("bot.memory.database.save_message_trace", save),
+    ):
+        with pytest.raises(RuntimeError):
+            async with trace(1, 111):
+                raise RuntimeError
+        async with trace(2, 111):
+            with span("crisis"):
+                pass
+
+    assert get_trace_stats()["errors"] == 1
+    save.assert_awaited_once()
+    assert save.await_args.args[0] == 2
+
+
+@pytest.mark.asyncio
+async def test_step_percentiles():
+    for i in range(1, 101):
+        async with trace(i, 111) as tr:
+            pass
+        tr.spans.append(("dialog", 0.0, float(i), True))
+
+    steps = get_step_percentiles()
+    assert steps["dialog"]["count"] == 100
+    assert steps["dialog"]["p50"] == 51.0
+    assert steps["dialog"]["p95"] == 96.0
+    assert steps["dialog"]["max"] == 100.0
+    assert "total" in steps
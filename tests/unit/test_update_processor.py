@@ -0,0 +1,190 @@
+"""Тесты bot.update_processor — параллельность между юзерами, порядок внутри юзера."""
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from telegram import Chat, Message, Update, User
+
+from bot.update_processor import PerUserUpdateProcessor, release_turn
+
+
+def make_update(user_id: int, update_id: int = 1) -> Update:
+    """Настоящий Update с текстовым сообщением от user_id."""
+    message = Message(
+        message_id=update_id,
+        date=datetime.now(timezone.utc),
+        chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, first_name="Маша", is_bot=False),
+        text="привет",
+    )
+    return Update(update_id=update_id, message=message)
+
+
+async def _dispatch(processor: PerUserUpdateProcessor, items: list[tuple[Update, object]]) -> None:
+    """Как Application: задача на апдейт, в порядке прихода."""
+    tasks = [asyncio.create_task(processor.process_update(u, c)) for u, c in items]
+    await asyncio.gather(*tasks)
+
+
+@pytest.mark.asyncio
+async def test_same_user_strictly_ordered() -> None:
+    """Апдейты одного юзера выполняются последовательно и в порядке прихода."""
+    processor = PerUserUpdateProcessor(max_concurrent=8, max_pending=64)
+    log: list[str] = []
+
+    async def handler(name: str, delay: float) -> None:
+        log.append(f"start {name}")
+        await asyncio.sleep(delay)
+        log.append(f"end {name}")
+
+    await _dispatch(processor, [
+        (make_update(111, 1), handler("a", 0.03)),
+        (make_update(111, 2), handler("b", 0.0)),
+        (make_update(111, 3), handler("c", 0.01)),
+    ])
+
+    assert log == ["start a", "end a", "start b", "end b", "start c", "end c"]
+    assert processor.stats()["processed"] == 3
+
+
+@pytest.mark.asyncio
+async def test_different_users_run_concurrently() -> None:
+    """Медленный хэндлер одного юзера не блокирует другого."""
+    processor = PerUserUpdateProcessor(max_concurrent=8, max_pending=64)
+    finished: list[int] = []
+
+    async def handler(user_id: int, delay: float) -> None:
+        await asyncio.sleep(delay)
+        finished.append(user_id)
+
+    await _dispatch(processor, [
+        (make_update(111, 1), handler(111, 0.1)),
+        (make_update(222, 2), handler(222, 0.0)),
+    ])
+
+    assert finished == [222, 111]
+
+
+@pytest.mark.asyncio
+async def test_global_cap_and_waiting_user_holds_no_slot() -> None:
+    """Не больше max_concurrent хэндлеров; апдейт в очереди юзера слот не занимает."""
+    processor = PerUserUpdateProcessor(max_concurrent=2, max_pending=64)
+    running = 0
+    peak = 0
+    order: list[int] = []
+
+    async def handler(user_id: int, delay: float) -> None:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        order.append(user_id)
+        await asyncio.sleep(delay)
+        running -= 1
+
+    await _dispatch(processor, [
+        (make_update(111, 1), handler(111, 0.05)),
+        (make_update(111, 2), handler(111, 0.0)),  # ждёт очереди 111
+        (make_update(222, 3), handler(222, 0.0)),  # занимает второй слот сразу
+        (make_update(333, 4), handler(333, 0.0)),
+    ])
+
+    assert peak == 2
+    assert order.index(222) < order.index(111, 1)
+    stats = processor.stats()
+    assert stats["running"] == 0 and stats["pending"] == 0
+    assert stats["active_users"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stats_reports_queue_depth() -> None:
+    """stats() видит ждущие апдейты и глубину очереди юзера."""
+    processor = PerUserUpdateProcessor(max_concurrent=4, max_pending=64)
+    gate = asyncio.Event()
+
+    async def blocked() -> None:
+        await gate.wait()
+
+    async def noop() -> None:
+        return None
+
+    tasks = [
+        asyncio.create_task(processor.process_update(make_update(111, 1), blocked())),
+        asyncio.create_task(processor.process_update(make_update(111, 2), noop())),
+        asyncio.create_task(processor.process_update(make_update(111, 3), noop())),
+    ]
+    await asyncio.sleep(0)
+
+    stats = processor.stats()
+    assert stats["running"] == 1
+    assert stats["pending"] == 2
+    assert stats["max_user_depth"] == 3
+
+    gate.set()
+    await asyncio.gather(*tasks)
+    assert processor.stats()["max_pending_seen"] == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiting_update_releases_state() -> None:
+    """Отмена апдейта в очереди: счётчики и очередь юзера корректны, следующий идёт."""
+    processor = PerUserUpdateProcessor(max_concurrent=4, max_pending=64)
+    gate = asyncio.Event()
+    done: list[int] = []
+
+    async def first() -> None:
+        await gate.wait()
+        done.append(1)
+
+    async def never() -> None:
+        done.append(2)
+
+    async def third() -> None:
+        done.append(3)
+
+    t1 = asyncio.create_task(processor.process_update(make_update(111, 1), first()))
+    t2 = asyncio.create_task(processor.process_update(make_update(111, 2), never()))
+    t3 = asyncio.create_task(processor.process_update(make_update(111, 3), third()))
+    await asyncio.sleep(0)
+    t2.cancel()
+    gate.set()
+    await asyncio.gather(t1, t3)
+    with pytest.raises(asyncio.CancelledError):
+        await t2
+
+    assert done == [1, 3]
+    assert processor.stats()["pending"] == 0
+    assert processor.stats()["active_users"] == 0
+
+
+@pytest.mark.asyncio
+async def test_release_turn_lets_next_update_start() -> None:
+    """release_turn() пускает следующий апдейт юзера до конца текущего."""
+    processor = PerUserUpdateProcessor(max_concurrent=8, max_pending=64)
+    log: list[str] = []
+
+    async def first() -> None:
+        log.append("start 1")
+        release_turn()
+        await asyncio.sleep(0.02)
+        log.append("end 1")
+
+    async def second() -> None:
+        log.append("start 2")
+
+    await _dispatch(processor, [
+        (make_update(111, 1), first()),
+        (make_update(111, 2), second()),
+    ])
+
+    assert log == ["start 1", "start 2", "end 1"]
+
+
+def test_release_turn_outside_processor_is_noop() -> None:
+    release_turn()
+
+
+def test_invalid_concurrency() -> None:
+    with pytest.raises(ValueError):
+        PerUserUpdateProcessor(max_concurrent=0, max_pending=10)